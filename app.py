@@ -1,40 +1,84 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from config.settings import Config
 from routes import register_routes
+from services.ia import start_ia_client, close_ia_client
+from services.jobs import job_manager
+from services.payments import start_stripe_client, close_stripe_client
+from services.database import start_supabase_client, close_supabase_client
+from services.stripe_events import stripe_event_worker
+from services.catalog import price_catalog
+from utils.log import setup_logging, RequestIdMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Démarrage / arrêt des ressources partagées de l'application"""
+    await start_ia_client()
+    start_stripe_client()
+    await start_supabase_client()
+    await job_manager.start()
+    await stripe_event_worker.start()
+    await price_catalog.start()
+    try:
+        yield
+    finally:
+        await price_catalog.stop()
+        await stripe_event_worker.stop()
+        await job_manager.stop()
+        await close_stripe_client()
+        await close_supabase_client()
+        await close_ia_client()
+
 
 def create_app():
     """Factory function pour créer l'application FastAPI"""
     
+    setup_logging()
+    
     app = FastAPI(
         title="API PENSAGA",
         description="API pour PENSAGA",
-        version="1.0.0"
+        version="1.0.0",
+        lifespan=lifespan
     )
     
     try:
         Config.validate()
     except ValueError as e:
-        print(f"Erreur de configuration: {e}")
-        print("Assurez-vous d'avoir créé un fichier .env avec les variables nécessaires")
+        logger.error("Erreur de configuration: %s", e)
+        logger.error("Assurez-vous d'avoir créé un fichier .env avec les variables nécessaires")
     
     # Configuration CORS
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
         allow_credentials=True,
-        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        allow_headers=["Content-Type", "Authorization"],
+        allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+        allow_headers=["Content-Type", "Authorization", "X-Request-ID", "Idempotency-Key"],
+        expose_headers=["X-Request-ID"],
     )
     
+    # Identifiant de requête (en-tête X-Request-ID) repris dans les logs
+    app.add_middleware(RequestIdMiddleware)
+    
     # Enregistrer les routes
     register_routes(app)
     
     # Gestionnaires d'erreurs
     @app.exception_handler(404)
     async def not_found_handler(request: Request, exc):
+        # Ressource introuvable (histoire, job...) : le message de la route est conservé
+        if getattr(exc, "detail", None) != "Not Found":
+            return await http_exception_handler(request, exc)
         return JSONResponse(
             status_code=404,
             content={
@@ -0,0 +1,7 @@
+"""
+Banc de charge de l'API
+
+Les serveurs de bench.fakes remplacent Ollama, Stripe et Supabase
+(PostgREST) en local ; bench.run lance l'application contre eux et mesure
+latence, débit et retard de la boucle asyncio par endpoint.
+"""
@@ -0,0 +1,5 @@
+from .ollama import create_ollama_app, OllamaSettings
+from .stripe_api import create_stripe_app
+from .postgrest import create_postgrest_app
+
+__all__ = ['create_ollama_app', 'OllamaSettings', 'create_stripe_app', 'create_postgrest_app']
@@ -0,0 +1,86 @@
+"""
+Lance les trois faux serveurs dans un même processus
+
+    python -m bench.fakes --token-rate 80 --first-token 0.3 --failure-rate 0.01
+"""
+import argparse
+import asyncio
+import signal
+
+import uvicorn
+
+from . import create_ollama_app, create_postgrest_app, create_stripe_app, OllamaSettings
+from .postgrest import PENSAGA_FUNCTIONS
+
+
+class _Server(uvicorn.Server):
+    """Serveur uvicorn sans gestion des signaux : un seul arrêt pour les trois serveurs"""
+
+    def install_signal_handlers(self) -> None:
+        pass
+
+
+def seed_users(count: int):
+    """Utilisateurs de test (table user_extend) : user-0 … user-<count-1>"""
+    return [
+        {"id": f"user-{i}", "token": 0, "has_subscription": False, "preferences": {}}
+        for i in range(count)
+    ]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Faux Ollama, Stripe et PostgREST pour le banc de charge")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ollama-port', type=int, default=11501)
+    parser.add_argument('--stripe-port', type=int, default=11502)
+    parser.add_argument('--postgrest-port', type=int, default=11503)
+    parser.add_argument('--token-rate', type=float, default=50.0, help="Tokens générés par seconde")
+    parser.add_argument('--first-token', type=float, default=0.2, help="Délai avant le premier token (s)")
+    parser.add_argument('--load-latency', type=float, default=0.0, help="Chargement du modèle au premier appel (s)")
+    parser.add_argument('--output-tokens', type=int, default=200, help="Longueur des réponses texte")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Part des appels Ollama en erreur")
+    parser.add_argument('--failure-status', type=int, default=500)
+    parser.add_argument('--stripe-latency', type=float, default=0.05)
+    parser.add_argument('--postgrest-latency', type=float, default=0.01)
+    parser.add_argument('--users', type=int, default=100, help="Lignes user_extend créées au démarrage")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    ollama = create_ollama_app(OllamaSettings(
+        token_rate=args.token_rate,
+        first_token_latency=args.first_token,
+        load_latency=args.load_latency,
+        output_tokens=args.output_tokens,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        seed=args.seed
+    ))
+    stripe_api = create_stripe_app(latency=args.stripe_latency)
+    postgrest = create_postgrest_app(
+        latency=args.postgrest_latency,
+        tables={"user_extend": seed_users(args.users)},
+        rpc=PENSAGA_FUNCTIONS
+    )
+    servers = [
+        _Server(uvicorn.Config(app, host=args.host, port=port, log_level="warning", access_log=False))
+        for app, port in (
+            (ollama, args.ollama_port),
+            (stripe_api, args.stripe_port),
+            (postgrest, args.postgrest_port),
+        )
+    ]
+
+    def shutdown() -> None:
+        for server in servers:
+            server.should_exit = True
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, shutdown)
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(parse_args()))
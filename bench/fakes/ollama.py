@@ -0,0 +1,163 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+
+_WORDS = (
+    "le héros traverse la ville sous une pluie fine tandis que son rival "
+    "observe depuis les toits et prépare une revanche dont personne ne "
+    "soupçonne encore l'ampleur ni le prix"
+).split()
+
+# Un token ≈ 4 caractères, comme l'estimation du registre de prompts
+_CHARS_PER_TOKEN = 4
+
+# Durées Ollama en nanosecondes
+_NS = 1_000_000_000
+
+# Intervalle minimal entre deux morceaux streamés : au-delà de ce débit, les
+# tokens sont regroupés pour ne pas mesurer le coût des sleep eux-mêmes
+_MIN_CHUNK_INTERVAL = 0.01
+
+
+class OllamaSettings:
+    """
+    Comportement du faux serveur Ollama
+
+    Args:
+        token_rate: Tokens générés par seconde
+        first_token_latency: Délai avant le premier token (évaluation du prompt)
+        load_latency: Chargement du modèle, ajouté au premier appel de chaque modèle
+        output_tokens: Longueur des réponses texte (bornée par num_predict)
+        failure_rate: Part des appels en erreur (0 à 1)
+        failure_status: Code HTTP des erreurs injectées
+        seed: Graine du tirage des erreurs (reproductibilité)
+    """
+
+    def __init__(
+        self,
+        token_rate: float = 50.0,
+        first_token_latency: float = 0.2,
+        load_latency: float = 0.0,
+        output_tokens: int = 200,
+        failure_rate: float = 0.0,
+        failure_status: int = 500,
+        seed: Optional[int] = None
+    ):
+        self.token_rate = token_rate
+        self.first_token_latency = first_token_latency
+        self.load_latency = load_latency
+        self.output_tokens = output_tokens
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.seed = seed
+
+
+def _character(index: int) -> Dict[str, Any]:
+    return {
+        "nom": f"Personnage {index + 1}",
+        "âge": str(20 + index * 7),
+        "apparence": "silhouette élancée, manteau sombre",
+        "personnalité": "déterminé mais secret",
+        "rôle": "allié" if index else "protagoniste"
+    }
+
+
+def _structured_output(schema: Any) -> str:
+    """Réponse conforme au schéma demandé (tableau de personnages ou objet)"""
+    if isinstance(schema, dict) and schema.get("type") == "array":
+        count = max(schema.get("minItems", 3), 1)
+        return json.dumps([_character(i) for i in range(count)], ensure_ascii=False)
+    if isinstance(schema, dict):
+        return json.dumps(_character(0), ensure_ascii=False)
+    return json.dumps({"response": " ".join(_WORDS[:8])}, ensure_ascii=False)
+
+
+def _text_tokens(count: int) -> List[str]:
+    return [f"{_WORDS[i % len(_WORDS)]} " for i in range(count)]
+
+
+def _tokens(body: Dict[str, Any], settings: OllamaSettings) -> List[str]:
+    if body.get("format") is not None:
+        text = _structured_output(body["format"])
+        return [text[i:i + _CHARS_PER_TOKEN] for i in range(0, len(text), _CHARS_PER_TOKEN)]
+    count = settings.output_tokens
+    num_predict = (body.get("options") or {}).get("num_predict")
+    if num_predict:
+        count = min(count, num_predict)
+    return _text_tokens(count)
+
+
+def create_ollama_app(settings: Optional[OllamaSettings] = None) -> FastAPI:
+    """Faux Ollama : /api/generate (streamé ou non) avec débit, latence et erreurs réglables"""
+    settings = settings or OllamaSettings()
+    rng = random.Random(settings.seed)
+    loaded = set()
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.calls = 0
+
+    def stats(body: Dict[str, Any], eval_count: int, load: float, started: float) -> Dict[str, Any]:
+        prompt_tokens = len(body.get("prompt", "")) // _CHARS_PER_TOKEN + 1
+        num_predict = (body.get("options") or {}).get("num_predict")
+        # Sortie coupée par num_predict, comme Ollama
+        truncated = body.get("format") is None and bool(num_predict) and settings.output_tokens > num_predict
+        return {
+            "model": body.get("model"),
+            "response": "",
+            "done": True,
+            "done_reason": "length" if truncated else "stop",
+            "total_duration": int((time.monotonic() - started) * _NS),
+            "load_duration": int(load * _NS),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(settings.first_token_latency * _NS),
+            "eval_count": eval_count,
+            "eval_duration": int(eval_count / settings.token_rate * _NS)
+        }
+
+    @app.get('/')
+    async def root():
+        return PlainTextResponse("Ollama is running")
+
+    @app.get('/api/tags')
+    async def tags():
+        return {"models": [{"name": model, "model": model} for model in sorted(loaded)]}
+
+    @app.post('/api/generate')
+    async def generate(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        if settings.failure_rate and rng.random() < settings.failure_rate:
+            return JSONResponse({"error": "erreur injectée"}, status_code=settings.failure_status)
+
+        started = time.monotonic()
+        load = 0.0
+        if body.get("model") not in loaded:
+            loaded.add(body.get("model"))
+            load = settings.load_latency
+        tokens = _tokens(body, settings)
+        await asyncio.sleep(load + settings.first_token_latency)
+
+        if not body.get("stream", True):
+            await asyncio.sleep(len(tokens) / settings.token_rate)
+            return {**stats(body, len(tokens), load, started), "response": "".join(tokens)}
+
+        per_chunk = max(1, int(settings.token_rate * _MIN_CHUNK_INTERVAL))
+
+        async def chunks():
+            for i in range(0, len(tokens), per_chunk):
+                group = tokens[i:i + per_chunk]
+                if i:
+                    await asyncio.sleep(len(group) / settings.token_rate)
+                yield json.dumps({"model": body.get("model"), "response": "".join(group), "done": False},
+                                 ensure_ascii=False) + "\n"
+            yield json.dumps(stats(body, len(tokens), load, started)) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    return app
@@ -0,0 +1,209 @@
+import asyncio
+import copy
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+
+# Paramètres de requête PostgREST qui ne sont pas des filtres
+_RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _coerce(raw: str, current: Any) -> Any:
+    """Convertit la valeur d'un filtre dans le type de la colonne comparée"""
+    if isinstance(current, bool):
+        return raw == "true"
+    if isinstance(current, (int, float)):
+        try:
+            return type(current)(raw)
+        except ValueError:
+            return float(raw)
+    return raw
+
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    op, _, raw = expression.partition(".")
+    value = row.get(column)
+    if op == "is":
+        return value is None if raw == "null" else value == (raw == "true")
+    if op == "in":
+        return str(value) in [item.strip('"') for item in raw.strip("()").split(",")]
+    if value is None:
+        return False
+    target = _coerce(raw, value)
+    return {
+        "eq": lambda: value == target,
+        "neq": lambda: value != target,
+        "gt": lambda: value > target,
+        "gte": lambda: value >= target,
+        "lt": lambda: value < target,
+        "lte": lambda: value <= target,
+    }.get(op, lambda: False)()
+
+
+def _select(row: Dict[str, Any], columns: str) -> Dict[str, Any]:
+    names = [name.strip() for name in columns.split(",") if name.strip()]
+    if not names or "*" in names:
+        return dict(row)
+    return {name: row.get(name) for name in names}
+
+
+def _user(tables: Dict[str, List[Dict[str, Any]]], user_id: Any) -> Dict[str, Any]:
+    user = next((row for row in tables.get("user_extend", []) if row.get("id") == user_id), None)
+    if user is None:
+        raise LookupError(f"Utilisateur introuvable: {user_id}")
+    return user
+
+
+def _increment_tokens(tables, params):
+    user = _user(tables, params["p_user_id"])
+    user["token"] = (user.get("token") or 0) + params["p_amount"]
+    return user["token"]
+
+
+def _set_subscription(tables, params):
+    user = _user(tables, params["p_user_id"])
+    preferences = dict(user.get("preferences") or {})
+    if params["p_subscription_id"] is None:
+        preferences.pop("stripe_subscription_id", None)
+    else:
+        preferences["stripe_subscription_id"] = params["p_subscription_id"]
+    user.update(has_subscription=params["p_subscription_id"] is not None, preferences=preferences)
+    return preferences
+
+
+def _apply_once(apply, payment_type, key):
+    """Registre stripe_applied_sessions : une session n'est appliquée qu'une fois"""
+    def function(tables, params):
+        ledger = tables.setdefault("stripe_applied_sessions", [])
+        if any(row["session_id"] == params["p_session_id"] for row in ledger):
+            return {"applied": False}
+        result = apply(tables, params)
+        ledger.append({
+            "session_id": params["p_session_id"],
+            "user_id": str(params["p_user_id"]),
+            "type": payment_type,
+            "token_amount": params.get("p_amount"),
+            "subscription_id": params.get("p_subscription_id")
+        })
+        return {"applied": True, key: result}
+    return function
+
+
+# Fonctions SQL des migrations supabase/ (même comportement, en mémoire)
+PENSAGA_FUNCTIONS = {
+    "increment_tokens": _increment_tokens,
+    "set_subscription": _set_subscription,
+    "apply_token_pack": _apply_once(_increment_tokens, "token_pack", "token"),
+    "apply_subscription": _apply_once(_set_subscription, "subscription", "preferences"),
+}
+
+
+def create_postgrest_app(
+    latency: float = 0.01,
+    tables: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    rpc: Optional[Dict[str, Callable[[Dict[str, List[Dict[str, Any]]], Dict[str, Any]], Any]]] = None
+) -> FastAPI:
+    """
+    Faux PostgREST (Supabase /rest/v1) : tables en mémoire
+
+    Gère select, filtres (eq, neq, gt, gte, lt, lte, in, is), order, limit,
+    insert, upsert (Prefer: resolution=merge-duplicates), update et delete.
+
+    Args:
+        latency: Délai ajouté à chaque appel (aller-retour vers Supabase)
+        tables: Données initiales par table
+        rpc: Fonctions appelables via /rest/v1/rpc/<nom>, reçoivent les
+            tables et les paramètres JSON
+    """
+    app = FastAPI()
+    data: Dict[str, List[Dict[str, Any]]] = copy.deepcopy(tables or {})
+    functions = dict(rpc or {})
+    app.state.tables = data
+    app.state.calls = 0
+
+    def filtered(table: str, request: Request) -> List[Dict[str, Any]]:
+        rows = data.setdefault(table, [])
+        for column, expression in request.query_params.multi_items():
+            if column not in _RESERVED:
+                rows = [row for row in rows if _matches(row, column, expression)]
+        return rows
+
+    def represent(request: Request, rows: List[Dict[str, Any]], status_code: int = 200) -> Response:
+        if "return=representation" not in request.headers.get("prefer", ""):
+            return Response(status_code=204)
+        columns = request.query_params.get("select", "*")
+        return JSONResponse([_select(row, columns) for row in rows], status_code=status_code)
+
+    @app.middleware("http")
+    async def simulate_network(request: Request, call_next):
+        app.state.calls += 1
+        await asyncio.sleep(latency)
+        return await call_next(request)
+
+    @app.post('/rest/v1/rpc/{name}')
+    async def call_rpc(name: str, request: Request):
+        function = functions.get(name)
+        if function is None:
+            return JSONResponse({"code": "PGRST202", "message": f"Could not find the function public.{name}"},
+                                status_code=404)
+        body = await request.body()
+        try:
+            return JSONResponse(function(data, await request.json() if body else {}))
+        except LookupError as e:
+            # Équivalent de l'erreur P0002 levée par les fonctions SQL
+            return JSONResponse({"code": "P0002", "message": str(e)}, status_code=404)
+
+    @app.get('/rest/v1/{table}')
+    async def select(table: str, request: Request):
+        rows = filtered(table, request)
+        order = request.query_params.get("order")
+        if order:
+            for part in reversed(order.split(",")):
+                column, _, direction = part.partition(".")
+                rows = sorted(rows, key=lambda row: (row.get(column) is None, row.get(column)),
+                              reverse=direction.startswith("desc"))
+        offset = int(request.query_params.get("offset", 0))
+        limit = request.query_params.get("limit")
+        rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+        columns = request.query_params.get("select", "*")
+        return JSONResponse([_select(row, columns) for row in rows])
+
+    @app.post('/rest/v1/{table}')
+    async def insert(table: str, request: Request):
+        body = await request.json()
+        rows = body if isinstance(body, list) else [body]
+        existing = data.setdefault(table, [])
+        upsert = "resolution=merge-duplicates" in request.headers.get("prefer", "")
+        keys = request.query_params.get("on_conflict", "id").split(",")
+        written = []
+        for row in rows:
+            match = None
+            if upsert:
+                match = next((current for current in existing
+                              if all(current.get(key) == row.get(key) for key in keys)), None)
+            if match is not None:
+                match.update(row)
+                written.append(match)
+            else:
+                existing.append(dict(row))
+                written.append(existing[-1])
+        return represent(request, written, status_code=201)
+
+    @app.patch('/rest/v1/{table}')
+    async def update(table: str, request: Request):
+        changes = await request.json()
+        rows = filtered(table, request)
+        for row in rows:
+            row.update(changes)
+        return represent(request, rows)
+
+    @app.delete('/rest/v1/{table}')
+    async def delete(table: str, request: Request):
+        rows = filtered(table, request)
+        ids = {id(row) for row in rows}
+        data[table] = [row for row in data.get(table, []) if id(row) not in ids]
+        return represent(request, rows)
+
+    return app
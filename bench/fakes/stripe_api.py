@@ -0,0 +1,173 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+_KEY_PART = re.compile(r"\[([^\]]*)\]")
+
+
+def _set_nested(target: Dict[str, Any], key: str, value: str) -> None:
+    """Range 'a[b][0][c]=v' (encodage des formulaires Stripe) dans un dict imbriqué"""
+    head = key.split("[", 1)[0]
+    parts = [head, *_KEY_PART.findall(key[len(head):])]
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    target[parts[-1]] = value
+
+
+def _lists(value: Any) -> Any:
+    """Les dicts à clés numériques ('0', '1', ...) redeviennent des listes"""
+    if isinstance(value, dict):
+        value = {key: _lists(item) for key, item in value.items()}
+        if value and all(key.isdigit() for key in value):
+            return [value[key] for key in sorted(value, key=int)]
+    return value
+
+
+async def _form(request: Request) -> Dict[str, Any]:
+    body: Dict[str, Any] = {}
+    for key, value in parse_qsl((await request.body()).decode(), keep_blank_values=True):
+        _set_nested(body, key, value)
+    return _lists(body)
+
+
+def _not_found(kind: str, object_id: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"type": "invalid_request_error", "code": "resource_missing",
+                   "message": f"No such {kind}: '{object_id}'"}},
+        status_code=404
+    )
+
+
+def create_stripe_app(latency: float = 0.05, paid: bool = True) -> FastAPI:
+    """
+    Faux Stripe : sessions Checkout, abonnements, produits et prix en mémoire
+
+    Args:
+        latency: Délai ajouté à chaque appel (aller-retour vers l'API Stripe)
+        paid: Les sessions créées sont considérées comme payées
+    """
+    app = FastAPI()
+    objects: Dict[str, Dict[str, Dict[str, Any]]] = {
+        "checkout.session": {}, "subscription": {}, "product": {}, "price": {}
+    }
+    idempotent: Dict[str, Dict[str, Any]] = {}
+    app.state.objects = objects
+    app.state.calls = 0
+
+    @app.middleware("http")
+    async def simulate_network(request: Request, call_next):
+        app.state.calls += 1
+        await asyncio.sleep(latency)
+        # Même clé d'idempotence : même réponse, sans recréer l'objet
+        key = request.headers.get("idempotency-key")
+        if request.method == "POST" and key and key in idempotent:
+            return JSONResponse(idempotent[key])
+        response = await call_next(request)
+        if request.method == "POST" and key and response.status_code == 200:
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            idempotent[key] = json.loads(body)
+            return JSONResponse(idempotent[key])
+        return response
+
+    def create(kind: str, prefix: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        obj = {"id": f"{prefix}_{uuid.uuid4().hex[:24]}", "object": kind, "created": int(time.time()),
+               "livemode": False, **fields}
+        objects[kind][obj["id"]] = obj
+        return obj
+
+    @app.post('/v1/checkout/sessions')
+    async def create_session(request: Request):
+        form = await _form(request)
+        subscription = None
+        if form.get("mode") == "subscription" and paid:
+            subscription = create("subscription", "sub", {"status": "active", "cancel_at_period_end": False,
+                                                          "metadata": form.get("metadata", {})})["id"]
+        session = create("checkout.session", "cs_test", {
+            "mode": form.get("mode", "payment"),
+            "status": "complete" if paid else "open",
+            "payment_status": "paid" if paid else "unpaid",
+            "metadata": form.get("metadata", {}),
+            "line_items": form.get("line_items", []),
+            "subscription": subscription,
+            "success_url": form.get("success_url"),
+            "cancel_url": form.get("cancel_url"),
+        })
+        session["url"] = f"https://checkout.stripe.test/c/pay/{session['id']}"
+        return session
+
+    @app.get('/v1/checkout/sessions/{session_id}')
+    async def retrieve_session(session_id: str):
+        session = objects["checkout.session"].get(session_id)
+        return session if session else _not_found("checkout.session", session_id)
+
+    @app.get('/v1/subscriptions/{subscription_id}')
+    async def retrieve_subscription(subscription_id: str):
+        subscription = objects["subscription"].get(subscription_id)
+        return subscription if subscription else _not_found("subscription", subscription_id)
+
+    @app.post('/v1/subscriptions/{subscription_id}')
+    async def modify_subscription(subscription_id: str, request: Request):
+        subscription = objects["subscription"].get(subscription_id)
+        if subscription is None:
+            return _not_found("subscription", subscription_id)
+        form = await _form(request)
+        if "cancel_at_period_end" in form:
+            subscription["cancel_at_period_end"] = form["cancel_at_period_end"] == "true"
+        return subscription
+
+    @app.delete('/v1/subscriptions/{subscription_id}')
+    async def cancel_subscription(subscription_id: str):
+        subscription = objects["subscription"].get(subscription_id)
+        if subscription is None:
+            return _not_found("subscription", subscription_id)
+        subscription["status"] = "canceled"
+        return subscription
+
+    @app.post('/v1/products')
+    async def create_product(request: Request):
+        form = await _form(request)
+        return create("product", "prod", {"name": form.get("name"), "active": True,
+                                          "metadata": form.get("metadata", {})})
+
+    @app.post('/v1/prices')
+    async def create_price(request: Request):
+        form = await _form(request)
+        recurring = form.get("recurring")
+        return create("price", "price", {
+            "currency": form.get("currency", "eur"),
+            "unit_amount": int(form.get("unit_amount", 0)),
+            "product": form.get("product"),
+            "recurring": {"interval": recurring["interval"]} if recurring else None,
+            "lookup_key": form.get("lookup_key"),
+            "active": True,
+            "type": "recurring" if recurring else "one_time",
+            "metadata": form.get("metadata", {}),
+        })
+
+    @app.get('/v1/prices')
+    async def list_prices(request: Request, limit: int = 100, starting_after: Optional[str] = None):
+        prices = [price for price in objects["price"].values() if price["active"]]
+        if request.query_params.get("active") == "false":
+            prices = [price for price in objects["price"].values() if not price["active"]]
+        lookup_keys = [value for key, value in request.query_params.multi_items() if key.startswith("lookup_keys")]
+        if lookup_keys:
+            prices = [price for price in prices if price["lookup_key"] in lookup_keys]
+        if starting_after:
+            ids = [price["id"] for price in prices]
+            prices = prices[ids.index(starting_after) + 1:] if starting_after in ids else []
+        return {"object": "list", "url": "/v1/prices", "data": prices[:limit], "has_more": len(prices) > limit}
+
+    @app.get('/v1/prices/{price_id}')
+    async def retrieve_price(price_id: str):
+        price = objects["price"].get(price_id)
+        return price if price else _not_found("price", price_id)
+
+    return app
@@ -0,0 +1,344 @@
+"""
+Banc de charge : lance les faux serveurs et l'application, puis mesure
+chaque scénario à plusieurs niveaux de concurrence
+
+    python -m bench.run --scenarios fix_text,verify_session --concurrency 1,8,32 --duration 10
+    python -m bench.run --save-baseline local      # enregistre bench/baselines/local.json
+    python -m bench.run --compare local            # code de sortie 1 en cas de régression
+
+Le générateur de charge et l'application partagent le même processus (le
+retard de boucle est mesuré sur la boucle de l'application, dans son
+thread) : comparer des mesures prises sur la même machine.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .scenarios import SCENARIOS, DEFAULT_SCENARIOS, Scenario
+
+
+BASELINES_DIR = Path(__file__).parent / 'baselines'
+
+# Clé au format JWT exigé par le client Supabase (le faux PostgREST ne la vérifie pas)
+_FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+class LoopLagMonitor:
+    """Mesure le retard de réveil d'une tâche qui dort interval secondes (boucle bloquée)"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.monotonic() - start - self.interval))
+
+    def reset(self) -> None:
+        self.samples = []
+
+
+class AppServer:
+    """Application FastAPI servie par uvicorn dans un thread, avec sa propre boucle"""
+
+    def __init__(self, port: int):
+        import uvicorn
+        from app import app
+
+        self.port = port
+        self.lag = LoopLagMonitor()
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port,
+                                                    log_level='warning', access_log=False))
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+
+    async def _serve(self) -> None:
+        monitor = asyncio.ensure_future(self.lag.run())
+        try:
+            await self.server.serve()
+        finally:
+            monitor.cancel()
+
+    def start(self) -> None:
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("L'application n'a pas démarré")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def start_fakes(args: argparse.Namespace, ports: Dict[str, int]) -> subprocess.Popen:
+    command = [
+        sys.executable, '-m', 'bench.fakes',
+        '--ollama-port', str(ports['ollama']),
+        '--stripe-port', str(ports['stripe']),
+        '--postgrest-port', str(ports['postgrest']),
+        '--token-rate', str(args.token_rate),
+        '--first-token', str(args.first_token),
+        '--output-tokens', str(args.output_tokens),
+        '--failure-rate', str(args.failure_rate),
+        '--stripe-latency', str(args.stripe_latency),
+        '--postgrest-latency', str(args.postgrest_latency),
+        '--seed', '1',
+    ]
+    root = Path(__file__).resolve().parent.parent
+    process = subprocess.Popen(command, cwd=root)
+    deadline = time.monotonic() + 15
+    for port in (ports['ollama'], ports['stripe'], ports['postgrest']):
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    process.kill()
+                    raise RuntimeError("Les faux serveurs n'ont pas démarré")
+                time.sleep(0.1)
+    return process
+
+
+def configure_environment(ports: Dict[str, int]) -> None:
+    """Pointe l'application vers les faux serveurs (avant l'import de app)"""
+    os.environ['OLLAMA_URL'] = f"http://127.0.0.1:{ports['ollama']}"
+    os.environ.pop('OLLAMA_BACKENDS', None)
+    os.environ['SUPABASE_URL'] = f"http://127.0.0.1:{ports['postgrest']}"
+    os.environ['SUPABASE_KEY'] = _FAKE_SUPABASE_KEY
+    os.environ['STRIPE_SECRET_KEY'] = 'sk_test_bench'
+    os.environ['STRIPE_API_BASE'] = f"http://127.0.0.1:{ports['stripe']}"
+    os.environ['STRIPE_CATALOG'] = json.dumps([
+        {"name": "Pack 100 tokens", "amount": 4.99, "token_amount": 100},
+        {"name": "Abonnement Premium", "amount": 9.99, "interval": "month"}
+    ])
+    os.environ.pop('IA_CACHE_DB_PATH', None)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('JOB_STORE', 'memory')
+
+
+async def _request(client: httpx.AsyncClient, scenario: Scenario, i: int, state: Any) -> Dict[str, Any]:
+    start = time.monotonic()
+    first_byte = None
+    body = scenario.body(i, state) if scenario.body else None
+    try:
+        async with client.stream(scenario.method, scenario.path(i, state), json=body,
+                                 headers=scenario.headers) as response:
+            async for _ in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.monotonic() - start
+            ok = response.status_code < 400
+            status = response.status_code
+    except httpx.HTTPError as e:
+        ok, status = False, type(e).__name__
+    return {"ok": ok, "status": status, "latency": time.monotonic() - start, "ttfb": first_byte}
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    state: Any,
+    concurrency: int,
+    duration: float,
+    max_requests: Optional[int]
+) -> List[Dict[str, Any]]:
+    """Concurrency clients enchaînent les requêtes jusqu'à la fin de la durée (ou max_requests)"""
+    counter = itertools.count()
+    deadline = time.monotonic() + duration
+    results: List[Dict[str, Any]] = []
+
+    async def worker():
+        while time.monotonic() < deadline:
+            i = next(counter)
+            if max_requests is not None and i >= max_requests:
+                return
+            results.append(await _request(client, scenario, i, state))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float, lag: List[float]) -> Dict[str, Any]:
+    latencies = [result["latency"] for result in results if result["ok"]]
+    ttfb = [result["ttfb"] for result in results if result["ok"] and result["ttfb"] is not None]
+    errors: Dict[str, int] = {}
+    for result in results:
+        if not result["ok"]:
+            errors[str(result["status"])] = errors.get(str(result["status"]), 0) + 1
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else 0.0,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": _ms(_percentile(latencies, 50)),
+        "p95_ms": _ms(_percentile(latencies, 95)),
+        "p99_ms": _ms(_percentile(latencies, 99)),
+        "ttfb_p50_ms": _ms(_percentile(ttfb, 50)),
+        "loop_lag_p99_ms": _ms(_percentile(lag, 99)),
+        "loop_lag_max_ms": _ms(max(lag) if lag else None),
+    }
+
+
+async def run_benchmark(args: argparse.Namespace, app_server: AppServer) -> Dict[str, Dict[str, Any]]:
+    report: Dict[str, Dict[str, Any]] = {}
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2, max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_server.port}", limits=limits,
+                                 timeout=args.timeout) as client:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            state = await scenario.prepare(client) if scenario.prepare else None
+            report[name] = {}
+            for concurrency in args.concurrency:
+                if args.warmup:
+                    await run_level(client, scenario, state, concurrency, args.warmup, None)
+                app_server.lag.reset()
+                start = time.monotonic()
+                results = await run_level(client, scenario, state, concurrency, args.duration, args.requests)
+                summary = summarize(results, time.monotonic() - start, list(app_server.lag.samples))
+                report[name][str(concurrency)] = summary
+                print_row(name, concurrency, summary)
+    return report
+
+
+_COLUMNS = ("requests", "rps", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "loop_lag_p99_ms", "loop_lag_max_ms",
+            "error_rate")
+
+
+def print_header() -> None:
+    print(f"{'scénario':<26}{'conc.':>6}" + "".join(f"{column:>16}" for column in _COLUMNS))
+
+
+def print_row(name: str, concurrency: int, summary: Dict[str, Any]) -> None:
+    cells = "".join(f"{'-' if summary[column] is None else summary[column]:>16}" for column in _COLUMNS)
+    print(f"{name:<26}{concurrency:>6}{cells}", flush=True)
+
+
+def compare(report: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Régressions par rapport à la baseline : p95 plus lent, débit plus faible ou plus d'erreurs"""
+    regressions = []
+    for name, levels in report.items():
+        for concurrency, current in levels.items():
+            previous = baseline.get("results", {}).get(name, {}).get(concurrency)
+            if not previous:
+                continue
+            label = f"{name} (concurrence {concurrency})"
+            if previous["p95_ms"] and current["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append(f"{label}: p95 {previous['p95_ms']} ms → {current['p95_ms']} ms")
+            if previous["rps"] and current["rps"] < previous["rps"] * (1 - threshold):
+                regressions.append(f"{label}: débit {previous['rps']} → {current['rps']} req/s")
+            if current["error_rate"] > previous["error_rate"] + 0.01:
+                regressions.append(f"{label}: erreurs {previous['error_rate']:.2%} → {current['error_rate']:.2%}")
+    return regressions
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Banc de charge de l'API contre des serveurs simulés")
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"Scénarios séparés par des virgules, parmi: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help="Niveaux de concurrence")
+    parser.add_argument('--duration', type=float, default=10.0, help="Durée de mesure par niveau (s)")
+    parser.add_argument('--requests', type=int, default=None, help="Nombre maximal de requêtes par niveau")
+    parser.add_argument('--warmup', type=float, default=1.0, help="Échauffement non mesuré par niveau (s)")
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--token-rate', type=float, default=200.0)
+    parser.add_argument('--first-token', type=float, default=0.1)
+    parser.add_argument('--output-tokens', type=int, default=100)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--stripe-latency', type=float, default=0.05)
+    parser.add_argument('--postgrest-latency', type=float, default=0.01)
+    parser.add_argument('--output', help="Écrit le rapport complet en JSON")
+    parser.add_argument('--save-baseline', metavar='NOM', help="Enregistre le rapport dans bench/baselines/NOM.json")
+    parser.add_argument('--compare', metavar='NOM', help="Compare à bench/baselines/NOM.json")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Écart toléré avant régression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Scénarios inconnus: {', '.join(unknown)}")
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        # Baseline lue avant la mesure : une faute de nom ne gâche pas un long banc
+        baseline = json.loads((BASELINES_DIR / f"{args.compare}.json").read_text())
+    ports = {'ollama': _free_port(), 'stripe': _free_port(), 'postgrest': _free_port(), 'app': _free_port()}
+    fakes = start_fakes(args, ports)
+    try:
+        configure_environment(ports)
+        app_server = AppServer(ports['app'])
+        app_server.start()
+        try:
+            print_header()
+            results = asyncio.run(run_benchmark(args, app_server))
+        finally:
+            app_server.stop()
+    finally:
+        fakes.terminate()
+        fakes.wait(timeout=10)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "settings": {key: getattr(args, key) for key in (
+            "duration", "requests", "warmup", "token_rate", "first_token", "output_tokens",
+            "failure_rate", "stripe_latency", "postgrest_latency")},
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        path = BASELINES_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"Baseline enregistrée: {path}")
+    if baseline is not None:
+        if baseline.get("settings") != report["settings"]:
+            print("⚠️ Réglages différents de ceux de la baseline, comparaison indicative")
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"❌ Régression: {regression}")
+        if regressions:
+            return 1
+        print("✅ Aucune régression par rapport à la baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
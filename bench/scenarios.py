@@ -0,0 +1,90 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+_TEXT = (
+    "Le soleil se couchait sur la ville quand Mara comprit enfin que le message "
+    "ne venait pas de son frère. Elle relut la lettre trois fois, chercha une "
+    "signature, un indice, puis la glissa dans sa poche avant de sortir. "
+)
+
+
+class Scenario:
+    """
+    Requête répétée par le banc de charge
+
+    Args:
+        name: Nom affiché dans le rapport et clé des baselines
+        method: Méthode HTTP
+        path: Chemin (peut dépendre de l'itération et de l'état préparé)
+        body: Corps JSON de la i-ème requête ; i varie pour éviter le cache
+            des réponses IA
+        headers: En-têtes ajoutés (ex: Accept pour le streaming SSE)
+        prepare: Préparation avant la mesure (ex: création de sessions
+            Stripe), son résultat est passé à path et body
+    """
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        path: Callable[[int, Any], str],
+        body: Optional[Callable[[int, Any], Dict[str, Any]]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        prepare: Optional[Callable[[httpx.AsyncClient], Awaitable[Any]]] = None
+    ):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+        self.prepare = prepare
+
+
+def _fixed(path: str) -> Callable[[int, Any], str]:
+    return lambda i, state: path
+
+
+async def _checkout_sessions(client: httpx.AsyncClient, count: int = 20) -> List[str]:
+    """Sessions payées (faux Stripe) vérifiées ensuite en boucle par verify_session"""
+    sessions = []
+    for i in range(count):
+        response = await client.post('/stripe/create-checkout-session', json=_checkout_body(i, None))
+        response.raise_for_status()
+        sessions.append(response.json()["sessionId"])
+    return sessions
+
+
+def _checkout_body(i: int, state: Any) -> Dict[str, Any]:
+    return {
+        "user_id": f"user-{i % 100}",
+        "product_name": "Pack 100 tokens",
+        "amount": 4.99,
+        "token_amount": 100,
+        "pack_id": "pack-100"
+    }
+
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in (
+    Scenario('health', 'GET', _fixed('/health')),
+    Scenario('generate_pitch', 'POST', _fixed('/ia/generate_pitch'),
+             lambda i, state: {"user_request": f"Une enquête dans une ville engloutie (variante {i})"}),
+    Scenario('generate_characters', 'POST', _fixed('/ia/generate_characters'),
+             lambda i, state: {"pitch": f"Pitch {i} : {_TEXT}", "synopsis": _TEXT * 3}),
+    Scenario('fix_text', 'POST', _fixed('/ia/fix_text'),
+             lambda i, state: {"text": f"{i}. {_TEXT * 4}"}),
+    Scenario('fix_text_stream', 'POST', _fixed('/ia/fix_text?stream=true'),
+             lambda i, state: {"text": f"{i}. {_TEXT * 4}"},
+             headers={"Accept": "text/event-stream"}),
+    Scenario('fix_text_long', 'POST', _fixed('/ia/fix_text'),
+             lambda i, state: {"text": f"{i}. " + "\n\n".join([_TEXT * 6] * 8)}),
+    Scenario('rephrase_text', 'POST', _fixed('/ia/rephrase_text'),
+             lambda i, state: {"text_complete": f"{i}. {_TEXT * 20}", "text_to_reformulate": _TEXT.split('.')[0]}),
+    Scenario('create_checkout_session', 'POST', _fixed('/stripe/create-checkout-session'), _checkout_body),
+    Scenario('verify_session', 'GET', lambda i, sessions: f'/stripe/verify-session/{sessions[i % len(sessions)]}',
+             prepare=_checkout_sessions),
+)}
+
+DEFAULT_SCENARIOS = ['health', 'generate_pitch', 'fix_text', 'fix_text_stream', 'create_checkout_session',
+                     'verify_session']
@@ -34,12 +34,7 @@ Rédige un **synopsis complet de 10 lignes** exactement.
 
 CREATE_CHARACTERS = """
 Tu es un character designer narratif expert en création de personnages pour webnovel.  
-À partir des éléments suivants :
-
-Pitch : {pitch}  
-Synopsis : {synopsis}  
-
-Génère la description des **3 à 5 personnages principaux** du webnovel.  
+Tu génères la description des **3 à 5 personnages principaux** d'un webnovel à partir de son pitch et de son synopsis.  
 
 ⚙️ Contraintes :
 - Réponds **uniquement en français**.
@@ -61,17 +56,36 @@ Génère la description des **3 à 5 personnages principaux** du webnovel.
 - Les descriptions doivent être cohérentes entre elles et avec le synopsis
 - Génère entre 3 et 5 personnages selon l'histoire
 - **Réponds SEULEMENT avec le JSON, sans aucun texte avant ou après**
+
+À partir des éléments suivants :
+
+Pitch : {pitch}  
+Synopsis : {synopsis}  
 """
 
-CREATE_EPISODE = """
-Tu es un romancier professionnel. Rédige l'épisode {numero} de cette histoire de manière claire, captivante et lisible.
+REPAIR_CHARACTER = """
+Tu es un character designer narratif expert en création de personnages pour webnovel.  
+Un des personnages générés pour ce webnovel est incomplet ou mal formé :  
+{fragment}
 
-À partir des informations suivantes :
+Réécris ce personnage sous la forme d'**un seul objet JSON** avec les 5 champs obligatoires : nom, âge, apparence, personnalité, rôle.
+
+⚙️ Contraintes :
+- Réponds **uniquement en français**.
+- Conserve tout ce qui est exploitable dans le fragment (nom, traits, rôle).
+- Le personnage doit être différent de ceux déjà créés : {noms}
+- Chaque champ doit être une chaîne de caractères de **100 mots maximum**.
+- **Réponds SEULEMENT avec le JSON, sans aucun texte avant ou après**
 
 Pitch : {pitch}  
 Synopsis : {synopsis}  
-Personnages : {personnages}  
-{contexte_episodes}
+"""
+
+# Les instructions et les éléments fixes de l'histoire forment un préfixe
+# identique d'un épisode à l'autre (réutilisé par le cache de prompt
+# d'Ollama) : seuls les épisodes précédents et le numéro viennent à la fin.
+CREATE_EPISODE = """
+Tu es un romancier professionnel. Tu rédiges les épisodes d'une histoire de manière claire, captivante et lisible.
 
 📖 RÈGLES D'ÉCRITURE IMPÉRATIVES :
 
@@ -117,6 +131,14 @@ Personnages : {personnages}
 - Réponds **uniquement en français**.
 
 🎯 OBJECTIF : Un texte fluide et captivant qu'on lit d'une traite, avec une vraie progression narrative et des personnages vivants.
+
+À partir des informations suivantes :
+
+Pitch : {pitch}  
+Synopsis : {synopsis}  
+Personnages : {personnages}  
+{contexte_episodes}
+✍️ Rédige maintenant l'épisode {numero} de cette histoire.
 """
 
 
@@ -148,4 +170,64 @@ Réécris uniquement ce passage pour qu'il soit mieux formulé, plus fluide et n
 - Aucune information nouvelle ne doit être ajoutée.  
 - Aucune ponctuation volontaire ne doit être modifiée.  
 - Le rendu final doit être **le texte reformulé uniquement**, sans explication ni commentaire.
-"""
\ No newline at end of file
+"""
+
+SUMMARIZE_EPISODE = """
+Tu es l'assistant d'un romancier et tu tiens la mémoire de son histoire.  
+Résume l'épisode suivant :  
+"{episode}"
+
+⚙️ Contraintes :
+- Réponds **uniquement en français**.
+- **120 mots maximum**.
+- Garde uniquement ce qui compte pour la suite : événements clés, décisions, révélations, nouveaux personnages, lieux, état des relations et situation finale.
+- Conserve les noms propres exactement comme dans le texte.
+- Le rendu final doit être **le résumé uniquement**, sans titre ni commentaire.
+"""
+
+SUMMARIZE_ARC = """
+Tu es l'assistant d'un romancier et tu tiens la mémoire de son histoire.  
+Voici les résumés des premiers épisodes, dans l'ordre :  
+{resumes}
+
+Rédige un **résumé global de l'arc narratif** couvert par ces épisodes.  
+
+⚙️ Contraintes :
+- Réponds **uniquement en français**.
+- **250 mots maximum**.
+- Mets en avant les intrigues en cours, les secrets révélés, l'évolution des personnages et les éléments à ne pas contredire.
+- Conserve les noms propres exactement comme dans les résumés.
+- Le rendu final doit être **le résumé uniquement**, sans titre ni commentaire.
+"""
+
+REPHRASE_PASSAGE = """
+Tu es un éditeur littéraire. Réécris le passage indiqué pour qu'il soit mieux formulé, plus fluide et naturel, tout en restant cohérent avec le texte qui l'entoure.  
+
+⚙️ Contraintes :
+- Réponds **uniquement en français**.
+- Le sens global du passage doit être conservé.  
+- Aucune information nouvelle ne doit être ajoutée.  
+- Aucune ponctuation volontaire ne doit être modifiée.  
+- Le rendu final doit être **le texte reformulé uniquement**, sans explication ni commentaire.
+{resume_document}
+Texte qui précède le passage :  
+"{contexte_avant}"  
+
+Passage à reformuler :  
+"{text_to_reformulate}"  
+
+Texte qui suit le passage :  
+"{contexte_apres}"  
+"""
+
+SUMMARIZE_DOCUMENT = """
+Tu es l'assistant d'un romancier.  
+Résume le texte suivant pour qu'un éditeur puisse retravailler un passage sans le lire en entier :  
+"{text}"
+
+⚙️ Contraintes :
+- Réponds **uniquement en français**.
+- **150 mots maximum**.
+- Indique le ton, le point de vue narratif, les personnages présents et les événements principaux.
+- Le rendu final doit être **le résumé uniquement**, sans titre ni commentaire.
+"""
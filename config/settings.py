@@ -1,20 +1,229 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Charger les variables d'environnement
 load_dotenv()
 
+
+def _parse_backends(raw, default_url):
+    """
+    Lit la liste des serveurs Ollama
+
+    OLLAMA_BACKENDS accepte soit une liste JSON d'objets
+    {"url", "weight", "models", "max_in_flight", "api_key"}, soit des URLs
+    séparées par des virgules. Sans valeur, seul OLLAMA_URL est utilisé.
+    """
+    if not raw:
+        return [{'url': default_url}]
+    raw = raw.strip()
+    if raw.startswith('['):
+        return [spec if isinstance(spec, dict) else {'url': spec} for spec in json.loads(raw)]
+    return [{'url': url.strip()} for url in raw.split(',') if url.strip()]
+
+
 class Config:
     """Configuration de base pour l'application"""
     
     # Supabase
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+    # Accès asynchrone à PostgREST (client httpx partagé)
+    SUPABASE_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', '10'))
+    SUPABASE_CONNECT_TIMEOUT = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '5'))
+    SUPABASE_MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', '20'))
+    SUPABASE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('SUPABASE_MAX_KEEPALIVE_CONNECTIONS', '10'))
+    SUPABASE_MAX_RETRIES = int(os.getenv('SUPABASE_MAX_RETRIES', '2'))
+    SUPABASE_RETRY_BACKOFF = float(os.getenv('SUPABASE_RETRY_BACKOFF', '0.2'))  # Doublé à chaque essai
+    
+    # Stripe (client HTTP asynchrone partagé, retries avec clé d'idempotence)
+    STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+    STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')  # Par défaut l'API Stripe (ex: faux Stripe du banc de charge)
+    STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', '20'))
+    STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '5'))
+    STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+    STRIPE_APPLIED_CACHE_SIZE = int(os.getenv('STRIPE_APPLIED_CACHE_SIZE', '10000'))  # Sessions déjà créditées gardées en mémoire
+    
+    # Catalogue des articles vendus, synchronisé avec les prix Stripe au démarrage :
+    # liste JSON d'objets {"name", "amount" (euros), "token_amount" (pack de tokens)
+    # ou "interval" (abonnement : day, week, month, year)}. Seuls ces articles
+    # peuvent être achetés, sauf si STRIPE_CATALOG_CREATE_ON_DEMAND est activé.
+    # Sans pack dans la liste (défaut), les packs restent vendus au montant et
+    # au nombre de tokens envoyés par le client : y ajouter les packs vendus
+    # pour ne plus faire confiance au client.
+    STRIPE_CATALOG = json.loads(os.getenv(
+        'STRIPE_CATALOG',
+        '[{"name": "Abonnement Premium", "amount": 9.99, "interval": "month"}]'
+    ))
+    STRIPE_CATALOG_CREATE_ON_DEMAND = os.getenv('STRIPE_CATALOG_CREATE_ON_DEMAND', 'false').lower() in ('1', 'true', 'yes')
+    
+    # Cache des sessions Checkout lues chez Stripe (durée selon l'état de la session)
+    STRIPE_SESSION_CACHE_SIZE = int(os.getenv('STRIPE_SESSION_CACHE_SIZE', '10000'))
+    STRIPE_SESSION_TTL_FINAL = float(os.getenv('STRIPE_SESSION_TTL_FINAL', '3600'))  # Payée ou expirée : ne change plus
+    STRIPE_SESSION_TTL_PENDING = float(os.getenv('STRIPE_SESSION_TTL_PENDING', '2'))  # En attente de paiement
+    
+    # Webhooks Stripe : file durable SQLite traitée par un worker en tâche de fond
+    STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')  # whsec_..., webhooks désactivés si absente
+    STRIPE_WEBHOOK_TOLERANCE = int(os.getenv('STRIPE_WEBHOOK_TOLERANCE', '300'))  # Âge max de la signature (secondes)
+    STRIPE_EVENTS_DB_PATH = os.getenv('STRIPE_EVENTS_DB_PATH', './data/stripe_events.sqlite3')
+    STRIPE_EVENTS_BATCH_SIZE = int(os.getenv('STRIPE_EVENTS_BATCH_SIZE', '20'))
+    STRIPE_EVENTS_MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENTS_MAX_ATTEMPTS', '8'))
+    STRIPE_EVENTS_RETRY_BACKOFF = float(os.getenv('STRIPE_EVENTS_RETRY_BACKOFF', '5'))  # Doublé à chaque essai
+    STRIPE_EVENTS_LEASE = float(os.getenv('STRIPE_EVENTS_LEASE', '60'))  # Délai avant qu'un lot non terminé soit repris
+    STRIPE_EVENTS_POLL_INTERVAL = float(os.getenv('STRIPE_EVENTS_POLL_INTERVAL', '1'))
+    STRIPE_EVENTS_RETENTION = float(os.getenv('STRIPE_EVENTS_RETENTION', str(7 * 86400)))  # Conservation pour dédoublonner
     
     # Ollama / IA
     OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
     OLLAMA_API_KEY = os.getenv('OLLAMA_API_KEY')  # Optionnel pour Ollama Cloud
     OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'gpt-oss:120b')
+    # Durée pendant laquelle Ollama garde le modèle (et son cache de prompt) en mémoire
+    OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+    
+    # Pool de serveurs Ollama (équilibrage + éjection des serveurs en échec)
+    OLLAMA_BACKENDS = _parse_backends(os.getenv('OLLAMA_BACKENDS'), OLLAMA_URL)
+    OLLAMA_FAILURE_THRESHOLD = int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '3'))
+    OLLAMA_EJECTION_TIME = float(os.getenv('OLLAMA_EJECTION_TIME', '30'))
+    # Nombre d'histoires dont on retient le serveur (réutilisation du cache de prompt)
+    OLLAMA_AFFINITY_SIZE = int(os.getenv('OLLAMA_AFFINITY_SIZE', '10000'))
+    
+    # Client HTTP partagé vers Ollama (pool de connexions)
+    OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '100'))
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OLLAMA_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv('OLLAMA_KEEPALIVE_EXPIRY', '30'))
+    OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '10'))
+    OLLAMA_HTTP2 = os.getenv('OLLAMA_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+    
+    # Modèle par endpoint IA (par défaut OLLAMA_MODEL), ex: un petit modèle pour la correction
+    IA_MODELS = {endpoint: model for endpoint, model in {
+        'generate_pitch': os.getenv('IA_MODEL_PITCH'),
+        'generate_synopsis': os.getenv('IA_MODEL_SYNOPSIS'),
+        'generate_characters': os.getenv('IA_MODEL_CHARACTERS'),
+        'generate_episode': os.getenv('IA_MODEL_EPISODE'),
+        'fix_text': os.getenv('IA_MODEL_FIX_TEXT'),
+        'rephrase_text': os.getenv('IA_MODEL_REPHRASE'),
+        'summarize_episode': os.getenv('IA_MODEL_SUMMARY'),
+        'summarize_arc': os.getenv('IA_MODEL_SUMMARY'),
+        'summarize_document': os.getenv('IA_MODEL_SUMMARY'),
+    }.items() if model}
+    
+    # Modèle de repli (plus petit) quand l'objectif de latence n'est pas tenu
+    IA_FALLBACK_MODELS = {endpoint: model for endpoint, model in {
+        'generate_pitch': os.getenv('IA_FALLBACK_MODEL_PITCH'),
+        'generate_synopsis': os.getenv('IA_FALLBACK_MODEL_SYNOPSIS'),
+        'generate_characters': os.getenv('IA_FALLBACK_MODEL_CHARACTERS'),
+        'generate_episode': os.getenv('IA_FALLBACK_MODEL_EPISODE'),
+        'fix_text': os.getenv('IA_FALLBACK_MODEL_FIX_TEXT'),
+        'rephrase_text': os.getenv('IA_FALLBACK_MODEL_REPHRASE'),
+    }.items() if model}
+    
+    # Objectif de latence : p95 maximal (secondes) par endpoint, attente maximale
+    # prévue dans la file, et fenêtre des mesures prises en compte
+    IA_SLO_P95 = {
+        'generate_pitch': float(os.getenv('IA_SLO_P95_PITCH', '20')),
+        'generate_synopsis': float(os.getenv('IA_SLO_P95_SYNOPSIS', '30')),
+        'generate_characters': float(os.getenv('IA_SLO_P95_CHARACTERS', '45')),
+        'generate_episode': float(os.getenv('IA_SLO_P95_EPISODE', '90')),
+        'fix_text': float(os.getenv('IA_SLO_P95_FIX_TEXT', '10')),
+        'rephrase_text': float(os.getenv('IA_SLO_P95_REPHRASE', '10')),
+    }
+    IA_SLO_QUEUE_WAIT = float(os.getenv('IA_SLO_QUEUE_WAIT', '5'))
+    IA_SLO_WINDOW = float(os.getenv('IA_SLO_WINDOW', '300'))
+    
+    # Timeouts (en secondes) par endpoint IA
+    IA_TIMEOUTS = {
+        'generate_pitch': float(os.getenv('IA_TIMEOUT_PITCH', '60')),
+        'generate_synopsis': float(os.getenv('IA_TIMEOUT_SYNOPSIS', '60')),
+        'generate_characters': float(os.getenv('IA_TIMEOUT_CHARACTERS', '60')),
+        'generate_episode': float(os.getenv('IA_TIMEOUT_EPISODE', '120')),
+        'fix_text': float(os.getenv('IA_TIMEOUT_FIX_TEXT', '60')),
+        'rephrase_text': float(os.getenv('IA_TIMEOUT_REPHRASE', '60')),
+        'summarize_episode': float(os.getenv('IA_TIMEOUT_SUMMARY', '120')),
+        'summarize_arc': float(os.getenv('IA_TIMEOUT_SUMMARY', '120')),
+        'summarize_document': float(os.getenv('IA_TIMEOUT_SUMMARY', '120')),
+    }
+    
+    # Contrôle d'admission : requêtes simultanées par serveur Ollama et file d'attente
+    # (OLLAMA_MAX_INFLIGHT peut être surchargé par serveur dans OLLAMA_BACKENDS)
+    OLLAMA_MAX_INFLIGHT = int(os.getenv('OLLAMA_MAX_INFLIGHT', '4'))
+    IA_MAX_QUEUE = int(os.getenv('IA_MAX_QUEUE', '32'))
+    
+    # Priorité par endpoint IA (0 = interactif, 1 = normal, 2 = génération longue)
+    IA_PRIORITIES = {
+        'fix_text': 0,
+        'rephrase_text': 0,
+        'generate_pitch': 1,
+        'generate_synopsis': 1,
+        'generate_characters': 1,
+        'generate_episode': 2,
+        'summarize_episode': 2,
+        'summarize_arc': 2,
+        'summarize_document': 1,
+    }
+    
+    # Mémoire de l'histoire : épisodes récents repris tels quels, les plus
+    # anciens résumés, dans un budget de tokens pour le contexte
+    STORY_RECENT_EPISODES = int(os.getenv('STORY_RECENT_EPISODES', '2'))
+    STORY_CONTEXT_TOKEN_BUDGET = int(os.getenv('STORY_CONTEXT_TOKEN_BUDGET', '8000'))
+    
+    # Sessions d'histoire côté serveur ('supabase' ou 'sqlite' pour le local / les tests)
+    STORY_STORE = os.getenv('STORY_STORE', 'supabase')
+    STORY_DB_PATH = os.getenv('STORY_DB_PATH', './data/stories.sqlite3')
+    
+    # Cache des réponses IA (mémoire LRU + niveau disque SQLite optionnel)
+    IA_CACHE_TTL = float(os.getenv('IA_CACHE_TTL', '86400'))
+    IA_CACHE_MAX_ENTRIES = int(os.getenv('IA_CACHE_MAX_ENTRIES', '1000'))
+    IA_CACHE_MAX_BYTES = int(os.getenv('IA_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    IA_CACHE_DB_PATH = os.getenv('IA_CACHE_DB_PATH')  # ex: ./data/ia_cache.sqlite3
+    IA_CACHE_DISK_MAX_ENTRIES = int(os.getenv('IA_CACHE_DISK_MAX_ENTRIES', '10000'))
+    
+    # Endpoints batch : éléments traités en parallèle par lot, taille maximale d'un lot
+    IA_BATCH_CONCURRENCY = int(os.getenv('IA_BATCH_CONCURRENCY', '4'))
+    IA_BATCH_MAX_ITEMS = int(os.getenv('IA_BATCH_MAX_ITEMS', '50'))
+    
+    # Correction des textes longs : taille des morceaux (alignés sur les paragraphes)
+    # et nombre de morceaux corrigés en parallèle
+    FIX_TEXT_CHUNK_CHARS = int(os.getenv('FIX_TEXT_CHUNK_CHARS', '2000'))
+    FIX_TEXT_CONCURRENCY = int(os.getenv('FIX_TEXT_CONCURRENCY', '4'))
+    
+    # Reformulation : fenêtre de contexte autour du passage ('sentence' ou 'paragraph')
+    # et résumé du document (mis en cache) pour les textes longs
+    REPHRASE_WINDOW_UNIT = os.getenv('REPHRASE_WINDOW_UNIT', 'sentence')
+    REPHRASE_WINDOW_SIZE = int(os.getenv('REPHRASE_WINDOW_SIZE', '3'))
+    REPHRASE_DOC_SUMMARY = os.getenv('REPHRASE_DOC_SUMMARY', 'false').lower() in ('1', 'true', 'yes')
+    REPHRASE_SUMMARY_MIN_CHARS = int(os.getenv('REPHRASE_SUMMARY_MIN_CHARS', '6000'))
+    
+    # Personnages : nombre demandé au modèle et tentatives pour un personnage mal formé
+    CHARACTERS_MIN = int(os.getenv('CHARACTERS_MIN', '3'))
+    CHARACTERS_MAX = int(os.getenv('CHARACTERS_MAX', '5'))
+    CHARACTERS_REPAIR_ATTEMPTS = int(os.getenv('CHARACTERS_REPAIR_ATTEMPTS', '2'))
+    
+    # Registre des prompts : estimation des tokens (tiktoken si installé) et
+    # num_ctx / num_predict envoyés à Ollama. num_ctx est fixe : Ollama
+    # recharge le modèle à chaque changement de taille de contexte
+    PROMPT_TOKENIZER = os.getenv('PROMPT_TOKENIZER', 'cl100k_base')
+    PROMPT_DYNAMIC_CTX = os.getenv('PROMPT_DYNAMIC_CTX', 'true').lower() in ('1', 'true', 'yes')
+    PROMPT_NUM_CTX = int(os.getenv('PROMPT_NUM_CTX', '16384'))
+    # Marge appliquée à la longueur de sortie mesurée de chaque prompt pour
+    # fixer num_predict (à augmenter pour les modèles de raisonnement, dont
+    # la réflexion compte dans num_predict)
+    PROMPT_OUTPUT_HEADROOM = float(os.getenv('PROMPT_OUTPUT_HEADROOM', '2.0'))
+    # Part maximale de num_ctx réservée à la sortie (le reste va au prompt)
+    PROMPT_MAX_OUTPUT_SHARE = float(os.getenv('PROMPT_MAX_OUTPUT_SHARE', '0.5'))
+    
+    # Jobs de génération asynchrones ('memory', 'sqlite' ou 'supabase')
+    JOB_STORE = os.getenv('JOB_STORE', 'memory')
+    JOB_DB_PATH = os.getenv('JOB_DB_PATH', './data/jobs.sqlite3')
+    JOB_TTL = float(os.getenv('JOB_TTL', '3600'))  # Conservation des résultats (secondes)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+    JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '100'))
+    JOB_PROGRESS_INTERVAL = float(os.getenv('JOB_PROGRESS_INTERVAL', '1.0'))
+    
+    # Logs JSON écrits par un thread dédié (jamais sur la boucle asyncio)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_MAX_CHARS = int(os.getenv('LOG_MAX_CHARS', '2000'))  # Taille max d'un message ou d'un champ
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))  # Part des requêtes dont les logs DEBUG/INFO sont gardés
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Au-delà, les logs sont abandonnés
     
     @staticmethod
     def validate():
@@ -1,8 +1,8 @@
 # Placer vos modèles de données ici
 # Exemple d'utilisation avec Pydantic pour la validation des données
 
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, ValidationInfo, field_validator
+from typing import Any, Dict, Optional
 from datetime import datetime
 
 class ExampleModel(BaseModel):
@@ -21,3 +21,57 @@ class ExampleModel(BaseModel):
             }
         }
 
+
+class Character(BaseModel):
+    """
+    Personnage principal d'une histoire
+
+    Les clés JSON sont en français accentué (âge, personnalité, rôle) ; les
+    variantes sans accent renvoyées par certains modèles sont acceptées.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+    
+    nom: str = Field(..., min_length=1)
+    age: str = Field(..., alias="âge", validation_alias=AliasChoices("âge", "age"))
+    apparence: str = Field(..., min_length=1)
+    personnalite: str = Field(
+        ...,
+        alias="personnalité",
+        validation_alias=AliasChoices("personnalité", "personnalite", "perso"),
+        min_length=1
+    )
+    role: str = Field(..., alias="rôle", validation_alias=AliasChoices("rôle", "role"), min_length=1)
+    
+    @field_validator("age", mode="before")
+    @classmethod
+    def age_as_text(cls, value: Any) -> Any:
+        # Certains modèles renvoient l'âge sous forme de nombre
+        return str(value) if isinstance(value, (int, float)) else value
+    
+    @classmethod
+    def list_schema(cls, min_items: int, max_items: int) -> Dict[str, Any]:
+        """Schéma JSON d'un tableau de personnages (sortie structurée Ollama)"""
+        return {
+            "type": "array",
+            "items": cls.model_json_schema(by_alias=True),
+            "minItems": min_items,
+            "maxItems": max_items
+        }
+
+
+class UserExtend(BaseModel):
+    """Ligne de la table user_extend (solde de tokens, abonnement, préférences)"""
+    model_config = ConfigDict(extra="allow")
+    
+    id: str
+    token: int = 0
+    has_subscription: bool = False
+    preferences: Dict[str, Any] = Field(default_factory=dict)
+    
+    @field_validator("token", "has_subscription", "preferences", mode="before")
+    @classmethod
+    def null_as_default(cls, value: Any, info: ValidationInfo) -> Any:
+        # Colonnes nullables en base : NULL vaut la valeur par défaut
+        if value is None:
+            return cls.model_fields[info.field_name].get_default(call_default_factory=True)
+        return value
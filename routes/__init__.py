@@ -6,10 +6,16 @@ def register_routes(app):
     from .api import api_router
     from .ia import ia_router
     from .stripe import stripe_router
+    from .stories import stories_router
+    from .jobs import jobs_router
+    from .metrics import metrics_router
     
     # Enregistrer les routers
     app.include_router(health_router)
+    app.include_router(metrics_router)
     app.include_router(api_router, prefix='/api', tags=['API'])
     app.include_router(ia_router, prefix='/ia', tags=['IA'])
+    app.include_router(jobs_router, prefix='/ia/jobs', tags=['IA'])
     app.include_router(stripe_router, prefix='/stripe', tags=['Stripe'])
+    app.include_router(stories_router, prefix='/stories', tags=['Stories'])
 
@@ -1,17 +1,34 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
 import httpx
 
-from services.ia import request_ia
-from config.prompts import (
-    CREATE_PITCH, 
-    CREATE_SYNOPSIS, 
-    CREATE_CHARACTERS, 
-    CREATE_EPISODE, 
-    FIX_TEXT, 
-    REPHRASE_TEXT
+from services.ia import (
+    request_ia,
+    stream_ia,
+    response_cache,
+    inflight_stats,
+    scheduler,
+    backend_pool,
+    model_router,
+    progress_sink
 )
+from services.scheduler import OverloadedError
+from services.story_memory import build_episode_context
+from services.prompt_registry import render_prompt, get_prompt, estimate_tokens, RenderedPrompt
+from services.story_sessions import get_story_store, StoryNotFoundError
+from services.json_stream import JSONArrayStream
 from config.settings import Config
+from models import Character
+from utils.streaming import encode_event, wants_sse, media_type
+from utils.text import split_chunks, text_edits, locate_passage, context_window
+
+logger = logging.getLogger(__name__)
 
 ia_router = APIRouter()
 
@@ -24,43 +41,234 @@ class SynopsisRequest(BaseModel):
     pitch: str
 
 class CharactersRequest(BaseModel):
-    pitch: str
-    synopsis: str
+    pitch: Optional[str] = None
+    synopsis: Optional[str] = None
+    story_id: Optional[str] = None  # Histoire stockée côté serveur (remplace pitch/synopsis)
 
 class EpisodeRequest(BaseModel):
-    pitch: str
-    synopsis: str
-    personnages: str
-    numero: int = 1
+    pitch: Optional[str] = None
+    synopsis: Optional[str] = None
+    personnages: Optional[str] = None
+    numero: Optional[int] = None  # Par défaut 1, ou l'épisode suivant le dernier de l'histoire (story_id)
     episodes_precedents: list[str] = []  # Liste des contenus des épisodes précédents
+    story_id: Optional[str] = None  # Histoire stockée côté serveur (remplace les champs ci-dessus)
 
 class FixTextRequest(BaseModel):
     text: str
+    # 'full' : texte d'origine et texte corrigé, 'diff' : liste des corrections seulement
+    response_format: Literal['full', 'diff'] = 'full'
 
 class RephraseRequest(BaseModel):
     text_complete: str
     text_to_reformulate: str
 
+class BatchEpisodeRequest(BaseModel):
+    items: list[EpisodeRequest]
+    chain: bool = False  # Chaque épisode généré est ajouté au contexte de l'élément suivant
+
+class BatchFixTextRequest(BaseModel):
+    items: list[FixTextRequest]
+
+
+def _metadata(result: Dict[str, Any], *fields: str) -> Dict[str, Any]:
+    """Extrait les statistiques de génération renvoyées par Ollama et le temps d'attente en file"""
+    metadata = {field: result.get(field) for field in fields}
+    metadata["queue_wait"] = result.get("queue_wait")
+    # Réponse coupée par num_predict : le client peut la redemander
+    metadata["truncated"] = result.get("done_reason") == "length"
+    return metadata
+
+
+def _overloaded(e: OverloadedError) -> HTTPException:
+    """Réponse 503 avec Retry-After quand la file d'attente IA est pleine"""
+    return HTTPException(
+        status_code=503,
+        detail=f"{e}. Réessayez dans {e.retry_after} secondes.",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+def _story_affinity(story_id: Optional[str], *parts: str) -> str:
+    """Clé d'affinité d'une histoire : son story_id, sinon un hash de ses éléments fixes"""
+    if story_id:
+        return story_id
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def _prompt_cache(prompt: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Estime les tokens du prompt servis par le cache de prompt d'Ollama
+
+    prompt_eval_count ne compte que les tokens réellement évalués : l'écart
+    avec la taille estimée du prompt correspond au préfixe réutilisé.
+    """
+    estimate = estimate_tokens(prompt)
+    evaluated = result.get("prompt_eval_count")
+    return {
+        "prompt_tokens_estimate": estimate,
+        "prompt_eval_count": evaluated,
+        "prompt_tokens_reused": max(estimate - evaluated, 0) if evaluated is not None else None
+    }
+
+
+async def _load_story(story_id: str) -> Dict[str, Any]:
+    """Charge une histoire stockée côté serveur (404 si elle n'existe pas)"""
+    try:
+        return await get_story_store().get(story_id)
+    except StoryNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+async def _stream_generation(
+    prompt: str,
+    endpoint: str,
+    accept: Optional[str],
+    build_response: Callable[[Dict[str, Any]], Dict[str, Any]],
+    content_key: str,
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+    affinity: Optional[str] = None,
+    options: Optional[Dict[str, Any]] = None
+) -> StreamingResponse:
+    """
+    Transmet la génération au client au fil de l'eau (SSE ou NDJSON)
+
+    Chaque morceau de texte est envoyé dès sa réception. Le dernier
+    événement reprend la réponse de la route non streamée, sans le texte
+    généré (déjà transmis), avec le même bloc metadata. on_complete reçoit
+    le texte complet une fois la génération terminée.
+    """
+    sse = wants_sse(accept)
+    chunks = stream_ia(prompt, endpoint=endpoint, affinity=affinity, options=options)
+    # Ouvrir le flux avant de répondre : les erreurs de connexion sont ainsi
+    # converties en codes HTTP par la route appelante
+    first = await chunks.__anext__()
+
+    parts = []
+
+    async def encode(chunk: Dict[str, Any]) -> str:
+        if chunk.get("done"):
+            if on_complete is not None:
+                await on_complete("".join(parts))
+            final = build_response(chunk)
+            final.pop(content_key, None)
+            return encode_event({"done": True, **final}, sse, event="done")
+        if on_complete is not None:
+            parts.append(chunk.get("response", ""))
+        return encode_event({"done": False, "response": chunk.get("response", "")}, sse)
+
+    async def events():
+        try:
+            yield await encode(first)
+            async for chunk in chunks:
+                yield await encode(chunk)
+        except Exception as e:
+            yield encode_event({"done": True, "success": False, "error": str(e)}, sse, event="error")
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(events(), media_type=media_type(sse))
+
+
+def _item_error(e: Exception) -> Dict[str, Any]:
+    """Erreur d'un élément de batch (les HTTPException des routes gardent leur code)"""
+    if isinstance(e, HTTPException):
+        return {"success": False, "status_code": e.status_code, "error": e.detail}
+    return {"success": False, "status_code": 500, "error": str(e)}
+
+
+def _stream_batch(
+    count: int,
+    run_item: Callable[[int], Awaitable[Dict[str, Any]]],
+    accept: Optional[str],
+    chain: bool = False
+) -> StreamingResponse:
+    """
+    Exécute les éléments d'un batch et transmet chaque résultat dès qu'il est prêt
+
+    Les éléments sont traités en parallèle (au plus IA_BATCH_CONCURRENCY à
+    la fois), ou l'un après l'autre en mode chain. Chaque événement porte
+    l'index de l'élément : l'échec d'un élément n'interrompt pas le batch,
+    sauf en mode chain où les éléments suivants dépendent de lui. Le
+    dernier événement récapitule les succès et échecs.
+    """
+    sse = wants_sse(accept)
+    limit = asyncio.Semaphore(Config.IA_BATCH_CONCURRENCY)
+
+    async def run(index: int) -> Dict[str, Any]:
+        try:
+            async with limit:
+                return {"index": index, **await run_item(index)}
+        except Exception as e:
+            return {"index": index, **_item_error(e)}
+
+    async def results():
+        if chain:
+            for index in range(count):
+                result = await run(index)
+                yield result
+                if not result.get("success"):
+                    for skipped in range(index + 1, count):
+                        yield {"index": skipped, "success": False, "status_code": 424,
+                               "error": f"Élément {index} en échec, élément non généré"}
+                    return
+            return
+        tasks = [asyncio.ensure_future(run(index)) for index in range(count)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Client déconnecté : abandonner les éléments restants
+            for task in tasks:
+                task.cancel()
+
+    async def events():
+        succeeded = 0
+        async for result in results():
+            succeeded += bool(result.get("success"))
+            yield encode_event({"done": False, **result}, sse, event="item")
+        yield encode_event({"done": True, "total": count, "succeeded": succeeded,
+                            "failed": count - succeeded}, sse, event="done")
+
+    return StreamingResponse(events(), media_type=media_type(sse))
+
+
+def _check_batch_size(items: List[Any]) -> None:
+    if not items:
+        raise HTTPException(status_code=400, detail="Le batch ne contient aucun élément")
+    if len(items) > Config.IA_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch trop grand ({len(items)} éléments, maximum {Config.IA_BATCH_MAX_ITEMS})"
+        )
+
 
 @ia_router.post('/generate_pitch')
-async def generate_pitch(request: PitchRequest):
+async def generate_pitch(request: PitchRequest, stream: bool = False, accept: Optional[str] = Header(None)):
     """Génère 5 idées de pitch à partir d'une demande utilisateur"""
     try:
-        prompt = CREATE_PITCH.format(user_request=request.user_request)
-        result = await request_ia(prompt)
+        rendered = render_prompt('CREATE_PITCH', user_request=request.user_request)
         
-        return {
-            "success": True,
-            "model": Config.OLLAMA_MODEL,
-            "user_request": request.user_request,
-            "pitchs": result.get("response", ""),
-            "metadata": {
-                "total_duration": result.get("total_duration"),
-                "load_duration": result.get("load_duration"),
-                "prompt_eval_count": result.get("prompt_eval_count"),
-                "eval_count": result.get("eval_count")
+        def build_response(result):
+            return {
+                "success": True,
+                "model": result.get("model"),
+                "user_request": request.user_request,
+                "pitchs": result.get("response", ""),
+                "metadata": {
+                    **_metadata(result, "total_duration", "load_duration", "prompt_eval_count", "eval_count"),
+                    "prompt": rendered.stats
+                }
             }
-        }
+        
+        if stream:
+            return await _stream_generation(
+                rendered.text, 'generate_pitch', accept, build_response, "pitchs", options=rendered.options
+            )
+        
+        result = await request_ia(rendered.text, endpoint='generate_pitch', options=rendered.options, progress=True)
+        return build_response(result)
+    except OverloadedError as e:
+        raise _overloaded(e)
     except httpx.TimeoutException:
         raise HTTPException(
             status_code=504, 
@@ -84,22 +292,34 @@ async def generate_pitch(request: PitchRequest):
 
 
 @ia_router.post('/generate_synopsis')
-async def generate_synopsis(request: SynopsisRequest):
+async def generate_synopsis(request: SynopsisRequest, stream: bool = False, accept: Optional[str] = Header(None)):
     """Génère un synopsis de 10 lignes à partir d'un pitch"""
     try:
-        prompt = CREATE_SYNOPSIS.format(user_request=request.pitch)
-        result = await request_ia(prompt)
+        rendered = render_prompt('CREATE_SYNOPSIS', user_request=request.pitch)
         
-        return {
-            "success": True,
-            "model": Config.OLLAMA_MODEL,
-            "pitch": request.pitch,
-            "synopsis": result.get("response", ""),
-            "metadata": {
-                "total_duration": result.get("total_duration"),
-                "eval_count": result.get("eval_count")
+        def build_response(result):
+            return {
+                "success": True,
+                "model": result.get("model"),
+                "pitch": request.pitch,
+                "synopsis": result.get("response", ""),
+                "metadata": {
+                    **_metadata(result, "total_duration", "eval_count"),
+                    "prompt": rendered.stats
+                }
             }
-        }
+        
+        if stream:
+            return await _stream_generation(
+                rendered.text, 'generate_synopsis', accept, build_response, "synopsis", options=rendered.options
+            )
+        
+        # Prompt déterministe : les appels identiques sont servis par le cache
+        result = await request_ia(rendered.text, endpoint='generate_synopsis', cache=True, options=rendered.options,
+                                  progress=True)
+        return build_response(result)
+    except OverloadedError as e:
+        raise _overloaded(e)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout lors de la génération.")
     except httpx.ConnectError:
@@ -108,178 +328,255 @@ async def generate_synopsis(request: SynopsisRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _parse_character(raw: str) -> Dict[str, Any]:
+    """Décode et valide un personnage (ValueError s'il est mal formé)"""
+    return Character.model_validate_json(raw).model_dump(by_alias=True)
+
+
+async def _repair_character(
+    fragment: str,
+    pitch: str,
+    synopsis: str,
+    names: List[str],
+    affinity: str
+) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Redemande au modèle un personnage mal formé (au plus CHARACTERS_REPAIR_ATTEMPTS fois)
+
+    Returns:
+        Tuple (personnage valide ou None, résultats des appels IA)
+    """
+    rendered = render_prompt(
+        'REPAIR_CHARACTER',
+        fragment=fragment,
+        noms=", ".join(names) or "aucun",
+        pitch=pitch,
+        synopsis=synopsis
+    )
+    results = []
+    for _ in range(Config.CHARACTERS_REPAIR_ATTEMPTS):
+        result = await request_ia(
+            rendered.text,
+            endpoint='generate_characters',
+            affinity=affinity,
+            options=rendered.options,
+            format=Character.model_json_schema(by_alias=True)
+        )
+        results.append(result)
+        try:
+            return _parse_character(result.get("response", "")), results
+        except ValueError:
+            continue
+    return None, results
+
+
 @ia_router.post('/generate_characters')
-async def generate_characters(request: CharactersRequest):
-    """Génère 3-5 personnages principaux à partir d'un pitch et synopsis"""
+async def generate_characters(request: CharactersRequest, stream: bool = False, accept: Optional[str] = Header(None)):
+    """
+    Génère 3-5 personnages principaux à partir d'un pitch et synopsis
+
+    La sortie du modèle est contrainte par le schéma JSON des personnages
+    (sortie structurée d'Ollama) et lue au fil de l'eau : en streaming,
+    chaque personnage est transmis dès que son objet JSON est complet.
+    Seuls les personnages mal formés sont redemandés au modèle.
+    """
     try:
-        import json
-        import re
+        pitch, synopsis = request.pitch, request.synopsis
+        if request.story_id:
+            story = await _load_story(request.story_id)
+            pitch = pitch or story["pitch"]
+            synopsis = synopsis or story["synopsis"]
+        if not (pitch and synopsis):
+            raise HTTPException(status_code=400, detail="pitch et synopsis sont requis (ou un story_id complet)")
         
-        prompt = CREATE_CHARACTERS.format(
-            pitch=request.pitch,
-            synopsis=request.synopsis
-        )
-        result = await request_ia(prompt)
-        
-        # Extraire la réponse de l'IA
-        raw_response = result.get("response", "")
+        rendered = render_prompt('CREATE_CHARACTERS', pitch=pitch, synopsis=synopsis)
+        affinity = _story_affinity(request.story_id, pitch, synopsis)
+        schema = Character.list_schema(Config.CHARACTERS_MIN, Config.CHARACTERS_MAX)
         
-        print(f"[DEBUG] Réponse brute reçue: {raw_response[:500]}")
+        parser = JSONArrayStream()
+        characters: List[Dict[str, Any]] = []
+        malformed: List[str] = []
         
-        # Extraire le JSON de la réponse (même s'il y a du texte avant/après)
-        json_text = raw_response.strip()
+        def collect(text: str) -> List[Dict[str, Any]]:
+            """Valide les personnages complétés par ce morceau de texte"""
+            completed = []
+            for raw in parser.feed(text):
+                try:
+                    completed.append(_parse_character(raw))
+                except ValueError:
+                    malformed.append(raw)
+            characters.extend(completed)
+            return completed
         
-        # Méthode 1: Chercher un bloc de code markdown
-        json_match = re.search(r'```(?:json)?\s*(\[.*?\])', json_text, re.DOTALL)
-        if json_match:
-            json_text = json_match.group(1)
-            print(f"[DEBUG] JSON extrait via markdown: {json_text[:200]}")
+        async def repair() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+            """Redemande les personnages mal formés (ou interrompus) en parallèle"""
+            if parser.pending:
+                malformed.append(parser.pending)
+            names = [c["nom"] for c in characters]
+            outcomes = await asyncio.gather(*(
+                _repair_character(raw, pitch, synopsis, names, affinity) for raw in malformed
+            ))
+            repaired = [character for character, _ in outcomes if character is not None]
+            characters.extend(repaired)
+            return repaired, [result for _, results in outcomes for result in results]
         
-        # Méthode 2: Chercher un tableau JSON direct
-        else:
-            # Chercher le premier [ et le dernier ]
-            start_idx = json_text.find('[')
-            end_idx = json_text.rfind(']')
-            
-            if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                json_text = json_text[start_idx:end_idx+1]
-                print(f"[DEBUG] JSON extrait via indices: {json_text[:200]}")
-            
-            # Nettoyer les markdown restants
-            json_text = json_text.strip()
-            if json_text.startswith("```json"):
-                json_text = json_text[7:]
-            if json_text.startswith("```"):
-                json_text = json_text[3:]
-            if json_text.endswith("```"):
-                json_text = json_text[:-3]
-            json_text = json_text.strip()
-        
-        # Parser le JSON avec gestion d'erreurs détaillée
-        try:
-            characters = json.loads(json_text)
-            print(f"[DEBUG] Parsing JSON réussi, {len(characters)} personnages")
-            
-            # Valider que c'est une liste
-            if not isinstance(characters, list):
-                raise ValueError(f"La réponse n'est pas un tableau, type reçu: {type(characters)}")
-            
-            if len(characters) < 1:
-                raise ValueError("Aucun personnage trouvé dans la réponse")
-            
-            # Normaliser les champs des personnages (gérer variantes avec/sans accents)
-            field_mapping = {
-                "age": "âge",
-                "role": "rôle",
-                "perso": "personnalité",
-                "personnalite": "personnalité"
+        async def build_response(result: Dict[str, Any], repaired: List[Dict[str, Any]], repair_calls: int):
+            if not characters:
+                raise ValueError("Aucun personnage valide dans la réponse")
+            if request.story_id:
+                # Enregistrer les personnages dans l'histoire côté serveur
+                await get_story_store().update(request.story_id, {
+                    "personnages": json.dumps(characters, ensure_ascii=False)
+                })
+            return {
+                "success": True,
+                "model": result.get("model"),
+                "story_id": request.story_id,
+                "characters": characters,
+                "metadata": {
+                    **_metadata(result, "total_duration", "eval_count"),
+                    "prompt": rendered.stats,
+                    "prompt_cache": _prompt_cache(rendered.text, result),
+                    "characters_repaired": len(repaired),
+                    "characters_dropped": len(malformed) - len(repaired),
+                    "repair_calls": repair_calls
+                }
             }
+        
+        if stream:
+            sse = wants_sse(accept)
+            chunks = stream_ia(
+                rendered.text,
+                endpoint='generate_characters',
+                affinity=affinity,
+                options=rendered.options,
+                format=schema
+            )
+            # Ouvrir le flux avant de répondre : les erreurs de connexion deviennent des codes HTTP
+            first = await chunks.__anext__()
             
-            # Valider et normaliser chaque personnage
-            for i, character in enumerate(characters):
-                if not isinstance(character, dict):
-                    raise ValueError(f"Le personnage {i+1} n'est pas un objet")
-                
-                # Normaliser les noms de champs
-                normalized_character = {}
-                for key, value in character.items():
-                    # Appliquer le mapping si nécessaire
-                    if key in field_mapping:
-                        normalized_character[field_mapping[key]] = value
-                    else:
-                        normalized_character[key] = value
-                
-                # Vérifier les champs requis
-                required_fields = ["nom", "âge", "apparence", "personnalité", "rôle"]
-                missing_fields = []
-                for field in required_fields:
-                    if field not in normalized_character:
-                        # Essayer sans accent si nécessaire
-                        base_field = field.replace("âge", "age").replace("rôle", "role")
-                        if base_field in character:
-                            normalized_character[field] = character[base_field]
-                        else:
-                            missing_fields.append(field)
-                            normalized_character[field] = ""
-                
-                if missing_fields:
-                    print(f"[WARNING] Personnage {i+1} - Champs manquants: {missing_fields}, utilisation de valeurs vides")
-                
-                # Remplacer le personnage non normalisé par celui normalisé
-                characters[i] = normalized_character
-            
-            print(f"[DEBUG] Validation réussie pour {len(characters)} personnages")
-            
-        except json.JSONDecodeError as e:
-            print(f"[ERROR] Erreur JSON: {str(e)}")
-            print(f"[ERROR] Texte essayé: {json_text[:500]}")
+            async def events():
+                try:
+                    chunk = first
+                    while chunk is not None:
+                        new = collect(chunk.get("response", ""))
+                        for offset, character in enumerate(new):
+                            index = len(characters) - len(new) + offset
+                            yield encode_event({"done": False, "index": index, "character": character}, sse, event="character")
+                        if chunk.get("done"):
+                            break
+                        chunk = await anext(chunks, None)
+                    repaired, repair_results = await repair()
+                    for offset, character in enumerate(repaired):
+                        index = len(characters) - len(repaired) + offset
+                        yield encode_event({"done": False, "index": index, "character": character}, sse, event="character")
+                    final = await build_response(chunk or {}, repaired, len(repair_results))
+                    final.pop("characters", None)
+                    yield encode_event({"done": True, **final}, sse, event="done")
+                except Exception as e:
+                    yield encode_event({"done": True, "success": False, "error": str(e)}, sse, event="error")
+                finally:
+                    await chunks.aclose()
             
-            # Fallback : générer un message d'erreur avec un personnage par défaut
-            print(f"[INFO] Tentative de fallback avec un personnage par défaut")
-            characters = [{
-                "nom": "Personnage Non Généré",
-                "âge": "Non spécifié",
-                "apparence": "L'IA n'a pas pu générer cette information",
-                "personnalité": "À définir",
-                "rôle": "À définir"
-            }]
-            print(f"[WARNING] Utilisation du fallback avec un personnage par défaut")
+            return StreamingResponse(events(), media_type=media_type(sse))
         
-        return {
-            "success": True,
-            "model": Config.OLLAMA_MODEL,
-            "characters": characters,
-            "metadata": {
-                "total_duration": result.get("total_duration"),
-                "eval_count": result.get("eval_count")
-            }
-        }
+        result = await request_ia(
+            rendered.text,
+            endpoint='generate_characters',
+            affinity=affinity,
+            options=rendered.options,
+            format=schema,
+            progress=True
+        )
+        collect(result.get("response", ""))
+        repaired, repair_results = await repair()
+        return await build_response(result, repaired, len(repair_results))
+    except HTTPException:
+        raise
     except ValueError as e:
-        print(f"[ERROR] Erreur de format: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur de format dans la réponse de l'IA: {str(e)}")
+    except OverloadedError as e:
+        raise _overloaded(e)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout lors de la génération.")
     except httpx.ConnectError:
         raise HTTPException(status_code=503, detail=f"Impossible de se connecter au serveur IA ({Config.OLLAMA_URL}).")
     except Exception as e:
-        print(f"[ERROR] Exception non gérée: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Exception non gérée: %s", type(e).__name__)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @ia_router.post('/generate_episode')
-async def generate_episode(request: EpisodeRequest):
+async def generate_episode(request: EpisodeRequest, stream: bool = False, accept: Optional[str] = Header(None)):
     """Génère un épisode complet de webtoon (1500-2500 mots)"""
     try:
-        # Construire le contexte des épisodes précédents
-        contexte_episodes = ""
-        if request.episodes_precedents:
-            contexte_str = "\n\n---\n\n".join([
-                f"Épisode {i+1} :\n{episode}" 
-                for i, episode in enumerate(request.episodes_precedents)
-            ])
-            contexte_episodes = f"Épisodes précédents (pour contexte et cohérence) :\n{contexte_str}\n"
+        pitch, synopsis, personnages = request.pitch, request.synopsis, request.personnages
+        episodes_precedents = request.episodes_precedents
+        numero = request.numero if request.numero is not None else 1
+        if request.story_id:
+            # Histoire stockée côté serveur : le client n'envoie que story_id
+            # (+ numero pour régénérer un épisode, sinon l'épisode suivant est ajouté)
+            story = await _load_story(request.story_id)
+            pitch = pitch or story["pitch"]
+            synopsis = synopsis or story["synopsis"]
+            personnages = personnages or story["personnages"]
+            if request.numero is None:
+                numero = max((e["numero"] for e in story["episodes"]), default=0) + 1
+            episodes_precedents = [e["content"] for e in story["episodes"] if e["numero"] < numero]
+        if not (pitch and synopsis and personnages):
+            raise HTTPException(status_code=400, detail="pitch, synopsis et personnages sont requis (ou un story_id complet)")
         
-        prompt = CREATE_EPISODE.format(
-            pitch=request.pitch,
-            synopsis=request.synopsis,
-            personnages=request.personnages,
-            numero=request.numero,
-            contexte_episodes=contexte_episodes
-        )
-        result = await request_ia(prompt, timeout=120.0)  # Timeout plus long pour les épisodes
+        # Construire le contexte des épisodes précédents (récents en entier, anciens résumés)
+        # dans la place laissée par le reste du prompt, pour qu'il ne soit pas raccourci au rendu
+        fields = {"pitch": pitch, "synopsis": synopsis, "personnages": personnages, "numero": numero}
+        context_budget = get_prompt('CREATE_EPISODE').field_budget('contexte_episodes', **fields)
+        contexte_episodes, memory_stats = await build_episode_context(episodes_precedents, context_budget)
         
-        return {
-            "success": True,
-            "model": Config.OLLAMA_MODEL,
-            "episode_number": request.numero,
-            "episode_content": result.get("response", ""),
-            "metadata": {
-                "total_duration": result.get("total_duration"),
-                "eval_count": result.get("eval_count")
+        rendered = render_prompt('CREATE_EPISODE', contexte_episodes=contexte_episodes, **fields)
+        
+        # Même serveur d'un épisode à l'autre : le préfixe commun est déjà en cache
+        affinity = _story_affinity(request.story_id, pitch, synopsis, personnages)
+        
+        async def save_episode(content: str):
+            # Ajouter l'épisode généré à l'histoire côté serveur
+            if request.story_id:
+                await get_story_store().put_episode(request.story_id, numero, content)
+        
+        def build_response(result):
+            return {
+                "success": True,
+                "model": result.get("model"),
+                "story_id": request.story_id,
+                "episode_number": numero,
+                "episode_content": result.get("response", ""),
+                "metadata": {
+                    **_metadata(result, "total_duration", "eval_count"),
+                    "story_memory": memory_stats,
+                    "prompt": rendered.stats,
+                    "prompt_cache": _prompt_cache(rendered.text, result)
+                }
             }
-        }
+        
+        if stream:
+            # En streaming, le timeout ne porte que sur l'attente entre deux morceaux
+            return await _stream_generation(
+                rendered.text, 'generate_episode', accept, build_response, "episode_content",
+                save_episode, affinity, rendered.options
+            )
+        
+        result = await request_ia(  # Timeout plus long pour les épisodes
+            rendered.text,
+            endpoint='generate_episode',
+            affinity=affinity,
+            options=rendered.options,
+            progress=True
+        )
+        await save_episode(result.get("response", ""))
+        return build_response(result)
+    except HTTPException:
+        raise
+    except OverloadedError as e:
+        raise _overloaded(e)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout lors de la génération. Les épisodes peuvent prendre jusqu'à 2 minutes.")
     except httpx.ConnectError:
@@ -288,22 +585,123 @@ async def generate_episode(request: EpisodeRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _fix_chunk(chunk: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Corrige un morceau de texte en conservant ses espaces de début et de fin"""
+    core = chunk.strip()
+    if not core:
+        return chunk, None
+    # Le texte corrigé est transmis dans l'ordre du texte par fix_text
+    # Prompt déterministe : un paragraphe inchangé est servi par le cache
+    rendered = render_prompt('FIX_TEXT', text=core)
+    result = await request_ia(rendered.text, endpoint='fix_text', cache=True, options=rendered.options)
+    lead = chunk[:len(chunk) - len(chunk.lstrip())]
+    trail = chunk[len(chunk.rstrip()):]
+    return lead + result.get("response", "").strip() + trail, result
+
+
+async def _fix_chunks(chunks: List[Tuple[str, str]]) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Corrige les morceaux en parallèle (au plus FIX_TEXT_CONCURRENCY à la
+    fois) et les renvoie dans l'ordre du texte, séparateurs compris
+    """
+    limit = asyncio.Semaphore(Config.FIX_TEXT_CONCURRENCY)
+
+    async def fix(chunk: str):
+        async with limit:
+            return await _fix_chunk(chunk)
+
+    tasks = [asyncio.ensure_future(fix(chunk)) for chunk, _ in chunks]
+    try:
+        for task, (_, separator) in zip(tasks, chunks):
+            fixed, result = await task
+            yield fixed + separator, result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 @ia_router.post('/fix_text')
-async def fix_text(request: FixTextRequest):
-    """Corrige les fautes d'orthographe et de grammaire sans reformuler"""
+async def fix_text(request: FixTextRequest, stream: bool = False, accept: Optional[str] = Header(None)):
+    """
+    Corrige les fautes d'orthographe et de grammaire sans reformuler
+
+    Les textes longs sont découpés en morceaux alignés sur les paragraphes
+    (FIX_TEXT_CHUNK_CHARS), corrigés en parallèle puis réassemblés dans
+    l'ordre. Chaque morceau est mis en cache par contenu : après une petite
+    modification, seuls les paragraphes changés repartent vers le modèle.
+    """
     try:
-        prompt = FIX_TEXT.format(text=request.text)
-        result = await request_ia(prompt)
+        chunks = split_chunks(request.text, Config.FIX_TEXT_CHUNK_CHARS)
         
-        return {
-            "success": True,
-            "model": Config.OLLAMA_MODEL,
-            "original_text": request.text,
-            "fixed_text": result.get("response", ""),
-            "metadata": {
-                "total_duration": result.get("total_duration")
+        def build_response(fixed: str, results: List[Dict[str, Any]]):
+            response = {
+                "success": True,
+                # Modèle du premier morceau corrigé (les morceaux peuvent varier en cas de repli)
+                "model": next((r.get("model") for r in results), None),
+                "metadata": {
+                    "total_duration": sum(r.get("total_duration") or 0 for r in results if not r.get("cached")),
+                    "queue_wait": max((r.get("queue_wait") or 0 for r in results), default=0.0),
+                    "chunks": len(chunks),
+                    "chunks_cached": sum(1 for r in results if r.get("cached"))
+                }
             }
-        }
+            if request.response_format == 'diff':
+                response["edits"] = text_edits(request.text, fixed)
+            else:
+                response["original_text"] = request.text
+                response["fixed_text"] = fixed
+            return response
+        
+        if stream and len(chunks) == 1:
+            # Texte court : transmission token par token
+            rendered = render_prompt('FIX_TEXT', text=request.text)
+            return await _stream_generation(
+                rendered.text, 'fix_text', accept,
+                lambda result: build_response(result.get("response", ""), [result]),
+                "fixed_text",
+                options=rendered.options
+            )
+        
+        corrected = _fix_chunks(chunks)
+        
+        if stream:
+            # Texte long : transmission morceau par morceau, dans l'ordre
+            sse = wants_sse(accept)
+            # Attendre le premier morceau : les erreurs deviennent des codes HTTP
+            first = await corrected.__anext__()
+            
+            async def events():
+                parts, results = [], []
+                try:
+                    item = first
+                    while item is not None:
+                        text, result = item
+                        parts.append(text)
+                        if result is not None:
+                            results.append(result)
+                        yield encode_event({"done": False, "response": text}, sse)
+                        item = await anext(corrected, None)
+                    final = build_response("".join(parts), results)
+                    final.pop("fixed_text", None)
+                    yield encode_event({"done": True, **final}, sse, event="done")
+                except Exception as e:
+                    yield encode_event({"done": True, "success": False, "error": str(e)}, sse, event="error")
+                finally:
+                    await corrected.aclose()
+            
+            return StreamingResponse(events(), media_type=media_type(sse))
+        
+        sink = progress_sink.get()
+        parts, results = [], []
+        async for text, result in corrected:
+            parts.append(text)
+            if result is not None:
+                results.append(result)
+            if sink is not None:
+                sink(text)
+        return build_response("".join(parts), results)
+    except OverloadedError as e:
+        raise _overloaded(e)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout lors de la correction.")
     except httpx.ConnectError:
@@ -312,28 +710,172 @@ async def fix_text(request: FixTextRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _document_summary(text: str) -> str:
+    """Résumé d'un document pour la reformulation (mis en cache par contenu)"""
+    rendered = render_prompt('SUMMARIZE_DOCUMENT', text=text)
+    result = await request_ia(rendered.text, endpoint='summarize_document', cache=True, options=rendered.options)
+    return result.get("response", "").strip()
+
+
+async def _rephrase_prompt(request: RephraseRequest) -> Tuple[RenderedPrompt, Dict[str, Any]]:
+    """
+    Prompt de reformulation limité au voisinage du passage
+
+    Le passage est localisé dans le texte complet et seules
+    REPHRASE_WINDOW_SIZE phrases (ou paragraphes) de chaque côté sont
+    envoyées au modèle. Si le passage est introuvable, ou si la fenêtre
+    couvre presque tout le texte, le prompt complet est conservé.
+
+    Returns:
+        Tuple (prompt, statistiques pour la metadata)
+    """
+    full_prompt = render_prompt(
+        'REPHRASE_TEXT',
+        text_complete=request.text_complete,
+        text_to_reformulate=request.text_to_reformulate
+    )
+    rendered = full_prompt
+    summary = False
+    span = locate_passage(request.text_complete, request.text_to_reformulate)
+    if span is not None:
+        before, after = context_window(
+            request.text_complete, *span, Config.REPHRASE_WINDOW_SIZE, Config.REPHRASE_WINDOW_UNIT
+        )
+        resume_document = ""
+        if Config.REPHRASE_DOC_SUMMARY and len(request.text_complete) > Config.REPHRASE_SUMMARY_MIN_CHARS:
+            resume = await _document_summary(request.text_complete)
+            resume_document = f"\nRésumé du texte complet (pour la cohérence globale) :  \n\"{resume}\"\n"
+        windowed = render_prompt(
+            'REPHRASE_PASSAGE',
+            resume_document=resume_document,
+            contexte_avant=before.strip(),
+            text_to_reformulate=request.text_to_reformulate,
+            contexte_apres=after.strip()
+        )
+        if windowed.stats["prompt_tokens_estimate"] < full_prompt.stats["prompt_tokens_estimate"]:
+            rendered = windowed
+            summary = bool(resume_document)
+
+    full_tokens = full_prompt.stats["prompt_tokens_estimate"]
+    prompt_tokens = rendered.stats["prompt_tokens_estimate"]
+    return rendered, {
+        "passage_found": span is not None,
+        "windowed": rendered is not full_prompt,
+        "window": f"{Config.REPHRASE_WINDOW_SIZE} {Config.REPHRASE_WINDOW_UNIT}",
+        "document_summary": summary,
+        "prompt_tokens_full_estimate": full_tokens,
+        "prompt_tokens_estimate": prompt_tokens,
+        "prompt_tokens_saved": full_tokens - prompt_tokens,
+        "prompt_reduction": round(1 - prompt_tokens / full_tokens, 3)
+    }
+
+
 @ia_router.post('/rephrase_text')
-async def rephrase_text(request: RephraseRequest):
-    """Reformule un passage pour le rendre plus fluide"""
+async def rephrase_text(request: RephraseRequest, stream: bool = False, accept: Optional[str] = Header(None)):
+    """Reformule un passage pour le rendre plus fluide (avec le texte qui l'entoure pour contexte)"""
     try:
-        prompt = REPHRASE_TEXT.format(
-            text_complete=request.text_complete,
-            text_to_reformulate=request.text_to_reformulate
-        )
-        result = await request_ia(prompt)
+        rendered, window_stats = await _rephrase_prompt(request)
         
-        return {
-            "success": True,
-            "model": Config.OLLAMA_MODEL,
-            "original_passage": request.text_to_reformulate,
-            "rephrased_text": result.get("response", ""),
-            "metadata": {
-                "total_duration": result.get("total_duration")
+        def build_response(result):
+            return {
+                "success": True,
+                "model": result.get("model"),
+                "original_passage": request.text_to_reformulate,
+                "rephrased_text": result.get("response", ""),
+                "metadata": {
+                    **_metadata(result, "total_duration"),
+                    "prompt": rendered.stats,
+                    "prompt_window": window_stats
+                }
             }
-        }
+        
+        if stream:
+            return await _stream_generation(
+                rendered.text, 'rephrase_text', accept, build_response, "rephrased_text", options=rendered.options
+            )
+        
+        # Prompt déterministe : les appels identiques sont servis par le cache
+        result = await request_ia(rendered.text, endpoint='rephrase_text', cache=True, options=rendered.options,
+                                  progress=True)
+        return build_response(result)
+    except OverloadedError as e:
+        raise _overloaded(e)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout lors de la reformulation.")
     except httpx.ConnectError:
         raise HTTPException(status_code=503, detail=f"Impossible de se connecter au serveur IA ({Config.OLLAMA_URL}).")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@ia_router.post('/batch/generate_episode')
+async def batch_generate_episode(request: BatchEpisodeRequest, accept: Optional[str] = Header(None)):
+    """
+    Génère plusieurs épisodes en un seul appel (flux NDJSON ou SSE)
+
+    En mode chain, les épisodes sont générés dans l'ordre et chacun est
+    ajouté aux episodes_precedents de l'élément suivant.
+    """
+    _check_batch_size(request.items)
+    items = request.items
+    previous: Dict[str, Any] = {}
+
+    async def run_item(index: int) -> Dict[str, Any]:
+        item = items[index]
+        if request.chain and previous:
+            # Contexte de l'élément (ou, à défaut, celui du précédent) + épisode tout juste généré
+            context = item.episodes_precedents or previous["context"]
+            item = item.model_copy(update={"episodes_precedents": [*context, previous["content"]]})
+        result = await generate_episode(item, stream=False, accept=None)
+        previous.update(context=item.episodes_precedents, content=result["episode_content"])
+        return result
+
+    return _stream_batch(len(items), run_item, accept, chain=request.chain)
+
+
+@ia_router.post('/batch/fix_text')
+async def batch_fix_text(request: BatchFixTextRequest, accept: Optional[str] = Header(None)):
+    """Corrige plusieurs textes (ex: les paragraphes d'un chapitre) en un seul appel"""
+    _check_batch_size(request.items)
+
+    async def run_item(index: int) -> Dict[str, Any]:
+        return await fix_text(request.items[index], stream=False, accept=None)
+
+    return _stream_batch(len(request.items), run_item, accept)
+
+
+@ia_router.get('/cache/stats')
+async def cache_stats():
+    """Statistiques du cache des réponses IA (hits / misses) et du regroupement des requêtes"""
+    return {
+        "success": True,
+        "cache": response_cache.stats(),
+        "single_flight": inflight_stats()
+    }
+
+
+@ia_router.get('/scheduler/stats')
+async def scheduler_stats():
+    """État de la file d'attente IA (requêtes en cours, en attente, temps d'attente moyen)"""
+    return {
+        "success": True,
+        "scheduler": scheduler.stats()
+    }
+
+
+@ia_router.get('/models/stats')
+async def models_stats():
+    """Modèle utilisé par endpoint, p95 récent et nombre de replis sur le modèle de secours"""
+    return {
+        "success": True,
+        "models": model_router.stats()
+    }
+
+
+@ia_router.get('/backends/stats')
+async def backends_stats():
+    """État des serveurs Ollama du pool (santé, requêtes en cours, échecs)"""
+    return {
+        "success": True,
+        "backends": backend_pool.stats()
+    }
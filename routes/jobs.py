@@ -0,0 +1,147 @@
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Header, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from services.jobs import (
+    job_manager,
+    JobNotFoundError,
+    JobQueueFullError,
+    UnknownJobTypeError,
+    TERMINAL_STATUSES
+)
+from utils.streaming import encode_event, SSE_MEDIA_TYPE
+from . import ia
+
+jobs_router = APIRouter()
+
+
+# Types de job : les routes IA existantes, appelées sans streaming
+JOB_TYPES = {
+    'generate_pitch': (ia.PitchRequest, ia.generate_pitch),
+    'generate_synopsis': (ia.SynopsisRequest, ia.generate_synopsis),
+    'generate_characters': (ia.CharactersRequest, ia.generate_characters),
+    'generate_episode': (ia.EpisodeRequest, ia.generate_episode),
+    'fix_text': (ia.FixTextRequest, ia.fix_text),
+    'rephrase_text': (ia.RephraseRequest, ia.rephrase_text),
+}
+
+# Relecture du stockage pendant le flux SSE (job exécuté par un autre worker)
+STREAM_POLL_INTERVAL = 1.0
+
+
+def _route_handler(model, route):
+    async def handler(payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await route(model(**payload), stream=False, accept=None)
+    return handler
+
+
+for _job_type, (_model, _route) in JOB_TYPES.items():
+    job_manager.register(_job_type, _route_handler(_model, _route))
+
+
+class JobRequest(BaseModel):
+    type: str
+    payload: Dict[str, Any] = {}
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Représentation d'un job renvoyée aux clients"""
+    return {"job_id": job["id"], **{k: v for k, v in job.items() if k != "id"}}
+
+
+@jobs_router.post('', status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(request: JobRequest):
+    """Soumet une génération IA et renvoie immédiatement l'identifiant du job"""
+    entry = JOB_TYPES.get(request.type)
+    if entry is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Type de job inconnu: {request.type}. Types disponibles: {', '.join(JOB_TYPES)}"
+        )
+    try:
+        # Valider le payload avant de mettre le job en file
+        entry[0](**request.payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    try:
+        job = await job_manager.submit(request.type, request.payload)
+        return {"success": True, "job_id": job["id"], "status": job["status"]}
+    except UnknownJobTypeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@jobs_router.get('/stats')
+async def jobs_stats():
+    """État du pool de workers des jobs"""
+    return {"success": True, "jobs": job_manager.stats()}
+
+
+@jobs_router.get('/{job_id}')
+async def get_job(job_id: str):
+    """Statut, texte partiel et résultat d'un job"""
+    try:
+        job = await job_manager.get(job_id)
+        return {"success": True, "job": _public(job)}
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@jobs_router.get('/{job_id}/stream')
+async def stream_job(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Suit un job en SSE
+
+    Les événements "progress" transmettent le texte généré depuis
+    l'événement précédent, l'événement "done" le job complet. Leur id est
+    la longueur du texte déjà transmis : un client reconnecté (en-tête
+    Last-Event-ID) reprend là où il s'était arrêté.
+    """
+    try:
+        job = await job_manager.get(job_id)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    sent = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def events():
+        nonlocal job, sent
+        status_sent = None
+        while True:
+            if job["status"] != status_sent:
+                status_sent = job["status"]
+                yield encode_event({"status": status_sent}, True, event="status")
+            partial = job.get("partial") or ""
+            if len(partial) > sent:
+                yield encode_event({"response": partial[sent:]}, True, event="progress", event_id=str(len(partial)))
+                sent = len(partial)
+            if job["status"] in TERMINAL_STATUSES:
+                yield encode_event({"done": True, **_public(job)}, True, event="done")
+                return
+            await job_manager.wait_for_update(job_id, STREAM_POLL_INTERVAL)
+            try:
+                job = await job_manager.get(job_id)
+            except JobNotFoundError:
+                yield encode_event({"done": True, "success": False, "error": "Job expiré"}, True, event="error")
+                return
+
+    return StreamingResponse(events(), media_type=SSE_MEDIA_TYPE)
+
+
+@jobs_router.delete('/{job_id}')
+async def cancel_job(job_id: str):
+    """Annule un job en attente ou en cours"""
+    try:
+        job = await job_manager.cancel(job_id)
+        return {"success": True, "job_id": job_id, "status": job["status"]}
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from services.metrics import render_metrics, CONTENT_TYPE_LATEST
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get('/metrics', include_in_schema=False)
+async def metrics():
+    """Métriques Prometheus (latence, tokens, file d'attente de l'IA)"""
+    return Response(render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
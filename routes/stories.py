@@ -0,0 +1,83 @@
+from fastapi import APIRouter, HTTPException, status
+from pydantic import BaseModel
+from typing import Optional
+
+from services.story_sessions import get_story_store, StoryNotFoundError
+
+stories_router = APIRouter()
+
+
+class StoryCreateRequest(BaseModel):
+    pitch: Optional[str] = None
+    synopsis: Optional[str] = None
+    personnages: Optional[str] = None
+    episodes: list[str] = []  # Épisodes existants, numérotés à partir de 1
+
+class StoryUpdateRequest(BaseModel):
+    pitch: Optional[str] = None
+    synopsis: Optional[str] = None
+    personnages: Optional[str] = None
+
+class EpisodeContentRequest(BaseModel):
+    content: str
+
+
+@stories_router.post('', status_code=status.HTTP_201_CREATED)
+async def create_story(request: StoryCreateRequest):
+    """Crée une session d'histoire côté serveur"""
+    try:
+        story = await get_story_store().create(
+            request.model_dump(exclude={'episodes'}),
+            request.episodes
+        )
+        return {"success": True, "story": story}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@stories_router.get('/{story_id}')
+async def get_story(story_id: str, include_episodes: bool = True):
+    """Récupère une histoire (avec ses épisodes par défaut)"""
+    try:
+        story = await get_story_store().get(story_id, include_episodes=include_episodes)
+        return {"success": True, "story": story}
+    except StoryNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@stories_router.patch('/{story_id}')
+async def update_story(story_id: str, request: StoryUpdateRequest):
+    """Met à jour le pitch, le synopsis ou les personnages d'une histoire"""
+    try:
+        story = await get_story_store().update(story_id, request.model_dump(exclude_unset=True))
+        return {"success": True, "story": story}
+    except StoryNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@stories_router.put('/{story_id}/episodes/{numero}')
+async def put_episode(story_id: str, numero: int, request: EpisodeContentRequest):
+    """Ajoute ou remplace un épisode (ex: après édition par l'auteur)"""
+    try:
+        await get_story_store().put_episode(story_id, numero, request.content)
+        return {"success": True, "story_id": story_id, "numero": numero}
+    except StoryNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@stories_router.delete('/{story_id}')
+async def delete_story(story_id: str):
+    """Supprime une histoire et ses épisodes"""
+    try:
+        await get_story_store().delete(story_id)
+        return {"success": True, "story_id": story_id}
+    except StoryNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
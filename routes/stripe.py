@@ -1,31 +1,23 @@
-from fastapi import APIRouter, HTTPException, Body, Header
+from fastapi import APIRouter, HTTPException, Body, Header, Request
 from typing import Optional
+import logging
 import stripe
-import os
 from dotenv import load_dotenv
-from utils.supabase_client import SupabaseClient
+from services import database, payments
+from services.stripe_events import stripe_event_worker, HANDLED_EVENTS
+from services.catalog import price_catalog, InvalidCatalogItemError
 
 # Charger les variables d'environnement
 load_dotenv()
 
-stripe_router = APIRouter()
-
-# Initialiser le client Supabase
-def get_supabase_client():
-    return SupabaseClient.get_client()
+logger = logging.getLogger(__name__)
 
-# Initialiser Stripe avec la clé secrète depuis les variables d'environnement
-STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
-if STRIPE_SECRET_KEY:
-    stripe.api_key = STRIPE_SECRET_KEY
-    print(f"✅ Stripe configuré avec la clé secrète: {STRIPE_SECRET_KEY[:20]}...")
-else:
-    print("⚠️ STRIPE_SECRET_KEY non configurée")
+stripe_router = APIRouter()
 
 @stripe_router.post('/create-checkout-session')
-async def create_checkout_session(request: dict):
+async def create_checkout_session(request: dict, idempotency_key: Optional[str] = Header(None)):
     """Créer une session Stripe Checkout pour un pack de tokens"""
-    if not STRIPE_SECRET_KEY:
+    if not payments.is_configured():
         raise HTTPException(
             status_code=503,
             detail="Stripe n'est pas configuré sur le serveur"
@@ -38,40 +30,46 @@ async def create_checkout_session(request: dict):
         token_amount = request.get('token_amount', 0)
         pack_id = request.get('pack_id')
         
+        # Seuls les packs du catalogue peuvent être achetés : le nombre de
+        # tokens crédités est celui du pack, pas celui envoyé par le client
+        # (sans pack configuré, celui du client comme avant le catalogue)
+        pack = price_catalog.item(product_name, amount)
+        if pack.get('token_amount') is not None:
+            if request.get('token_amount') is not None and str(request['token_amount']) != str(pack['token_amount']):
+                raise InvalidCatalogItemError(f"token_amount ne correspond pas au pack {pack['name']}")
+            token_amount = pack['token_amount']
+        price_id = await price_catalog.get_price_id(product_name, amount)
+        
         # Créer une session de paiement
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'eur',
-                    'product_data': {
-                        'name': product_name,
-                    },
-                    'unit_amount': int(amount * 100),  # Convertir en centimes
-                },
+        session = await payments.create_checkout_session({
+            'payment_method_types': ['card'],
+            'line_items': [{
+                'price': price_id,
                 'quantity': 1,
             }],
-            mode='payment',
-            success_url=f"{request.get('success_url', 'http://localhost:5173')}?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{request.get('cancel_url', 'http://localhost:5173')}",
-            metadata={
+            'mode': 'payment',
+            'success_url': f"{request.get('success_url', 'http://localhost:5173')}?session_id={{CHECKOUT_SESSION_ID}}",
+            'cancel_url': f"{request.get('cancel_url', 'http://localhost:5173')}",
+            'metadata': {
                 'user_id': str(user_id),
                 'pack_id': str(pack_id),
                 'token_amount': str(token_amount),
                 'type': 'token_pack'
             }
-        )
+        }, idempotency_key)
         
         return {'sessionId': session.id, 'url': session.url}
         
+    except InvalidCatalogItemError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @stripe_router.post('/create-subscription-session')
-async def create_subscription_session(request: dict):
+async def create_subscription_session(request: dict, idempotency_key: Optional[str] = Header(None)):
     """Créer une session Stripe Checkout pour un abonnement"""
-    if not STRIPE_SECRET_KEY:
+    if not payments.is_configured():
         raise HTTPException(
             status_code=503,
             detail="Stripe n'est pas configuré sur le serveur"
@@ -83,115 +81,112 @@ async def create_subscription_session(request: dict):
         subscription_id = request.get('subscription_id')
         
         if not price_id:
-            # Si pas de price_id, créer un prix dynamique
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'eur',
-                        'product_data': {
-                            'name': request.get('product_name', 'Abonnement Premium'),
-                        },
-                        'unit_amount': int(request.get('amount', 9.99) * 100),
-                        'recurring': {
-                            'interval': 'month',
-                        },
-                    },
-                    'quantity': 1,
-                }],
-                mode='subscription',
-                success_url=f"{request.get('success_url', 'http://localhost:5173')}?session_id={{CHECKOUT_SESSION_ID}}",
-                cancel_url=f"{request.get('cancel_url', 'http://localhost:5173')}",
-                metadata={
-                    'user_id': str(user_id),
-                    'subscription_id': str(subscription_id),
-                    'type': 'subscription'
-                }
-            )
-        else:
-            # Utiliser le prix existant
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price': price_id,
-                    'quantity': 1,
-                }],
-                mode='subscription',
-                success_url=f"{request.get('success_url', 'http://localhost:5173')}?session_id={{CHECKOUT_SESSION_ID}}",
-                cancel_url=f"{request.get('cancel_url', 'http://localhost:5173')}",
-                metadata={
-                    'user_id': str(user_id),
-                    'subscription_id': str(subscription_id),
-                    'type': 'subscription'
-                }
+            # Si pas de price_id, prix mensuel du catalogue (créé une seule fois)
+            price_id = await price_catalog.get_price_id(
+                request.get('product_name', 'Abonnement Premium'),
+                request.get('amount', 9.99),
+                'month'
             )
+        elif not await price_catalog.is_subscription_price(price_id):
+            raise InvalidCatalogItemError(f"Prix d'abonnement inconnu ou inactif: {price_id}")
+        
+        session = await payments.create_checkout_session({
+            'payment_method_types': ['card'],
+            'line_items': [{
+                'price': price_id,
+                'quantity': 1,
+            }],
+            'mode': 'subscription',
+            'success_url': f"{request.get('success_url', 'http://localhost:5173')}?session_id={{CHECKOUT_SESSION_ID}}",
+            'cancel_url': f"{request.get('cancel_url', 'http://localhost:5173')}",
+            'metadata': {
+                'user_id': str(user_id),
+                'subscription_id': str(subscription_id),
+                'type': 'subscription'
+            }
+        }, idempotency_key)
         
         return {'sessionId': session.id, 'url': session.url}
         
+    except InvalidCatalogItemError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@stripe_router.get('/catalog')
+async def get_catalog():
+    """Prix Stripe du catalogue connus de ce processus"""
+    return price_catalog.stats()
+
+
+@stripe_router.post('/webhook')
+async def stripe_webhook(request: Request, stripe_signature: Optional[str] = Header(None)):
+    """Recevoir un événement Stripe : enregistré puis traité en tâche de fond"""
+    if not stripe_event_worker.is_running:
+        raise HTTPException(
+            status_code=503,
+            detail="Les webhooks Stripe ne sont pas configurés sur le serveur"
+        )
+    
+    try:
+        event = payments.parse_webhook_event(await request.body(), stripe_signature)
+    except (stripe.SignatureVerificationError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Webhook invalide: {e}")
+    
+    if event.get('type') not in HANDLED_EVENTS:
+        return {'received': True, 'ignored': True}
+    
+    # Stripe renvoie l'événement tant qu'il n'a pas reçu de 2xx : il est
+    # écrit dans la file durable avant de répondre
+    created = await stripe_event_worker.submit(event)
+    return {'received': True, 'duplicate': not created}
+
+
 @stripe_router.get('/verify-session/{session_id}')
 async def verify_session(session_id: str):
     """Vérifier le statut d'une session Stripe"""
-    if not STRIPE_SECRET_KEY:
+    if not payments.is_configured():
         raise HTTPException(
             status_code=503,
             detail="Stripe n'est pas configuré"
         )
     
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
+        # Session déjà appliquée (webhook ou vérification précédente) : lecture
+        # du registre, sans appel à Stripe
+        applied_session = await payments.get_applied_session(session_id)
+        if applied_session is not None:
+            metadata = {'user_id': applied_session['user_id'], 'type': applied_session['type']}
+            if applied_session['token_amount'] is not None:
+                metadata['token_amount'] = str(applied_session['token_amount'])
+            return {
+                'session_id': session_id,
+                'status': 'paid',
+                'paid': True,
+                'metadata': metadata,
+                'subscription_id': applied_session['subscription_id'],
+                'applied': True
+            }
         
-        # Si le paiement est réussi, activer l'abonnement ou ajouter les tokens
-        if session.payment_status == 'paid' and session.metadata:
-            user_id = session.metadata.get('user_id')
-            payment_type = session.metadata.get('type')
-            
-            if payment_type == 'subscription' and user_id:
-                # Activer l'abonnement Premium
-                try:
-                    supabase = get_supabase_client()
-                    stripe_subscription_id = session.get('subscription')
-                    user_data = supabase.table('user_extend').select('preferences').eq('id', user_id).execute()
-                    current_prefs = {}
-                    if user_data.data and len(user_data.data) > 0 and user_data.data[0].get('preferences'):
-                        current_prefs = user_data.data[0]['preferences'] or {}
-                    updated_prefs = { **current_prefs, 'stripe_subscription_id': stripe_subscription_id }
-                    response = supabase.table('user_extend').update({
-                        'has_subscription': True,
-                        'preferences': updated_prefs
-                    }).eq('id', user_id).execute()
-                    print(f"✅ Abonnement activé pour user {user_id}")
-                    print(f"Response: {response}")
-                except Exception as e:
-                    print(f"❌ Erreur lors de l'activation de l'abonnement: {e}")
-            
-            elif payment_type == 'token_pack' and user_id:
-                # Ajouter les tokens
-                token_amount = int(session.metadata.get('token_amount', 0))
-                if token_amount > 0:
-                    try:
-                        supabase = get_supabase_client()
-                        # Récupérer le solde actuel
-                        user_data = supabase.table('user_extend').select('token').eq('id', user_id).execute()
-                        current_tokens = user_data.data[0].get('token', 0) if user_data.data and len(user_data.data) > 0 else 0
-                        
-                        # Mettre à jour avec le nouveau solde
-                        supabase.table('user_extend').update({
-                            'token': current_tokens + token_amount
-                        }).eq('id', user_id).execute()
-                        print(f"✅ {token_amount} tokens ajoutés pour user {user_id}")
-                    except Exception as e:
-                        print(f"❌ Erreur lors de l'ajout des tokens: {e}")
+        session = await payments.retrieve_checkout_session(session_id)
+        
+        # Webhook pas encore reçu : si le paiement est réussi, activer
+        # l'abonnement ou ajouter les tokens (une seule fois par session,
+        # en une opération atomique côté base)
+        applied = False
+        try:
+            applied = await payments.apply_checkout_session(session)
+        except Exception as e:
+            logger.error("Erreur lors de l'application du paiement %s: %s", session.id, e)
         
         return {
             'session_id': session.id,
             'status': session.payment_status,
             'paid': session.payment_status == 'paid',
             'metadata': session.metadata,
-            'subscription_id': session.get('subscription')
+            'subscription_id': session.get('subscription'),
+            'applied': applied
         }
         
     except Exception as e:
@@ -201,7 +196,7 @@ async def verify_session(session_id: str):
 @stripe_router.post('/cancel-subscription')
 async def cancel_subscription(request: dict):
     """Annuler l'abonnement Stripe de l'utilisateur et mettre à jour la BDD"""
-    if not STRIPE_SECRET_KEY:
+    if not payments.is_configured():
         raise HTTPException(
             status_code=503,
             detail="Stripe n'est pas configuré sur le serveur"
@@ -213,40 +208,35 @@ async def cancel_subscription(request: dict):
         if not user_id:
             raise HTTPException(status_code=400, detail="user_id requis")
 
-        supabase = get_supabase_client()
         # Récupérer l'id d'abonnement stripe depuis la requête (prioritaire) ou les préférences
         stripe_subscription_id = provided_subscription_id
-        preferences = {}
         if not stripe_subscription_id:
-            user_resp = supabase.table('user_extend').select('preferences').eq('id', user_id).execute()
-            if not user_resp.data or len(user_resp.data) == 0:
+            user = await database.get_user(user_id, 'preferences')
+            if user is None:
                 raise HTTPException(status_code=404, detail="Utilisateur introuvable")
-            preferences = user_resp.data[0].get('preferences') or {}
-            stripe_subscription_id = preferences.get('stripe_subscription_id')
+            stripe_subscription_id = user.preferences.get('stripe_subscription_id')
 
         if not stripe_subscription_id:
             raise HTTPException(status_code=400, detail="Aucun abonnement Stripe associé à l'utilisateur")
 
         # Annuler l'abonnement immédiatement côté Stripe
         try:
-            stripe.Subscription.delete(stripe_subscription_id)
+            await payments.cancel_subscription(stripe_subscription_id)
         except Exception as e:
             # Si suppression immédiate échoue, tenter l'annulation en fin de période
             try:
-                stripe.Subscription.modify(stripe_subscription_id, cancel_at_period_end=True)
+                await payments.cancel_subscription_at_period_end(stripe_subscription_id)
             except Exception as e2:
                 raise HTTPException(status_code=500, detail=f"Stripe error: {e2}")
 
         # Mettre à jour la BDD: has_subscription = False et supprimer l'id stripe des préférences
-        preferences.pop('stripe_subscription_id', None)
-        supabase.table('user_extend').update({
-            'has_subscription': False,
-            'preferences': preferences
-        }).eq('id', user_id).execute()
+        await database.set_subscription(user_id, None)
 
         return { 'success': True }
     except HTTPException:
         raise
+    except database.UserNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
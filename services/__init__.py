@@ -3,7 +3,9 @@ Services pour PENSAGA
 Module contenant les services métier de l'application
 """
 
-from .ia import request_ia
+from .ia import request_ia, stream_ia, start_ia_client, close_ia_client, get_timeout, response_cache, scheduler, backend_pool, model_router
+from .scheduler import OverloadedError
+from .jobs import job_manager
 
-__all__ = ['request_ia']
+__all__ = ['request_ia', 'stream_ia', 'start_ia_client', 'close_ia_client', 'get_timeout', 'response_cache', 'scheduler', 'backend_pool', 'model_router', 'OverloadedError', 'job_manager']
 
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import httpx
+
+
+# États d'un serveur Ollama du pool
+HEALTHY = "healthy"
+EJECTED = "ejected"
+HALF_OPEN = "half_open"
+
+
+# Erreurs survenues avant que la requête n'atteigne le serveur : on peut
+# retenter sur un autre serveur sans risque de double génération
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Indique si l'erreur doit compter contre la santé du serveur (connexion ou 5xx)"""
+    if isinstance(error, CONNECT_ERRORS):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return False
+
+
+class Backend:
+    """Un serveur Ollama du pool et ses statistiques"""
+
+    def __init__(
+        self,
+        url: str,
+        weight: float = 1.0,
+        models: Optional[Iterable[str]] = None,
+        max_in_flight: int = 4,
+        api_key: Optional[str] = None
+    ):
+        self.url = url.rstrip("/")
+        self.weight = max(float(weight), 0.01)
+        self.models = set(models) if models else None
+        self.max_in_flight = max_in_flight
+        self.api_key = api_key
+        self.outstanding = 0
+        self.state = HEALTHY
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.last_error: Optional[str] = None
+
+    def supports(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def available(self, now: float) -> bool:
+        """Serveur sain, ou éjecté dont le délai est écoulé (une sonde autorisée)"""
+        if self.state == HEALTHY:
+            return True
+        if self.state == EJECTED:
+            return now >= self.ejected_until
+        # Demi-ouvert : une seule requête de sonde à la fois
+        return self.outstanding == 0
+
+    def load(self) -> float:
+        """Charge relative utilisée par l'équilibrage (requêtes en cours / poids)"""
+        return (self.outstanding + 1) / self.weight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "weight": self.weight,
+            "models": sorted(self.models) if self.models else None,
+            "outstanding": self.outstanding,
+            "max_in_flight": self.max_in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "last_error": self.last_error
+        }
+
+
+class BackendPool:
+    """
+    Pool de serveurs Ollama avec équilibrage "least outstanding requests"
+
+    Chaque appel est envoyé au serveur sain, compatible avec le modèle,
+    ayant le moins de requêtes en cours (pondéré par son poids). Un serveur
+    est éjecté après failure_threshold échecs consécutifs (connexion ou
+    5xx), puis remis à l'essai avec une requête de sonde après
+    ejection_time secondes.
+
+    Une clé d'affinité (ex: story_id) renvoie les appels d'une même histoire
+    vers le même serveur tant qu'il est disponible et non saturé, pour que
+    le cache de prompt d'Ollama serve le préfixe commun.
+    """
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        failure_threshold: int = 3,
+        ejection_time: float = 30.0,
+        affinity_size: int = 10000
+    ):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.affinity_size = affinity_size
+        self._affinity: "OrderedDict[str, str]" = OrderedDict()
+
+    @classmethod
+    def from_specs(cls, specs: List[Dict[str, Any]], default_max_in_flight: int, **kwargs) -> "BackendPool":
+        """Crée le pool à partir de la configuration (liste de dicts url/weight/models)"""
+        return cls([
+            Backend(
+                url=spec["url"],
+                weight=spec.get("weight", 1.0),
+                models=spec.get("models"),
+                max_in_flight=spec.get("max_in_flight", default_max_in_flight),
+                api_key=spec.get("api_key")
+            )
+            for spec in specs
+        ], **kwargs)
+
+    def reset(self, backends: List[Backend]) -> None:
+        """Remplace les serveurs du pool (ex: serveurs de test locaux)"""
+        self.backends = backends
+        self._affinity.clear()
+
+    def capacity(self) -> int:
+        """Nombre total de requêtes simultanées acceptées par les serveurs disponibles"""
+        now = time.monotonic()
+        available = [b for b in self.backends if b.available(now) or b.state == HALF_OPEN]
+        return max(sum(b.max_in_flight for b in available), 1)
+
+    def _candidates(self, model: str, exclude: Iterable[Backend] = ()) -> List[Backend]:
+        now = time.monotonic()
+        return [
+            b for b in self.backends
+            if b.supports(model) and b.available(now) and b not in exclude
+        ]
+
+    def has_candidate(self, model: str, exclude: Iterable[Backend] = ()) -> bool:
+        """Indique s'il reste un serveur disponible pour ce modèle (hors exclus)"""
+        return bool(self._candidates(model, exclude))
+
+    def _sticky(self, affinity: Optional[str], candidates: List[Backend]) -> Optional[Backend]:
+        """Serveur déjà utilisé pour cette clé, s'il est candidat et non saturé"""
+        url = self._affinity.get(affinity) if affinity else None
+        for backend in candidates:
+            if backend.url == url and backend.outstanding < backend.max_in_flight:
+                return backend
+        return None
+
+    def _remember(self, affinity: str, backend: Backend) -> None:
+        self._affinity[affinity] = backend.url
+        self._affinity.move_to_end(affinity)
+        while len(self._affinity) > self.affinity_size:
+            self._affinity.popitem(last=False)
+
+    def pick(self, model: str, exclude: Iterable[Backend] = (), affinity: Optional[str] = None) -> Backend:
+        """
+        Choisit le serveur pour un appel et réserve sa place
+
+        Raises:
+            httpx.ConnectError: Si aucun serveur disponible ne sert ce modèle
+        """
+        candidates = self._candidates(model, exclude)
+        if not candidates:
+            raise httpx.ConnectError(f"Aucun serveur IA disponible pour le modèle {model}")
+
+        backend = self._sticky(affinity, candidates)
+        if backend is None:
+            under_limit = [b for b in candidates if b.outstanding < b.max_in_flight]
+            backend = min(under_limit or candidates, key=lambda b: b.load())
+        if affinity:
+            self._remember(affinity, backend)
+        if backend.state == EJECTED:
+            backend.state = HALF_OPEN
+        backend.outstanding += 1
+        backend.requests += 1
+        return backend
+
+    def release(self, backend: Backend, error: Optional[BaseException] = None) -> None:
+        """Libère la place et met à jour la santé du serveur"""
+        backend.outstanding -= 1
+        if error is not None and is_backend_failure(error):
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            backend.last_error = f"{type(error).__name__}: {error}"
+            if backend.state == HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+                backend.state = EJECTED
+                backend.ejected_until = time.monotonic() + self.ejection_time
+                backend.ejections += 1
+        elif not isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # Le serveur a répondu (succès ou erreur côté client) : il est sain
+            backend.consecutive_failures = 0
+            backend.state = HEALTHY
+
+    @asynccontextmanager
+    async def lease(
+        self,
+        model: str,
+        exclude: Iterable[Backend] = (),
+        affinity: Optional[str] = None
+    ) -> AsyncIterator[Backend]:
+        """Réserve un serveur pour la durée du bloc"""
+        backend = self.pick(model, exclude, affinity)
+        try:
+            yield backend
+        except BaseException as e:
+            self.release(backend, e)
+            raise
+        else:
+            self.release(backend)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [backend.stats() for backend in self.backends]
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+
+def make_cache_key(
+    model: str,
+    prompt: str,
+    options: Optional[Dict[str, Any]] = None,
+    format: Optional[Any] = None
+) -> str:
+    """
+    Calcule la clé de contenu d'une requête IA
+
+    La clé est un hash SHA-256 du modèle, du prompt formaté, des options
+    de génération et du format de sortie (sérialisés de façon canonique).
+    """
+    material = json.dumps(
+        {"model": model, "prompt": prompt, "options": options or {}, "format": format},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class _SQLiteTier:
+    """Niveau disque du cache (SQLite), partagé entre les workers uvicorn"""
+
+    # Nombre d'écritures entre deux purges des entrées expirées / en trop
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ia_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM ia_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return row
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ia_cache (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, time.time())
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune()
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM ia_cache")
+            self._conn.commit()
+
+    def _prune(self) -> None:
+        """Supprime les entrées expirées puis les plus anciennes au-delà de la limite"""
+        self._conn.execute("DELETE FROM ia_cache WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM ia_cache WHERE key IN ("
+            " SELECT key FROM ia_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+
+class ResponseCache:
+    """
+    Cache des réponses IA adressé par contenu
+
+    Niveau mémoire LRU avec TTL, borné en nombre d'entrées et en taille
+    totale, et niveau disque SQLite optionnel qui survit aux redémarrages.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        max_bytes: int,
+        db_path: Optional[str] = None,
+        disk_max_entries: int = 10000
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._bytes = 0
+        self._disk = _SQLiteTier(db_path, disk_max_entries) if db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Retourne la réponse en cache ou None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, _, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(value)
+            self._evict(key)
+
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key)
+            if row is not None:
+                value, expires_at = row
+                self._store(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return json.loads(value)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, response: Dict[str, Any]) -> None:
+        """Enregistre une réponse dans le cache"""
+        value = json.dumps(response, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        self._store(key, value, expires_at)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.set, key, value, expires_at)
+
+    def clear(self) -> None:
+        """Vide le niveau mémoire et le niveau disque"""
+        self._entries.clear()
+        self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Compteurs hits/misses et occupation du cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "disk_enabled": self._disk is not None
+        }
+
+    def _store(self, key: str, value: str, expires_at: float) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._evict(oldest)
+
+    def _evict(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
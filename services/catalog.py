@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import stripe
+
+from config.settings import Config
+from . import payments
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# Clé d'un article du catalogue : (nom, montant en centimes, intervalle de
+# facturation ou None pour un achat unique)
+CatalogKey = Tuple[str, int, Optional[str]]
+
+# Marque les prix créés par le catalogue (metadata Stripe)
+_CATALOG_TAG = "pensaga_catalog"
+
+INTERVALS = ("day", "week", "month", "year")
+
+
+class InvalidCatalogItemError(ValueError):
+    """Nom, montant ou intervalle de facturation invalide, ou article absent du catalogue"""
+
+
+def to_cents(amount: Any) -> int:
+    """Montant en euros -> centimes (arrondi : 9.99 * 100 vaut 998.999...)"""
+    try:
+        cents = round(float(amount) * 100)
+    except (TypeError, ValueError):
+        raise InvalidCatalogItemError(f"Montant invalide: {amount!r}")
+    if cents <= 0:
+        raise InvalidCatalogItemError(f"Montant invalide: {amount!r}")
+    return cents
+
+
+def make_key(name: Any, amount: Any, interval: Optional[str] = None) -> CatalogKey:
+    """Valide un article (sans appel à Stripe) et renvoie sa clé"""
+    if not isinstance(name, str) or not name.strip():
+        raise InvalidCatalogItemError("Nom de produit requis")
+    if interval is not None and interval not in INTERVALS:
+        raise InvalidCatalogItemError(f"Intervalle de facturation invalide: {interval!r}")
+    return (name.strip(), to_cents(amount), interval)
+
+
+def lookup_key(key: CatalogKey) -> str:
+    """lookup_key Stripe du prix : déterministe, identique d'un processus à l'autre"""
+    name, cents, interval = key
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+    return f"pensaga_{interval or 'once'}_{cents}_{digest}"
+
+
+class PriceCatalog:
+    """
+    Prix Stripe des packs de tokens et des abonnements
+
+    Chaque article configuré (nom, montant, intervalle) correspond à un
+    Product et un Price créés une seule fois chez Stripe, puis référencés
+    par leur id dans les sessions Checkout au lieu d'un price_data qui crée
+    un nouveau prix à chaque paiement. Un article hors catalogue est refusé
+    avant tout appel à Stripe, sauf avec create_on_demand. Tant qu'aucun
+    pack n'est configuré, les packs restent acceptés tels que demandés par
+    le client (comportement d'avant le catalogue).
+    """
+
+    # Délai avant de retenter une synchronisation échouée (doublé à chaque
+    # échec, jusqu'à SYNC_MAX_RETRY_DELAY)
+    SYNC_RETRY_DELAY = 30.0
+    SYNC_MAX_RETRY_DELAY = 600.0
+
+    def __init__(self, items: List[Dict[str, Any]], create_on_demand: bool = False):
+        self.create_on_demand = create_on_demand
+        self._items: Dict[CatalogKey, Dict[str, Any]] = {}
+        for item in items:
+            try:
+                key = make_key(item.get("name"), item.get("amount"), item.get("interval"))
+            except InvalidCatalogItemError as e:
+                logger.error("Article du catalogue ignoré (%s): %s", e, item)
+                continue
+            if key[2] is None and not isinstance(item.get("token_amount"), int):
+                # Le nombre de tokens crédités ne doit pas venir du client
+                logger.error("Pack du catalogue ignoré, token_amount manquant: %s", item)
+                continue
+            self._items[key] = {**item, "name": key[0], "amount": key[1] / 100, "interval": key[2]}
+        self.has_packs = any(interval is None for _, _, interval in self._items)
+        if not self.has_packs and not create_on_demand:
+            logger.warning("Aucun pack de tokens dans STRIPE_CATALOG : les packs sont vendus au prix "
+                           "et au nombre de tokens envoyés par le client")
+        self._prices: Dict[CatalogKey, str] = {}
+        # Prix d'abonnement fournis par le client et vérifiés chez Stripe
+        self._known_prices: Set[str] = set()
+        self._creations = SingleFlight()
+        self._sync_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Synchronisation en tâche de fond : le démarrage n'attend pas Stripe"""
+        if payments.is_configured() and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._initial_sync())
+
+    async def stop(self) -> None:
+        task, self._sync_task = self._sync_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _initial_sync(self) -> None:
+        # Les prix manquants sont de toute façon créés à la première demande :
+        # la synchronisation est retentée en tâche de fond jusqu'à réussir
+        delay = self.SYNC_RETRY_DELAY
+        while True:
+            try:
+                await self.sync()
+                return
+            except Exception as e:
+                logger.warning("Synchronisation du catalogue Stripe impossible: %s, nouvel essai dans %.0fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.SYNC_MAX_RETRY_DELAY)
+
+    async def sync(self) -> int:
+        """
+        Charge les prix du catalogue déjà présents chez Stripe et crée ceux
+        des articles configurés qui manquent
+
+        Returns:
+            Nombre de prix en cache
+        """
+        client = payments.get_stripe_client()
+        page = await client.prices.list_async(params={"active": True, "limit": 100})
+        async for price in page.auto_paging_iter():
+            metadata = price.metadata or {}
+            if metadata.get(_CATALOG_TAG) and price.unit_amount:
+                interval = price.recurring.interval if price.recurring else None
+                key = (metadata.get("name", ""), price.unit_amount, interval)
+                if key in self._items or self.create_on_demand:
+                    self._prices[key] = price.id
+
+        for name, cents, interval in self._items:
+            await self.get_price_id(name, cents / 100, interval)
+        logger.info("Catalogue Stripe synchronisé: %d prix", len(self._prices))
+        return len(self._prices)
+
+    def item(self, name: Any, amount: Any, interval: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Article du catalogue (validation sans appel à Stripe)
+
+        Raises:
+            InvalidCatalogItemError: article invalide ou absent du catalogue
+        """
+        key = make_key(name, amount, interval)
+        item = self._items.get(key)
+        if item is None:
+            if not self.create_on_demand and (interval is not None or self.has_packs):
+                raise InvalidCatalogItemError(f"Article absent du catalogue: {key[0]} ({key[1] / 100:.2f} €)")
+            item = {"name": key[0], "amount": key[1] / 100, "interval": interval}
+        return item
+
+    async def get_price_id(self, name: Any, amount: Any, interval: Optional[str] = None) -> str:
+        """
+        Id du prix Stripe de l'article, créé chez Stripe s'il n'existe pas encore
+
+        Raises:
+            InvalidCatalogItemError: article invalide ou absent du catalogue
+        """
+        item = self.item(name, amount, interval)
+        key = make_key(item["name"], item["amount"], item["interval"])
+        price_id = self._prices.get(key)
+        if price_id is None:
+            price_id = await self._creations.do(lookup_key(key), lambda: self._find_or_create(key))
+        return price_id
+
+    async def is_subscription_price(self, price_id: str) -> bool:
+        """
+        price_id fourni par le client : prix d'abonnement actif chez Stripe,
+        du catalogue ou créé dans le dashboard (résultat positif gardé en cache)
+        """
+        if price_id in self._known_prices or price_id in self._prices.values():
+            return True
+        return await self._creations.do(f"retrieve-{price_id}", lambda: self._retrieve_price(price_id))
+
+    async def _retrieve_price(self, price_id: str) -> bool:
+        client = payments.get_stripe_client()
+        try:
+            price = await client.prices.retrieve_async(price_id)
+        except stripe.InvalidRequestError:
+            # Prix inexistant : non mis en cache (id arbitraire envoyé par le client)
+            return False
+        valid = bool(price.active and price.recurring)
+        if valid:
+            self._known_prices.add(price_id)
+        return valid
+
+    async def _find_or_create(self, key: CatalogKey) -> str:
+        client = payments.get_stripe_client()
+        name, cents, interval = key
+        prices = await client.prices.list_async(params={"lookup_keys": [lookup_key(key)], "active": True, "limit": 1})
+        if prices.data:
+            price = prices.data[0]
+        else:
+            # Clés d'idempotence dérivées de l'article : deux processus qui le
+            # créent en même temps obtiennent le même produit et le même prix
+            product = await client.products.create_async(
+                params={"name": name, "metadata": {_CATALOG_TAG: "1"}},
+                options={"idempotency_key": f"catalog-product-{lookup_key(key)}"}
+            )
+            params: Dict[str, Any] = {
+                "currency": "eur",
+                "unit_amount": cents,
+                "product": product.id,
+                "lookup_key": lookup_key(key),
+                "metadata": {_CATALOG_TAG: "1", "name": name}
+            }
+            if interval:
+                params["recurring"] = {"interval": interval}
+            price = await client.prices.create_async(
+                params=params,
+                options={"idempotency_key": f"catalog-price-{lookup_key(key)}"}
+            )
+            logger.info("Prix Stripe créé pour %s (%d centimes, %s): %s", name, cents, interval or "achat unique", price.id)
+        self._prices[key] = price.id
+        return price.id
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "items": [
+                {**item, "price_id": self._prices.get(key)}
+                for key, item in sorted(self._items.items(), key=lambda entry: str(entry[0]))
+            ],
+            "create_on_demand": self.create_on_demand,
+            "has_packs": self.has_packs,
+            "verified_prices": len(self._known_prices),
+            "creations": self._creations.stats()
+        }
+
+
+price_catalog = PriceCatalog(Config.STRIPE_CATALOG, create_on_demand=Config.STRIPE_CATALOG_CREATE_ON_DEMAND)
+
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from config.settings import Config
+from models import UserExtend
+
+logger = logging.getLogger(__name__)
+
+
+# Client HTTP partagé vers PostgREST (créé dans le lifespan FastAPI)
+_client: Optional[httpx.AsyncClient] = None
+
+# Erreurs temporaires : le serveur n'a pas pu traiter la requête
+_RETRY_STATUSES = {502, 503, 504}
+
+
+class UserNotFoundError(Exception):
+    """Levée quand la ligne user_extend demandée n'existe pas"""
+
+    def __init__(self, user_id: str):
+        super().__init__(f"Utilisateur introuvable: {user_id}")
+        self.user_id = user_id
+
+
+async def start_supabase_client() -> Optional[httpx.AsyncClient]:
+    """
+    Crée le client HTTP partagé vers l'API REST de Supabase (PostgREST)
+
+    Le client Supabase officiel (utils.supabase_client) est synchrone :
+    appelé depuis une route async, chaque requête bloque la boucle. Ce
+    client asynchrone garde un pool de connexions réutilisées.
+    """
+    global _client
+    if _client is not None:
+        return _client
+    if not Config.SUPABASE_URL or not Config.SUPABASE_KEY:
+        logger.warning("SUPABASE_URL ou SUPABASE_KEY non configurée")
+        return None
+
+    _client = httpx.AsyncClient(
+        base_url=f"{Config.SUPABASE_URL.rstrip('/')}/rest/v1",
+        headers={
+            "apikey": Config.SUPABASE_KEY,
+            "Authorization": f"Bearer {Config.SUPABASE_KEY}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        },
+        limits=httpx.Limits(
+            max_connections=Config.SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.SUPABASE_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        timeout=httpx.Timeout(Config.SUPABASE_TIMEOUT, connect=Config.SUPABASE_CONNECT_TIMEOUT)
+    )
+    return _client
+
+
+async def close_supabase_client() -> None:
+    """Ferme proprement le client HTTP partagé (arrêt de l'application)"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+async def get_supabase_client() -> httpx.AsyncClient:
+    """Retourne le client partagé, en le créant si le lifespan n'a pas été exécuté"""
+    client = _client or await start_supabase_client()
+    if client is None:
+        raise ValueError("Les configurations Supabase ne sont pas définies")
+    return client
+
+
+async def _request(
+    method: str,
+    path: str,
+    idempotent: bool,
+    params: Optional[Dict[str, str]] = None,
+    json: Any = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Any:
+    """
+    Requête PostgREST avec retries
+
+    Une connexion impossible est toujours retentée (la requête n'a pas été
+    envoyée). Les timeouts et erreurs 502/503/504 ne le sont que pour les
+    requêtes idempotentes, qui peuvent être rejouées sans effet de bord.
+    """
+    client = await get_supabase_client()
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, path, params=params, json=json, headers=headers)
+            response.raise_for_status()
+            return response.json() if response.content else None
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.TimeoutException, httpx.HTTPStatusError) as e:
+            retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)) or (
+                idempotent and (isinstance(e, httpx.TimeoutException)
+                                or e.response.status_code in _RETRY_STATUSES)
+            )
+            if not retryable or attempt >= Config.SUPABASE_MAX_RETRIES:
+                raise
+            delay = Config.SUPABASE_RETRY_BACKOFF * 2 ** attempt
+            attempt += 1
+            logger.warning("Supabase %s %s: %s, nouvel essai dans %.1fs", method, path, type(e).__name__, delay)
+            await asyncio.sleep(delay)
+
+
+async def select(table: str, columns: str = "*", **filters: str) -> List[Dict[str, Any]]:
+    """SELECT columns FROM table WHERE colonne = valeur pour chaque filtre"""
+    params = {"select": columns.replace(" ", ""), **{column: f"eq.{value}" for column, value in filters.items()}}
+    return await _request("GET", f"/{table}", idempotent=True, params=params)
+
+
+async def update(table: str, values: Dict[str, Any], **filters: str) -> List[Dict[str, Any]]:
+    """UPDATE table SET values WHERE colonne = valeur, renvoie les lignes modifiées"""
+    params = {column: f"eq.{value}" for column, value in filters.items()}
+    # Valeurs absolues : rejouer la requête donne le même résultat
+    return await _request("PATCH", f"/{table}", idempotent=True, params=params, json=values,
+                          headers={"Prefer": "return=representation"})
+
+
+async def rpc(function: str, params: Dict[str, Any], idempotent: bool = False) -> Any:
+    """Appelle une fonction SQL exposée par PostgREST (/rpc/<nom>)"""
+    return await _request("POST", f"/rpc/{function}", idempotent=idempotent, json=params)
+
+
+# Table user_extend : solde de tokens, abonnement et préférences des utilisateurs
+
+async def get_user(user_id: str, columns: str = "id, token, has_subscription, preferences") -> Optional[UserExtend]:
+    rows = await select('user_extend', columns, id=user_id)
+    return UserExtend.model_validate({"id": user_id, **rows[0]}) if rows else None
+
+
+async def update_user(user_id: str, **values: Any) -> UserExtend:
+    """Met à jour les colonnes données de user_extend"""
+    rows = await update('user_extend', values, id=user_id)
+    if not rows:
+        raise UserNotFoundError(user_id)
+    return UserExtend.model_validate(rows[0])
+
+
+async def get_applied_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Ligne du registre stripe_applied_sessions, None si la session n'a pas été appliquée"""
+    rows = await select('stripe_applied_sessions', 'session_id, user_id, type, token_amount, subscription_id',
+                        session_id=session_id)
+    return rows[0] if rows else None
+
+
+def _not_found(e: httpx.HTTPStatusError, user_id: str) -> Exception:
+    # Les fonctions SQL lèvent P0002 quand l'utilisateur n'existe pas (HTTP 404)
+    return UserNotFoundError(user_id) if e.response.status_code == 404 else e
+
+
+async def increment_tokens(user_id: str, amount: int) -> int:
+    """Ajoute amount tokens au solde en une requête atomique, renvoie le nouveau solde"""
+    try:
+        # Non idempotent : un retry après timeout pourrait créditer deux fois
+        return await rpc('increment_tokens', {"p_user_id": user_id, "p_amount": amount})
+    except httpx.HTTPStatusError as e:
+        raise _not_found(e, user_id)
+
+
+async def set_subscription(user_id: str, subscription_id: Optional[str]) -> Dict[str, Any]:
+    """Active (ou désactive si subscription_id est None) l'abonnement, renvoie les préférences"""
+    try:
+        return await rpc('set_subscription', {"p_user_id": user_id, "p_subscription_id": subscription_id},
+                         idempotent=True)
+    except httpx.HTTPStatusError as e:
+        raise _not_found(e, user_id)
+
+
+async def apply_token_pack(session_id: str, user_id: str, amount: int) -> Dict[str, Any]:
+    """
+    Crédite un pack de tokens une seule fois par session Stripe
+
+    Returns:
+        {"applied": True, "token": nouveau solde}, ou {"applied": False}
+        si la session avait déjà été appliquée
+    """
+    try:
+        return await rpc('apply_token_pack', {"p_session_id": session_id, "p_user_id": user_id, "p_amount": amount},
+                         idempotent=True)
+    except httpx.HTTPStatusError as e:
+        raise _not_found(e, user_id)
+
+
+async def apply_subscription(session_id: str, user_id: str, subscription_id: str) -> Dict[str, Any]:
+    """Active l'abonnement une seule fois par session Stripe (même retour que apply_token_pack)"""
+    try:
+        return await rpc('apply_subscription',
+                         {"p_session_id": session_id, "p_user_id": user_id, "p_subscription_id": subscription_id},
+                         idempotent=True)
+    except httpx.HTTPStatusError as e:
+        raise _not_found(e, user_id)
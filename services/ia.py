@@ -1,45 +1,452 @@
+import json
+import logging
+import time
 import httpx
+from contextvars import ContextVar
 from config.settings import Config
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Callable, List
+from .cache import ResponseCache, make_cache_key
+from .singleflight import SingleFlight
+from .scheduler import AdmissionScheduler, PRIORITY_NORMAL
+from .backends import Backend, BackendPool, CONNECT_ERRORS
+from .model_router import ModelRouter
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Client HTTP partagé par toute l'application (créé dans le lifespan FastAPI)
+_client: Optional[httpx.AsyncClient] = None
+
+# Cache des réponses, utilisé uniquement par les appels qui l'activent
+response_cache = ResponseCache(
+    ttl=Config.IA_CACHE_TTL,
+    max_entries=Config.IA_CACHE_MAX_ENTRIES,
+    max_bytes=Config.IA_CACHE_MAX_BYTES,
+    db_path=Config.IA_CACHE_DB_PATH,
+    disk_max_entries=Config.IA_CACHE_DISK_MAX_ENTRIES
+)
+
+# Regroupement des requêtes identiques en cours (double-clic, retry du front)
+_inflight = SingleFlight()
+
+# Réception du texte au fil de la génération (jobs asynchrones) : quand une
+# fonction est définie dans le contexte, les appels request_ia(progress=True)
+# interrogent Ollama en streaming et lui transmettent chaque morceau
+progress_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("progress_sink", default=None)
+
+
+class _ProgressFanout:
+    """Diffuse le texte d'une génération partagée à chaque progress_sink qui l'attend"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.sinks: List[Callable[[str], None]] = []
+
+    def add(self, sink: Callable[[str], None]) -> None:
+        # Arrivé en cours de génération : reçoit d'abord le texte déjà produit
+        if self.parts:
+            sink("".join(self.parts))
+        self.sinks.append(sink)
+
+    def __call__(self, text: str) -> None:
+        self.parts.append(text)
+        for sink in self.sinks:
+            sink(text)
+
+
+# Générations avec progression en cours, par clé de regroupement
+_progress_fanouts: Dict[str, _ProgressFanout] = {}
+
+# Serveurs Ollama disponibles (équilibrage least-outstanding + santé passive)
+backend_pool = BackendPool.from_specs(
+    Config.OLLAMA_BACKENDS,
+    default_max_in_flight=Config.OLLAMA_MAX_INFLIGHT,
+    failure_threshold=Config.OLLAMA_FAILURE_THRESHOLD,
+    ejection_time=Config.OLLAMA_EJECTION_TIME,
+    affinity_size=Config.OLLAMA_AFFINITY_SIZE
+)
+
+# Contrôle d'admission et file d'attente par priorité vers Ollama, la
+# capacité suit le nombre de serveurs disponibles dans le pool
+scheduler = AdmissionScheduler(
+    max_in_flight=backend_pool.capacity,
+    max_queue=Config.IA_MAX_QUEUE,
+    on_change=metrics.observe_load
+)
+
+# Modèle par endpoint, avec repli sur un modèle plus petit si la latence dérape
+model_router = ModelRouter(
+    expected_wait=lambda endpoint: scheduler.expected_wait(get_priority(endpoint)),
+    window=Config.IA_SLO_WINDOW
+)
+
+
+def _http2_available() -> bool:
+    """Vérifie que le support HTTP/2 (paquet h2) est installé"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def start_ia_client() -> httpx.AsyncClient:
+    """
+    Crée le client HTTP partagé vers Ollama
+
+    Le pool de connexions, l'expiration du keep-alive et HTTP/2 sont
+    configurés via Config. Appelé au démarrage de l'application.
+    """
+    global _client
+    if _client is not None:
+        return _client
+
+    http2 = Config.OLLAMA_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("OLLAMA_HTTP2 activé mais le paquet 'h2' n'est pas installé, utilisation de HTTP/1.1")
+        http2 = False
+
+    headers = {"Content-Type": "application/json"}
+    if Config.OLLAMA_API_KEY:
+        headers["Authorization"] = f"Bearer {Config.OLLAMA_API_KEY}"
+
+    _client = httpx.AsyncClient(
+        headers=headers,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=Config.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.OLLAMA_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(60.0, connect=Config.OLLAMA_CONNECT_TIMEOUT)
+    )
+    return _client
+
+
+async def close_ia_client() -> None:
+    """Ferme proprement le client HTTP partagé (arrêt de l'application)"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+async def get_ia_client() -> httpx.AsyncClient:
+    """Retourne le client partagé, en le créant si le lifespan n'a pas été exécuté"""
+    if _client is None:
+        return await start_ia_client()
+    return _client
+
+
+def get_timeout(endpoint: Optional[str], default: float = 60.0) -> float:
+    """Retourne le timeout configuré pour un endpoint IA"""
+    return Config.IA_TIMEOUTS.get(endpoint, default) if endpoint else default
+
+
+def get_priority(endpoint: Optional[str]) -> int:
+    """Retourne la classe de priorité configurée pour un endpoint IA"""
+    return Config.IA_PRIORITIES.get(endpoint, PRIORITY_NORMAL) if endpoint else PRIORITY_NORMAL
+
+
+def _build_payload(
+    prompt: str,
+    model: Optional[str],
+    stream: bool,
+    options: Optional[Dict[str, Any]] = None,
+    format: Optional[Any] = None
+) -> Dict[str, Any]:
+    """Construit le corps de la requête /api/generate"""
+    payload = {
+        "model": model or Config.OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": stream
+    }
+    if Config.OLLAMA_KEEP_ALIVE:
+        payload["keep_alive"] = Config.OLLAMA_KEEP_ALIVE
+    if options:
+        payload["options"] = options
+    if format is not None:
+        payload["format"] = format
+    return payload
+
+
+def _warn_if_truncated(endpoint: Optional[str], model: str, result: Dict[str, Any]) -> None:
+    """Signale une réponse coupée par num_predict (done_reason = length)"""
+    if result.get("done_reason") == "length":
+        logger.warning(
+            "Réponse IA coupée par num_predict (endpoint=%s, modèle=%s, %s tokens générés)",
+            endpoint or "other", model, result.get("eval_count")
+        )
 
 
 async def request_ia(
     prompt: str,
     model: Optional[str] = None,
-    timeout: float = 60.0
+    timeout: Optional[float] = None,
+    options: Optional[Dict[str, Any]] = None,
+    cache: bool = False,
+    endpoint: Optional[str] = None,
+    affinity: Optional[str] = None,
+    format: Optional[Any] = None,
+    progress: bool = False
 ) -> Dict[str, Any]:
     """
     Effectue une requête asynchrone à l'IA Ollama
-    
+
+    Les appels identiques concurrents sont regroupés en une seule requête
+    vers Ollama dont le résultat (ou l'erreur) est partagé. L'appel passe
+    par la file d'attente du scheduler selon la priorité de l'endpoint.
+    Avec progress=True et un progress_sink défini, le texte lui est
+    transmis au fil de la génération, y compris quand l'appel rejoint une
+    génération identique déjà en cours.
+
     Args:
         prompt: Le prompt à envoyer à l'IA
-        model: Le modèle à utiliser (par défaut: Config.OLLAMA_MODEL)
-        timeout: Timeout en secondes (par défaut: 60s)
-    
+        model: Le modèle à utiliser (par défaut: celui de l'endpoint, voir
+            model_router, sinon Config.OLLAMA_MODEL)
+        timeout: Timeout en secondes (par défaut: celui de l'endpoint, sinon 60s)
+        options: Options de génération Ollama (temperature, num_ctx, ...)
+        cache: Réutiliser une réponse identique déjà calculée (même modèle,
+            même prompt, mêmes options)
+        endpoint: Nom de l'endpoint appelant (timeout et priorité)
+        affinity: Clé d'affinité (ex: story_id) pour réutiliser le même
+            serveur, et donc son cache de prompt, d'un appel à l'autre
+        format: Sortie structurée Ollama ("json" ou schéma JSON)
+        progress: Génération finale présentée à l'utilisateur, dont le
+            texte alimente progress_sink (pas les appels auxiliaires :
+            résumés, réparations, ...)
+
     Returns:
-        Dict contenant la réponse de l'IA
-        
+        Dict contenant la réponse de l'IA, avec "queue_wait" (secondes
+        passées dans la file d'attente) et "cached" (réponse servie par
+        le cache)
+
     Raises:
+        OverloadedError: Si la file d'attente est pleine
         httpx.HTTPError: En cas d'erreur HTTP
         Exception: En cas d'erreur générale
     """
-    model = model or Config.OLLAMA_MODEL
-    url = f"{Config.OLLAMA_URL}/api/generate"
-    
-    # Préparer les headers avec la clé API si elle existe
-    headers = {"Content-Type": "application/json"}
-    if Config.OLLAMA_API_KEY:
-        headers["Authorization"] = f"Bearer {Config.OLLAMA_API_KEY}"
-    
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False
-    }
-    
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        response_json = response.json()
-        print(response_json.get("response", response_json))
-        return response_json
\ No newline at end of file
+    timeout = timeout or get_timeout(endpoint)
+    model = model or model_router.choose(endpoint)
+    payload = _build_payload(prompt, model, stream=False, options=options, format=format)
+    key = make_cache_key(payload["model"], prompt, options, format)
+
+    if cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            metrics.observe_cache_hit(endpoint, model)
+            return {**cached, "queue_wait": 0.0, "cached": True}
+
+    sink = progress_sink.get() if progress else None
+    flight_key = key
+    fanout = None
+    if sink is not None:
+        # Regroupé à part des appels sans progression (non streamés) ; le
+        # texte de la génération partagée est diffusé à chaque appelant
+        flight_key = f"{key}:progress"
+        if _inflight.is_in_flight(flight_key):
+            fanout = _progress_fanouts.get(flight_key)
+        if fanout is None:
+            fanout = _progress_fanouts[flight_key] = _ProgressFanout()
+        fanout.add(sink)
+
+    async def call() -> Dict[str, Any]:
+        try:
+            async with scheduler.slot(get_priority(endpoint)) as queue_wait:
+                metrics.observe_queue_wait(endpoint, queue_wait)
+                started = time.monotonic()
+                try:
+                    if fanout is not None:
+                        result = await _generate_with_progress(payload, timeout, affinity, fanout)
+                    else:
+                        result = await _generate(payload, timeout, affinity)
+                except httpx.TimeoutException:
+                    # Un appel en timeout compte comme un appel lent pour le choix du modèle
+                    model_router.observe(endpoint, model, time.monotonic() - started)
+                    raise
+                elapsed = time.monotonic() - started
+                model_router.observe(endpoint, model, elapsed)
+        except Exception as e:
+            metrics.observe_error(endpoint, model, e)
+            raise
+        finally:
+            if fanout is not None and _progress_fanouts.get(flight_key) is fanout:
+                del _progress_fanouts[flight_key]
+        metrics.observe_generation(endpoint, model, result, elapsed)
+        _warn_if_truncated(endpoint, model, result)
+        if cache:
+            await response_cache.set(key, result)
+        return {**result, "queue_wait": round(queue_wait, 4), "cached": False}
+
+    # Les appels identiques simultanés partagent une seule requête amont
+    try:
+        result = await _inflight.do(flight_key, call)
+    finally:
+        if fanout is not None:
+            fanout.sinks.remove(sink)
+    return dict(result)
+
+
+def _backend_headers(backend: Backend) -> Optional[Dict[str, str]]:
+    """Headers propres à un serveur (clé API différente de celle par défaut)"""
+    if backend.api_key:
+        return {"Authorization": f"Bearer {backend.api_key}"}
+    return None
+
+
+async def _generate(payload: Dict[str, Any], timeout: float, affinity: Optional[str] = None) -> Dict[str, Any]:
+    """Appel non streamé à /api/generate sur le serveur le moins chargé"""
+    client = await get_ia_client()
+    tried = []
+    while True:
+        try:
+            async with backend_pool.lease(payload["model"], exclude=tried, affinity=affinity) as backend:
+                tried.append(backend)
+                response = await client.post(
+                    f"{backend.url}/api/generate",
+                    json=payload,
+                    headers=_backend_headers(backend),
+                    timeout=httpx.Timeout(timeout, connect=Config.OLLAMA_CONNECT_TIMEOUT)
+                )
+                response.raise_for_status()
+            break
+        except CONNECT_ERRORS:
+            # Serveur injoignable : retenter sur un autre serveur du pool
+            if not backend_pool.has_candidate(payload["model"], exclude=tried):
+                raise
+    response_json = response.json()
+    # Le tableau "context" (tokens de la conversation) n'est pas réutilisé :
+    # inutile de le garder en mémoire ni dans le cache
+    response_json.pop("context", None)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Réponse IA", extra={
+            "model": payload["model"],
+            "eval_count": response_json.get("eval_count"),
+            "response": response_json.get("response", "")
+        })
+    return response_json
+
+
+def inflight_stats() -> Dict[str, int]:
+    """Statistiques du regroupement des requêtes identiques"""
+    return _inflight.stats()
+
+
+async def stream_ia(
+    prompt: str,
+    model: Optional[str] = None,
+    timeout: Optional[float] = None,
+    options: Optional[Dict[str, Any]] = None,
+    endpoint: Optional[str] = None,
+    affinity: Optional[str] = None,
+    format: Optional[Any] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Effectue une requête en streaming à l'IA Ollama
+
+    Les morceaux NDJSON renvoyés par Ollama sont transmis un par un. Le
+    timeout s'applique à l'attente entre deux morceaux et non à la durée
+    totale de la génération. La place dans le scheduler est conservée
+    jusqu'à la fin du flux.
+
+    Args:
+        prompt: Le prompt à envoyer à l'IA
+        model: Le modèle à utiliser (par défaut: celui de l'endpoint)
+        timeout: Délai maximal en secondes entre deux morceaux
+        options: Options de génération Ollama
+        endpoint: Nom de l'endpoint appelant (timeout et priorité)
+        affinity: Clé d'affinité (ex: story_id) pour réutiliser le même serveur
+        format: Sortie structurée Ollama ("json" ou schéma JSON)
+
+    Yields:
+        Dict pour chaque morceau ({"response": ..., "done": False}), le
+        dernier ayant "done": True, les statistiques de génération et
+        "queue_wait"
+
+    Raises:
+        OverloadedError: Si la file d'attente est pleine
+        httpx.HTTPError: En cas d'erreur HTTP
+    """
+    timeout = timeout or get_timeout(endpoint)
+    model = model or model_router.choose(endpoint)
+    payload = _build_payload(prompt, model, stream=True, options=options, format=format)
+
+    try:
+        async with scheduler.slot(get_priority(endpoint)) as queue_wait:
+            metrics.observe_queue_wait(endpoint, queue_wait)
+            started = time.monotonic()
+            first_token = None
+            async for chunk in _stream_chunks(payload, timeout, affinity):
+                if first_token is None and chunk.get("response"):
+                    first_token = time.monotonic() - started
+                if chunk.get("done"):
+                    elapsed = time.monotonic() - started
+                    model_router.observe(endpoint, model, elapsed)
+                    metrics.observe_generation(endpoint, model, chunk, elapsed, first_token)
+                    _warn_if_truncated(endpoint, model, chunk)
+                    yield {**chunk, "queue_wait": round(queue_wait, 4)}
+                else:
+                    yield chunk
+    except Exception as e:
+        metrics.observe_error(endpoint, model, e)
+        raise
+
+
+async def _stream_chunks(
+    payload: Dict[str, Any],
+    timeout: float,
+    affinity: Optional[str] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Appel streamé à /api/generate sur le serveur le moins chargé"""
+    client = await get_ia_client()
+    tried = []
+    while True:
+        try:
+            async with backend_pool.lease(payload["model"], exclude=tried, affinity=affinity) as backend:
+                tried.append(backend)
+                async with client.stream(
+                    "POST",
+                    f"{backend.url}/api/generate",
+                    json=payload,
+                    headers=_backend_headers(backend),
+                    timeout=httpx.Timeout(timeout, connect=Config.OLLAMA_CONNECT_TIMEOUT)
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise RuntimeError(chunk["error"])
+                        if chunk.get("done"):
+                            chunk.pop("context", None)
+                            yield chunk
+                            break
+                        yield chunk
+            return
+        except CONNECT_ERRORS:
+            # La connexion échoue avant tout morceau : retenter ailleurs
+            if not backend_pool.has_candidate(payload["model"], exclude=tried):
+                raise
+
+
+async def _generate_with_progress(
+    payload: Dict[str, Any],
+    timeout: float,
+    affinity: Optional[str],
+    sink: Callable[[str], None]
+) -> Dict[str, Any]:
+    """Génération streamée vers sink, retournée sous la même forme qu'un appel non streamé"""
+    parts = []
+    final: Dict[str, Any] = {}
+    async for chunk in _stream_chunks({**payload, "stream": True}, timeout, affinity):
+        if chunk.get("done"):
+            final = chunk
+            break
+        text = chunk.get("response", "")
+        parts.append(text)
+        sink(text)
+    return {**final, "response": "".join(parts)}
@@ -0,0 +1,438 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from config.settings import Config
+from utils.supabase_client import SupabaseClient
+from utils.log import request_id
+from .ia import progress_sink
+
+logger = logging.getLogger(__name__)
+
+
+# Statuts d'un job
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Champs d'un job persistés dans le stockage
+JOB_FIELDS = ("id", "type", "status", "partial", "result", "error", "created_at", "updated_at", "expires_at")
+
+
+class JobNotFoundError(Exception):
+    """Levée quand le job demandé n'existe pas (ou a expiré)"""
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Job introuvable: {job_id}")
+        self.job_id = job_id
+
+
+class JobQueueFullError(Exception):
+    """Levée quand trop de jobs sont déjà en attente"""
+
+
+class UnknownJobTypeError(ValueError):
+    """Levée pour un type de job non enregistré"""
+
+
+class JobStore(ABC):
+    """Stockage des jobs et de leurs résultats, avec expiration (TTL)"""
+
+    @abstractmethod
+    async def save(self, job: Dict[str, Any]) -> None:
+        """
+        Enregistre le job (création ou mise à jour)
+
+        Un job annulé n'est jamais réécrit avec un autre statut : une
+        annulation faite depuis une autre instance n'est pas écrasée par
+        le worker qui exécute le job.
+        """
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def purge(self) -> None:
+        """Supprime les jobs expirés"""
+
+
+class MemoryJobStore(JobStore):
+    """Stockage en mémoire (un seul worker uvicorn)"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    async def save(self, job: Dict[str, Any]) -> None:
+        current = self._jobs.get(job["id"])
+        if current is not None and current["status"] == CANCELLED and job["status"] != CANCELLED:
+            return
+        self._jobs[job["id"]] = dict(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None or job["expires_at"] <= time.time():
+            return None
+        return dict(job)
+
+    async def purge(self) -> None:
+        now = time.time()
+        for job_id in [k for k, job in self._jobs.items() if job["expires_at"] <= now]:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore(JobStore):
+    """Stockage SQLite local, partagé entre les workers d'une même machine"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ia_jobs ("
+            " id TEXT PRIMARY KEY, type TEXT NOT NULL, status TEXT NOT NULL,"
+            " partial TEXT, result TEXT, error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        row = {**job, "result": json.dumps(job["result"]), "error": json.dumps(job["error"])}
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO ia_jobs ({', '.join(JOB_FIELDS)})"
+                f" VALUES ({', '.join('?' for _ in JOB_FIELDS)})"
+                f" ON CONFLICT (id) DO UPDATE SET {', '.join(f'{f} = excluded.{f}' for f in JOB_FIELDS[1:])}"
+                " WHERE ia_jobs.status != ? OR excluded.status = ?",
+                (*(row[f] for f in JOB_FIELDS), CANCELLED, CANCELLED)
+            )
+            self._conn.commit()
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM ia_jobs WHERE id = ? AND expires_at > ?",
+                (job_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["result"] = json.loads(job["result"])
+        job["error"] = json.loads(job["error"])
+        return job
+
+    def _purge(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM ia_jobs WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    async def save(self, job: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._save, job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def purge(self) -> None:
+        await asyncio.to_thread(self._purge)
+
+
+class SupabaseJobStore(JobStore):
+    """Stockage Supabase (table ia_jobs), partagé entre toutes les instances"""
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        table = SupabaseClient.get_client().table('ia_jobs')
+        if job["status"] in (QUEUED, CANCELLED):
+            table.upsert(job).execute()
+        else:
+            # Ligne créée à la soumission : mise à jour sauf si le job a été annulé
+            table.update(job).eq('id', job["id"]).neq('status', CANCELLED).execute()
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        response = SupabaseClient.get_client().table('ia_jobs').select('*') \
+            .eq('id', job_id).gt('expires_at', time.time()).execute()
+        return response.data[0] if response.data else None
+
+    def _purge(self) -> None:
+        SupabaseClient.get_client().table('ia_jobs').delete().lte('expires_at', time.time()).execute()
+
+    # Le client Supabase est synchrone : les appels sont faits hors de la boucle d'événements
+    async def save(self, job: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._save, job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def purge(self) -> None:
+        await asyncio.to_thread(self._purge)
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class JobManager:
+    """
+    Exécution asynchrone des générations IA
+
+    Les jobs soumis sont placés dans une file bornée et traités par un
+    nombre fixe de workers asyncio. Le texte produit pendant la génération
+    est disponible au fil de l'eau (partial), le résultat final est
+    conservé dans le stockage jusqu'à expiration.
+    """
+
+    # Intervalle entre deux purges des jobs expirés (secondes)
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, store: JobStore, workers: int, max_pending: int, ttl: float, progress_interval: float):
+        self.store = store
+        self.workers = workers
+        self.ttl = ttl
+        self.progress_interval = progress_interval
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_pending)
+        self._payloads: Dict[str, Dict[str, Any]] = {}
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        # Jobs annulés à la demande de l'utilisateur (et non par l'arrêt d'un worker)
+        self._cancelled: Set[str] = set()
+        self._listeners: Dict[str, Set[asyncio.Event]] = {}
+        self._tasks: list = []
+
+    def register(self, job_type: str, handler: JobHandler) -> None:
+        """Enregistre un type de job (handler appelé avec le payload)"""
+        self._handlers[job_type] = handler
+
+    @property
+    def job_types(self):
+        return sorted(self._handlers)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Crée un job et le place dans la file
+
+        Raises:
+            UnknownJobTypeError: Si le type n'est pas enregistré
+            JobQueueFullError: Si la file d'attente est pleine
+        """
+        if job_type not in self._handlers:
+            raise UnknownJobTypeError(f"Type de job inconnu: {job_type}")
+        if self._queue.full():
+            raise JobQueueFullError("Trop de jobs en attente")
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "type": job_type,
+            "status": QUEUED,
+            "partial": "",
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + self.ttl
+        }
+        self._jobs[job["id"]] = job
+        self._payloads[job["id"]] = payload
+        await self.store.save(job)
+        self._queue.put_nowait(job["id"])
+        return dict(job)
+
+    async def get(self, job_id: str) -> Dict[str, Any]:
+        """Etat d'un job : version en mémoire si le job tourne ici, sinon le stockage"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+        job = await self.store.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    async def cancel(self, job_id: str) -> Dict[str, Any]:
+        """
+        Annule un job en attente ou en cours
+
+        Un job exécuté par une autre instance est marqué annulé dans le
+        stockage ; cette instance l'arrête à sa prochaine sauvegarde.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            stored = await self.get(job_id)
+            if stored["status"] in TERMINAL_STATUSES:
+                return stored
+            # Job d'une autre instance : marqué annulé dans le stockage
+            await self._update(stored, status=CANCELLED)
+            return stored
+
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancelled.add(job_id)
+            if task.cancel():
+                await self._update(job, status=CANCELLED)
+        elif job["status"] == QUEUED:
+            await self._update(job, status=CANCELLED)
+        return dict(job)
+
+    async def wait_for_update(self, job_id: str, timeout: float) -> None:
+        """Attend une mise à jour du job (ou le timeout, pour relire le stockage)"""
+        event = asyncio.Event()
+        self._listeners.setdefault(job_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            listeners = self._listeners.get(job_id)
+            if listeners is not None:
+                listeners.discard(event)
+                if not listeners:
+                    del self._listeners[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending": self._queue.qsize(),
+            "running": len(self._running),
+            "job_types": self.job_types
+        }
+
+    def _notify(self, job_id: str) -> None:
+        for event in self._listeners.get(job_id, ()):
+            event.set()
+
+    async def _update(self, job: Dict[str, Any], **fields) -> None:
+        job.update(fields, updated_at=time.time())
+        await self.store.save(job)
+        self._notify(job["id"])
+
+    async def _cancelled_elsewhere(self, job: Dict[str, Any]) -> bool:
+        """Le job a-t-il été annulé depuis une autre instance (statut du stockage)"""
+        stored = await self.store.get(job["id"])
+        if stored is None or stored["status"] != CANCELLED:
+            return False
+        job.update(status=CANCELLED, updated_at=stored["updated_at"])
+        self._notify(job["id"])
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        job = self._jobs.get(job_id)
+        payload = self._payloads.pop(job_id, None)
+        if job is None or job["status"] != QUEUED or await self._cancelled_elsewhere(job):
+            self._jobs.pop(job_id, None)
+            return
+
+        await self._update(job, status=RUNNING)
+        last_save = time.monotonic()
+        saving: Optional[asyncio.Future] = None
+
+        def on_progress(text: str) -> None:
+            nonlocal last_save, saving
+            job["partial"] += text
+            self._notify(job_id)
+            # Persister le texte partiel au plus toutes les progress_interval
+            # secondes, une sauvegarde à la fois
+            if (saving is None or saving.done()) and time.monotonic() - last_save >= self.progress_interval:
+                last_save = time.monotonic()
+                saving = asyncio.ensure_future(save_progress())
+
+        async def save_progress() -> None:
+            await self.store.save(dict(job))
+            if await self._cancelled_elsewhere(job):
+                self._cancelled.add(job_id)
+                task.cancel()
+
+        async def finish(**fields) -> None:
+            # La sauvegarde du texte partiel en cours se termine avant l'état
+            # final : un instantané "running" ne peut pas l'écraser
+            if saving is not None:
+                await asyncio.gather(saving, return_exceptions=True)
+            if fields["status"] != CANCELLED and await self._cancelled_elsewhere(job):
+                return
+            await self._update(job, **fields)
+
+        # La tâche copie le contexte : texte partiel et logs rattachés au job
+        token = progress_sink.set(on_progress)
+        rid_token = request_id.set(job_id)
+        task = asyncio.ensure_future(self._handlers[job["type"]](payload))
+        request_id.reset(rid_token)
+        progress_sink.reset(token)
+        self._running[job_id] = task
+        try:
+            result = await task
+            await finish(status=SUCCEEDED, result=result)
+        except asyncio.CancelledError:
+            if job_id not in self._cancelled:
+                # Arrêt du worker lui-même (la tâche du handler est annulée avec lui)
+                task.cancel()
+                raise
+            if job["status"] != CANCELLED:
+                await finish(status=CANCELLED)
+        except Exception as e:
+            await finish(status=FAILED, error=_describe_error(e))
+        finally:
+            self._running.pop(job_id, None)
+            self._cancelled.discard(job_id)
+            self._jobs.pop(job_id, None)
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.PURGE_INTERVAL)
+            try:
+                await self.store.purge()
+            except Exception as e:
+                logger.warning("Purge des jobs expirés impossible: %s", e)
+
+
+def _describe_error(error: Exception) -> Dict[str, Any]:
+    """Erreur d'un job sous forme sérialisable (HTTPException des routes comprises)"""
+    status_code = getattr(error, "status_code", 500)
+    detail = getattr(error, "detail", None) or str(error)
+    return {"status_code": status_code, "detail": detail, "type": type(error).__name__}
+
+
+def _create_store() -> JobStore:
+    if Config.JOB_STORE == 'sqlite':
+        return SQLiteJobStore(Config.JOB_DB_PATH)
+    if Config.JOB_STORE == 'supabase':
+        return SupabaseJobStore()
+    return MemoryJobStore()
+
+
+job_manager = JobManager(
+    store=_create_store(),
+    workers=Config.JOB_WORKERS,
+    max_pending=Config.JOB_MAX_PENDING,
+    ttl=Config.JOB_TTL,
+    progress_interval=Config.JOB_PROGRESS_INTERVAL
+)
@@ -0,0 +1,82 @@
+from typing import List
+
+
+class JSONArrayStream:
+    """
+    Découpe incrémentale d'un tableau JSON reçu morceau par morceau
+
+    Chaque élément du tableau de premier niveau est renvoyé (sous forme de
+    texte JSON brut) dès que sa dernière accolade ou son dernier crochet
+    est reçu, sans attendre la fin de la génération. Le texte précédant le
+    premier "[" (ex: bloc markdown) est ignoré. Le décodage et la
+    validation de chaque élément restent à la charge de l'appelant : un
+    élément mal formé n'empêche pas de lire les suivants.
+    """
+
+    def __init__(self):
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item: List[str] = []
+
+    @property
+    def finished(self) -> bool:
+        """Le tableau de premier niveau a été refermé"""
+        return self._finished
+
+    @property
+    def pending(self) -> str:
+        """Élément commencé mais pas encore terminé (ex: génération interrompue)"""
+        return "".join(self._item).strip()
+
+    def feed(self, text: str) -> List[str]:
+        """Ajoute un morceau de texte et renvoie les éléments terminés"""
+        items = []
+        for char in text:
+            if self._finished:
+                break
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                continue
+
+            if self._in_string:
+                self._item.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                # Entre deux éléments : séparateurs ou fin du tableau
+                if char == "]":
+                    self._finish(items)
+                    self._finished = True
+                    continue
+                if char == ",":
+                    self._finish(items)
+                    continue
+                if char.isspace() and not self._item:
+                    continue
+
+            self._item.append(char)
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish(items)
+        return items
+
+    def _finish(self, items: List[str]) -> None:
+        item = "".join(self._item).strip()
+        self._item = []
+        if item:
+            items.append(item)
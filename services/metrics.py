@@ -0,0 +1,201 @@
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest
+)
+from prometheus_client import multiprocess
+
+from .backends import CONNECT_ERRORS
+from .scheduler import OverloadedError
+
+
+# Les métriques sont enregistrées en mémoire, sans appel réseau ni verrou
+# partagé entre workers. Avec plusieurs workers uvicorn, définir
+# PROMETHEUS_MULTIPROC_DIR (répertoire vide à chaque démarrage) : chaque
+# processus écrit ses valeurs dans ses propres fichiers, agrégés à la lecture.
+
+# Durées d'inférence : de la correction courte à l'épisode complet
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+# Longueur des réponses : de la correction courte à l'épisode complet
+OUTPUT_TOKENS_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+REQUEST_DURATION = Histogram(
+    'pensaga_ia_request_duration_seconds',
+    "Durée des appels au serveur IA (hors attente dans la file)",
+    ['endpoint', 'model'],
+    buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    'pensaga_ia_time_to_first_token_seconds',
+    "Délai avant le premier token généré",
+    ['endpoint', 'model'],
+    buckets=LATENCY_BUCKETS
+)
+MODEL_LOAD_DURATION = Histogram(
+    'pensaga_ia_model_load_seconds',
+    "Temps de chargement du modèle rapporté par Ollama",
+    ['model'],
+    buckets=LATENCY_BUCKETS
+)
+QUEUE_WAIT = Histogram(
+    'pensaga_ia_queue_wait_seconds',
+    "Temps passé dans la file d'attente du scheduler",
+    ['endpoint'],
+    buckets=LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    'pensaga_ia_eval_tokens_per_second',
+    "Débit de génération (tokens générés par seconde)",
+    ['endpoint', 'model'],
+    buckets=TOKENS_PER_SECOND_BUCKETS
+)
+PROMPT_TOKENS = Counter(
+    'pensaga_ia_prompt_tokens',
+    "Tokens de prompt évalués par le modèle",
+    ['endpoint', 'model']
+)
+EVAL_TOKENS = Counter(
+    'pensaga_ia_eval_tokens',
+    "Tokens générés par le modèle",
+    ['endpoint', 'model']
+)
+OUTPUT_TOKENS = Histogram(
+    'pensaga_ia_output_tokens',
+    "Tokens générés par réponse (pour fixer num_predict de chaque prompt)",
+    ['endpoint', 'model'],
+    buckets=OUTPUT_TOKENS_BUCKETS
+)
+TRUNCATED = Counter(
+    'pensaga_ia_truncated',
+    "Réponses coupées par la limite num_predict (done_reason = length)",
+    ['endpoint', 'model']
+)
+REQUESTS = Counter(
+    'pensaga_ia_requests',
+    "Appels IA par résultat (success, cache_hit, error)",
+    ['endpoint', 'model', 'outcome']
+)
+ERRORS = Counter(
+    'pensaga_ia_errors',
+    "Erreurs des appels IA par classe (timeout, connect, http_<code>, overloaded, other)",
+    ['endpoint', 'model', 'error']
+)
+IN_FLIGHT = Gauge(
+    'pensaga_ia_in_flight',
+    "Requêtes en cours vers le serveur IA",
+    multiprocess_mode='livesum'
+)
+QUEUED = Gauge(
+    'pensaga_ia_queued',
+    "Requêtes en attente dans la file du scheduler",
+    multiprocess_mode='livesum'
+)
+
+# Stripe : lectures des sessions Checkout (cache de services.payments)
+STRIPE_SESSION_LOOKUPS = Counter(
+    'pensaga_stripe_session_lookups',
+    "Lectures de sessions Checkout par résultat (hit, coalesced : appel Stripe évité ; miss)",
+    ['outcome']
+)
+
+# Ollama exprime ses durées en nanosecondes
+_NS = 1e9
+
+
+def error_class(error: BaseException) -> str:
+    """Classe d'erreur utilisée comme label"""
+    if isinstance(error, OverloadedError):
+        return "overloaded"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, CONNECT_ERRORS):
+        return "connect"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"http_{error.response.status_code}"
+    return "other"
+
+
+def _label(endpoint: Optional[str]) -> str:
+    return endpoint or "other"
+
+
+def observe_generation(
+    endpoint: Optional[str],
+    model: str,
+    result: Dict[str, Any],
+    duration: float,
+    time_to_first_token: Optional[float] = None
+) -> None:
+    """
+    Enregistre un appel réussi et les statistiques renvoyées par Ollama
+
+    Sans mesure directe (appel non streamé), le délai avant le premier
+    token est estimé par le chargement du modèle plus l'évaluation du prompt.
+    """
+    endpoint = _label(endpoint)
+    REQUESTS.labels(endpoint, model, "success").inc()
+    REQUEST_DURATION.labels(endpoint, model).observe(duration)
+
+    load = result.get("load_duration")
+    if load:
+        MODEL_LOAD_DURATION.labels(model).observe(load / _NS)
+    if time_to_first_token is None and result.get("prompt_eval_duration") is not None:
+        time_to_first_token = ((load or 0) + result["prompt_eval_duration"]) / _NS
+    if time_to_first_token is not None:
+        TIME_TO_FIRST_TOKEN.labels(endpoint, model).observe(time_to_first_token)
+
+    if result.get("prompt_eval_count"):
+        PROMPT_TOKENS.labels(endpoint, model).inc(result["prompt_eval_count"])
+    eval_count = result.get("eval_count")
+    if eval_count:
+        EVAL_TOKENS.labels(endpoint, model).inc(eval_count)
+        OUTPUT_TOKENS.labels(endpoint, model).observe(eval_count)
+        if result.get("eval_duration"):
+            TOKENS_PER_SECOND.labels(endpoint, model).observe(eval_count / (result["eval_duration"] / _NS))
+    if result.get("done_reason") == "length":
+        TRUNCATED.labels(endpoint, model).inc()
+
+
+def observe_cache_hit(endpoint: Optional[str], model: str) -> None:
+    REQUESTS.labels(_label(endpoint), model, "cache_hit").inc()
+
+
+def observe_error(endpoint: Optional[str], model: str, error: BaseException) -> None:
+    endpoint = _label(endpoint)
+    REQUESTS.labels(endpoint, model, "error").inc()
+    ERRORS.labels(endpoint, model, error_class(error)).inc()
+
+
+def observe_queue_wait(endpoint: Optional[str], wait: float) -> None:
+    QUEUE_WAIT.labels(_label(endpoint)).observe(wait)
+
+
+def observe_load(in_flight: int, queued: int) -> None:
+    """Appelé par le scheduler à chaque entrée ou sortie de requête"""
+    IN_FLIGHT.set(in_flight)
+    QUEUED.set(queued)
+
+
+def observe_stripe_session_lookup(outcome: str) -> None:
+    STRIPE_SESSION_LOOKUPS.labels(outcome).inc()
+
+
+def render_metrics() -> bytes:
+    """Exposition au format texte Prometheus (agrégée entre workers si besoin)"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+__all__ = ['CONTENT_TYPE_LATEST', 'render_metrics']
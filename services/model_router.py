@@ -0,0 +1,89 @@
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from config.settings import Config
+
+
+class ModelRouter:
+    """
+    Choix du modèle par endpoint avec repli selon un objectif de latence
+
+    Chaque endpoint a son modèle (IA_MODELS, sinon OLLAMA_MODEL). Si un
+    modèle de repli est configuré (IA_FALLBACK_MODELS), il est utilisé
+    quand l'attente prévue dans la file dépasse IA_SLO_QUEUE_WAIT ou quand
+    le p95 récent du modèle principal dépasse l'objectif de l'endpoint
+    (IA_SLO_P95). Seules les mesures des window dernières secondes
+    comptent : le modèle principal est réessayé une fois les appels lents
+    sortis de la fenêtre.
+    """
+
+    # Nombre minimal de mesures avant de se fier au p95
+    MIN_SAMPLES = 5
+
+    def __init__(
+        self,
+        expected_wait: Callable[[str], float],
+        window: float = 300.0,
+        max_samples: int = 200
+    ):
+        self.expected_wait = expected_wait
+        self.window = window
+        self.max_samples = max_samples
+        self._samples: Dict[Tuple[str, str], Deque[Tuple[float, float]]] = {}
+        self.fallbacks: Dict[str, int] = {}
+
+    def primary(self, endpoint: Optional[str]) -> str:
+        return (Config.IA_MODELS.get(endpoint) if endpoint else None) or Config.OLLAMA_MODEL
+
+    def observe(self, endpoint: Optional[str], model: str, duration: float) -> None:
+        """Enregistre la durée d'un appel (hors attente dans la file)"""
+        if not endpoint:
+            return
+        samples = self._samples.setdefault((endpoint, model), deque(maxlen=self.max_samples))
+        samples.append((time.monotonic(), duration))
+
+    def p95(self, endpoint: str, model: str) -> Optional[float]:
+        """p95 des durées récentes (None s'il y a trop peu de mesures)"""
+        samples = self._samples.get((endpoint, model))
+        if not samples:
+            return None
+        horizon = time.monotonic() - self.window
+        while samples and samples[0][0] < horizon:
+            samples.popleft()
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        durations = sorted(duration for _, duration in samples)
+        return durations[min(math.ceil(0.95 * len(durations)) - 1, len(durations) - 1)]
+
+    def choose(self, endpoint: Optional[str]) -> str:
+        """Modèle à utiliser pour un appel de cet endpoint"""
+        model = self.primary(endpoint)
+        fallback = Config.IA_FALLBACK_MODELS.get(endpoint) if endpoint else None
+        if not fallback or fallback == model:
+            return model
+
+        slo = Config.IA_SLO_P95.get(endpoint)
+        p95 = self.p95(endpoint, model)
+        if self.expected_wait(endpoint) > Config.IA_SLO_QUEUE_WAIT or (slo and p95 is not None and p95 > slo):
+            self.fallbacks[endpoint] = self.fallbacks.get(endpoint, 0) + 1
+            return fallback
+        return model
+
+    def stats(self) -> Dict[str, Any]:
+        endpoints = sorted(set(Config.IA_MODELS) | set(Config.IA_FALLBACK_MODELS))
+        return {
+            endpoint: {
+                "model": self.primary(endpoint),
+                "fallback_model": Config.IA_FALLBACK_MODELS.get(endpoint),
+                "slo_p95": Config.IA_SLO_P95.get(endpoint),
+                "p95": {
+                    model: round(p95, 3)
+                    for (name, model) in list(self._samples)
+                    if name == endpoint and (p95 := self.p95(endpoint, model)) is not None
+                },
+                "fallbacks": self.fallbacks.get(endpoint, 0)
+            }
+            for endpoint in endpoints
+        }
@@ -0,0 +1,227 @@
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import stripe
+
+from config.settings import Config
+from . import database, metrics
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# Client Stripe partagé (créé dans le lifespan FastAPI) : appels asynchrones
+# via httpx, connexions réutilisées d'un appel à l'autre
+_client: Optional[stripe.StripeClient] = None
+_http_client: Optional[stripe.HTTPXClient] = None
+
+# Sessions Checkout déjà appliquées (vues par ce processus) : une
+# vérification répétée ne refait aucun appel à Supabase
+_applied_sessions: "OrderedDict[str, None]" = OrderedDict()
+
+# Sessions Checkout lues chez Stripe : (session, expiration). La page de
+# succès interroge verify-session en boucle, chaque lecture coûte un appel
+# Stripe (~300 ms, compté dans la limite de débit de l'API)
+_sessions: "OrderedDict[str, Tuple[stripe.checkout.Session, float]]" = OrderedDict()
+_session_lookups = SingleFlight()
+
+
+class PaymentsNotConfiguredError(Exception):
+    """STRIPE_SECRET_KEY n'est pas définie"""
+
+
+def is_configured() -> bool:
+    return bool(Config.STRIPE_SECRET_KEY)
+
+
+def start_stripe_client() -> Optional[stripe.StripeClient]:
+    """
+    Crée le client Stripe partagé
+
+    Les requêtes passent par un client httpx asynchrone : un appel Stripe
+    ne bloque plus la boucle asyncio. Les erreurs réseau et les réponses
+    409/429/5xx sont retentées (STRIPE_MAX_NETWORK_RETRIES) avec la même
+    clé d'idempotence, sans risque de créer deux fois le même objet.
+    """
+    global _client, _http_client
+    if _client is not None:
+        return _client
+    if not is_configured():
+        logger.warning("STRIPE_SECRET_KEY non configurée")
+        return None
+
+    _http_client = stripe.HTTPXClient(
+        timeout=httpx.Timeout(Config.STRIPE_TIMEOUT, connect=Config.STRIPE_CONNECT_TIMEOUT)
+    )
+    base_addresses = {"api": Config.STRIPE_API_BASE} if Config.STRIPE_API_BASE else {}
+    _client = stripe.StripeClient(
+        Config.STRIPE_SECRET_KEY,
+        http_client=_http_client,
+        max_network_retries=Config.STRIPE_MAX_NETWORK_RETRIES,
+        base_addresses=base_addresses
+    )
+    logger.info("Stripe configuré avec la clé secrète: %s...", Config.STRIPE_SECRET_KEY[:8])
+    return _client
+
+
+async def close_stripe_client() -> None:
+    """Ferme les connexions du client Stripe (arrêt de l'application)"""
+    global _client, _http_client
+    if _http_client is not None:
+        http_client, _client, _http_client = _http_client, None, None
+        await http_client.close_async()
+
+
+def get_stripe_client() -> stripe.StripeClient:
+    """Retourne le client partagé, en le créant si le lifespan n'a pas été exécuté"""
+    client = _client or start_stripe_client()
+    if client is None:
+        raise PaymentsNotConfiguredError("Stripe n'est pas configuré sur le serveur")
+    return client
+
+
+def _write_options(idempotency_key: Optional[str]) -> Dict[str, Any]:
+    # Clé fixée avant le premier essai : les retries réutilisent la même
+    return {"idempotency_key": idempotency_key or str(uuid.uuid4())}
+
+
+async def create_checkout_session(params: Dict[str, Any], idempotency_key: Optional[str] = None) -> stripe.checkout.Session:
+    """
+    Crée une session Stripe Checkout
+
+    Args:
+        params: Paramètres de la session (line_items, mode, metadata, ...)
+        idempotency_key: Clé fournie par le client (ex: en-tête
+            Idempotency-Key), pour qu'un double envoi renvoie la même session
+    """
+    return await get_stripe_client().checkout.sessions.create_async(
+        params=params,
+        options=_write_options(idempotency_key)
+    )
+
+
+def _session_ttl(session: stripe.checkout.Session) -> float:
+    # Une session payée ou expirée ne change plus ; une session en attente
+    # (paiement en cours, moyen de paiement différé) n'est gardée qu'un instant
+    if session.payment_status in ('paid', 'no_payment_required') or session.status == 'expired':
+        return Config.STRIPE_SESSION_TTL_FINAL
+    return Config.STRIPE_SESSION_TTL_PENDING
+
+
+def _cache_session(session: stripe.checkout.Session) -> None:
+    _sessions[session.id] = (session, time.monotonic() + _session_ttl(session))
+    _sessions.move_to_end(session.id)
+    while len(_sessions) > Config.STRIPE_SESSION_CACHE_SIZE:
+        _sessions.popitem(last=False)
+
+
+async def retrieve_checkout_session(session_id: str) -> stripe.checkout.Session:
+    """
+    Lit une session Checkout, depuis le cache si elle y est encore valide
+
+    Les lectures concurrentes d'une même session absente du cache sont
+    regroupées en un seul appel Stripe.
+    """
+    cached = _sessions.get(session_id)
+    if cached is not None:
+        if cached[1] > time.monotonic():
+            metrics.observe_stripe_session_lookup("hit")
+            return cached[0]
+        del _sessions[session_id]
+
+    metrics.observe_stripe_session_lookup("coalesced" if _session_lookups.is_in_flight(session_id) else "miss")
+
+    async def fetch() -> stripe.checkout.Session:
+        session = await get_stripe_client().checkout.sessions.retrieve_async(session_id)
+        _cache_session(session)
+        return session
+
+    return await _session_lookups.do(session_id, fetch)
+
+
+async def cancel_subscription(subscription_id: str) -> stripe.Subscription:
+    """Annule un abonnement immédiatement"""
+    return await get_stripe_client().subscriptions.cancel_async(subscription_id)
+
+
+async def cancel_subscription_at_period_end(subscription_id: str, idempotency_key: Optional[str] = None) -> stripe.Subscription:
+    """Programme l'annulation d'un abonnement à la fin de la période payée"""
+    return await get_stripe_client().subscriptions.update_async(
+        subscription_id,
+        params={"cancel_at_period_end": True},
+        options=_write_options(idempotency_key)
+    )
+
+
+def parse_webhook_event(payload: bytes, signature: Optional[str]) -> Dict[str, Any]:
+    """
+    Vérifie la signature d'un webhook (en-tête Stripe-Signature) et renvoie l'événement
+
+    Raises:
+        PaymentsNotConfiguredError: STRIPE_WEBHOOK_SECRET n'est pas définie
+        stripe.SignatureVerificationError: signature absente, invalide ou trop ancienne
+    """
+    if not Config.STRIPE_WEBHOOK_SECRET:
+        raise PaymentsNotConfiguredError("Les webhooks Stripe ne sont pas configurés sur le serveur")
+    text = payload.decode("utf-8")
+    stripe.WebhookSignature.verify_header(text, signature or "", Config.STRIPE_WEBHOOK_SECRET,
+                                          Config.STRIPE_WEBHOOK_TOLERANCE)
+    return json.loads(text)
+
+
+def _remember_applied(session_id: str) -> None:
+    _applied_sessions[session_id] = None
+    _applied_sessions.move_to_end(session_id)
+    while len(_applied_sessions) > Config.STRIPE_APPLIED_CACHE_SIZE:
+        _applied_sessions.popitem(last=False)
+
+
+async def apply_checkout_session(session: stripe.checkout.Session) -> bool:
+    """
+    Applique une session payée au compte de l'utilisateur (pack de tokens ou abonnement)
+
+    Le crédit est fait par une fonction SQL atomique, une seule fois par
+    session (registre stripe_applied_sessions) : vérifications concurrentes
+    ou répétées ne créditent pas deux fois.
+
+    Returns:
+        True si la session est appliquée (par cet appel ou auparavant)
+    """
+    if session.id in _applied_sessions:
+        return True
+    if session.payment_status != 'paid' or not session.metadata:
+        return False
+    user_id = session.metadata.get('user_id')
+    payment_type = session.metadata.get('type')
+    if not user_id:
+        return False
+
+    if payment_type == 'subscription' and session.get('subscription'):
+        result = await database.apply_subscription(session.id, user_id, session.get('subscription'))
+    elif payment_type == 'token_pack' and int(session.metadata.get('token_amount', 0)) > 0:
+        result = await database.apply_token_pack(session.id, user_id, int(session.metadata['token_amount']))
+    else:
+        return False
+
+    _remember_applied(session.id)
+    if result.get("applied"):
+        logger.info("Session %s appliquée (%s) pour user %s", session.id, payment_type, user_id)
+    return True
+
+
+async def get_applied_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Session déjà appliquée (registre stripe_applied_sessions), sans appel à Stripe"""
+    try:
+        applied = await database.get_applied_session(session_id)
+    except Exception as e:
+        # Registre illisible : la session sera vérifiée auprès de Stripe
+        logger.warning("Lecture du registre des sessions Stripe impossible: %s", e)
+        return None
+    if applied is not None:
+        _remember_applied(session_id)
+    return applied
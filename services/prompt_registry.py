@@ -0,0 +1,229 @@
+import logging
+import math
+import string
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import Config
+from config import prompts
+
+try:
+    import tiktoken
+except ImportError:  # Dépendance optionnelle : estimation heuristique sinon
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Marque insérée à la place du texte retiré d'une section trop longue
+TRIM_MARKER = "[…]"
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        _encoding = tiktoken.get_encoding(Config.PROMPT_TOKENIZER)
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimation du nombre de tokens d'un texte
+
+    Utilise tiktoken s'il est installé (le tokenizer n'est pas celui du
+    modèle Ollama mais en est proche), sinon ~4 caractères par token.
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=())) + 1
+    return len(text) // 4 + 1
+
+
+def _truncate(text: str, tokens: int, keep: str) -> str:
+    """Réduit un texte à environ tokens tokens en gardant son début ('head') ou sa fin ('tail')"""
+    if tokens <= 0:
+        return ""
+    # Place de la marque de coupure
+    tokens = max(tokens - 2, 1)
+    encoding = _get_encoding()
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())
+        if len(ids) <= tokens:
+            return text
+        kept = encoding.decode(ids[-tokens:] if keep == "tail" else ids[:tokens])
+    else:
+        chars = tokens * 4
+        if len(text) <= chars:
+            return text
+        kept = text[-chars:] if keep == "tail" else text[:chars]
+    return f"{TRIM_MARKER} {kept}" if keep == "tail" else f"{kept} {TRIM_MARKER}"
+
+
+class RenderedPrompt:
+    """Prompt formaté, options Ollama associées et statistiques de taille"""
+
+    def __init__(self, text: str, options: Dict[str, Any], stats: Dict[str, Any]):
+        self.text = text
+        self.options = options
+        self.stats = stats
+
+
+class PromptTemplate:
+    """
+    Template de prompt pré-analysé
+
+    Les champs du template et le coût en tokens de sa partie fixe sont
+    calculés une seule fois. Au rendu, si le prompt dépasse son budget, les
+    sections de trim_order sont raccourcies dans l'ordre (la moins
+    importante d'abord), en gardant leur début ou leur fin.
+
+    num_predict est une limite de sécurité et non la longueur visée : la
+    longueur de sortie attendue est multipliée par PROMPT_OUTPUT_HEADROOM,
+    une réponse coupée étant pire qu'une réponse un peu longue. Les sorties
+    coupées sont comptées dans pensaga_ia_truncated et la longueur réelle
+    dans pensaga_ia_output_tokens pour réajuster output_tokens. num_predict
+    ne dépasse pas PROMPT_MAX_OUTPUT_SHARE de num_ctx, pour que la marge ne
+    réduise pas le budget du prompt.
+
+    Args:
+        name: Nom du template (celui de la constante dans config.prompts)
+        template: Texte du template (syntaxe str.format)
+        output_tokens: Longueur de sortie attendue en tokens (avant la marge)
+        output_field: Champ dont la longueur détermine la sortie (ex:
+            texte à corriger), multiplié par output_ratio
+        trim_order: Liste de (champ, 'head' ou 'tail') raccourcissables
+        max_prompt_tokens: Budget du prompt (par défaut : PROMPT_NUM_CTX
+            moins num_predict)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        template: str,
+        output_tokens: int,
+        output_field: Optional[str] = None,
+        output_ratio: float = 1.5,
+        trim_order: Optional[List[Tuple[str, str]]] = None,
+        max_prompt_tokens: Optional[int] = None
+    ):
+        self.name = name
+        self.template = template
+        self.output_tokens = output_tokens
+        self.output_field = output_field
+        self.output_ratio = output_ratio
+        self.trim_order = trim_order or []
+        self.max_prompt_tokens = max_prompt_tokens
+
+        parsed = list(string.Formatter().parse(template))
+        self.fields = [field for _, field, _, _ in parsed if field]
+        self.fixed_tokens = estimate_tokens("".join(literal for literal, _, _, _ in parsed))
+        self._cap_reported = False
+
+    def _num_predict(self, field_tokens: Dict[str, int]) -> int:
+        expected = self.output_tokens
+        if self.output_field:
+            expected = max(expected, int(field_tokens[self.output_field] * self.output_ratio))
+        wanted = math.ceil(expected * Config.PROMPT_OUTPUT_HEADROOM)
+        limit = int(Config.PROMPT_NUM_CTX * Config.PROMPT_MAX_OUTPUT_SHARE)
+        if wanted > limit and not self._cap_reported:
+            self._cap_reported = True
+            logger.warning(
+                "num_predict du prompt %s limité à %d tokens (%d souhaités) : augmenter PROMPT_NUM_CTX",
+                self.name, limit, wanted
+            )
+        return min(wanted, limit)
+
+    def field_budget(self, field: str, **values: Any) -> int:
+        """
+        Tokens disponibles pour field une fois les autres champs placés
+
+        Permet de construire une section (ex: contexte des épisodes) à la
+        taille du budget au lieu de la laisser raccourcir au rendu.
+        """
+        field_tokens = {name: estimate_tokens(str(values[name])) for name in set(self.fields) if name != field}
+        field_tokens[field] = 0
+        budget = self.max_prompt_tokens or Config.PROMPT_NUM_CTX - self._num_predict(field_tokens)
+        used = self.fixed_tokens + sum(field_tokens[name] * self.fields.count(name) for name in field_tokens)
+        return max(budget - used, 0) // self.fields.count(field)
+
+    def render(self, **values: Any) -> RenderedPrompt:
+        values = {key: str(value) for key, value in values.items()}
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise KeyError(f"Champs manquants pour le prompt {self.name}: {', '.join(missing)}")
+
+        field_tokens = {field: estimate_tokens(values[field]) for field in set(self.fields)}
+        occurrences = {field: self.fields.count(field) for field in field_tokens}
+        num_predict = self._num_predict(field_tokens)
+
+        budget = self.max_prompt_tokens or Config.PROMPT_NUM_CTX - num_predict
+        prompt_tokens = self.fixed_tokens + sum(field_tokens[f] * occurrences[f] for f in field_tokens)
+        trimmed: Dict[str, int] = {}
+        for field, keep in self.trim_order:
+            excess = prompt_tokens - budget
+            if excess <= 0:
+                break
+            if field not in field_tokens:
+                continue
+            target = field_tokens[field] - math.ceil(excess / occurrences[field])
+            values[field] = _truncate(values[field], target, keep)
+            new_tokens = estimate_tokens(values[field]) if values[field] else 0
+            trimmed[field] = field_tokens[field] - new_tokens
+            prompt_tokens -= trimmed[field] * occurrences[field]
+            field_tokens[field] = new_tokens
+
+        options: Dict[str, Any] = {}
+        if Config.PROMPT_DYNAMIC_CTX:
+            # Même num_ctx pour tous les prompts : pas de rechargement du modèle
+            options = {"num_ctx": Config.PROMPT_NUM_CTX, "num_predict": num_predict}
+        return RenderedPrompt(
+            self.template.format(**values),
+            options,
+            {
+                "prompt": self.name,
+                "prompt_tokens_estimate": prompt_tokens,
+                "budget": budget,
+                "over_budget": prompt_tokens > budget,
+                "trimmed_tokens": trimmed,
+                **options
+            }
+        )
+
+
+def _register(*templates: PromptTemplate) -> Dict[str, PromptTemplate]:
+    return {template.name: template for template in templates}
+
+
+PROMPTS = _register(
+    PromptTemplate('CREATE_PITCH', prompts.CREATE_PITCH, output_tokens=800),
+    PromptTemplate('CREATE_SYNOPSIS', prompts.CREATE_SYNOPSIS, output_tokens=800),
+    PromptTemplate('CREATE_CHARACTERS', prompts.CREATE_CHARACTERS, output_tokens=2000),
+    PromptTemplate('REPAIR_CHARACTER', prompts.REPAIR_CHARACTER, output_tokens=600,
+                   trim_order=[('fragment', 'head')]),
+    # Le contexte des épisodes est construit à la taille de field_budget ; en dernier
+    # recours, les épisodes précédents cèdent la place en premier (on garde les plus récents)
+    PromptTemplate('CREATE_EPISODE', prompts.CREATE_EPISODE, output_tokens=4096,
+                   trim_order=[('contexte_episodes', 'tail'), ('personnages', 'head'), ('synopsis', 'head')]),
+    PromptTemplate('FIX_TEXT', prompts.FIX_TEXT, output_tokens=256, output_field='text', output_ratio=1.3),
+    PromptTemplate('REPHRASE_TEXT', prompts.REPHRASE_TEXT, output_tokens=256,
+                   output_field='text_to_reformulate', output_ratio=2.0,
+                   trim_order=[('text_complete', 'head')]),
+    PromptTemplate('REPHRASE_PASSAGE', prompts.REPHRASE_PASSAGE, output_tokens=256,
+                   output_field='text_to_reformulate', output_ratio=2.0,
+                   trim_order=[('resume_document', 'head'), ('contexte_apres', 'head'), ('contexte_avant', 'tail')]),
+    PromptTemplate('SUMMARIZE_EPISODE', prompts.SUMMARIZE_EPISODE, output_tokens=300,
+                   trim_order=[('episode', 'head')]),
+    PromptTemplate('SUMMARIZE_ARC', prompts.SUMMARIZE_ARC, output_tokens=600,
+                   trim_order=[('resumes', 'tail')]),
+    PromptTemplate('SUMMARIZE_DOCUMENT', prompts.SUMMARIZE_DOCUMENT, output_tokens=400,
+                   trim_order=[('text', 'head')]),
+)
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    return PROMPTS[name]
+
+
+def render_prompt(name: str, **values: Any) -> RenderedPrompt:
+    """Formate un prompt du registre dans son budget de tokens"""
+    return PROMPTS[name].render(**values)
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+
+# Classes de priorité (plus petit = servi en premier)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+
+class OverloadedError(Exception):
+    """Levée quand la file d'attente est trop longue pour accepter la requête"""
+
+    def __init__(self, retry_after: int, queued: int):
+        super().__init__(f"Serveur IA surchargé ({queued} requêtes en attente)")
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+class AdmissionScheduler:
+    """
+    Contrôle d'admission des appels au serveur IA
+
+    Limite le nombre de requêtes simultanées et sert la file d'attente par
+    priorité (puis par ordre d'arrivée). Une requête est refusée quand le
+    nombre de requêtes qui la précéderaient dans la file atteint max_queue.
+    max_in_flight peut être une fonction, pour suivre la capacité d'un pool
+    de serveurs. on_change est appelé (avec le nombre de requêtes en cours
+    et en attente) à chaque entrée ou sortie, pour les métriques.
+    """
+
+    # Poids de la moyenne glissante du temps de service
+    SERVICE_TIME_ALPHA = 0.2
+
+    def __init__(
+        self,
+        max_in_flight: Union[int, Callable[[], int]],
+        max_queue: int,
+        on_change: Optional[Callable[[int, int], None]] = None
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.on_change = on_change
+        self.in_flight = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._service_time = 10.0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    @property
+    def capacity(self) -> int:
+        if callable(self.max_in_flight):
+            return self.max_in_flight()
+        return self.max_in_flight
+
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def _ahead_of(self, priority: int) -> int:
+        return sum(1 for p, _, future in self._queue if p <= priority and not future.done())
+
+    def expected_wait(self, priority: int) -> float:
+        """Estimation (en secondes) de l'attente d'une nouvelle requête de cette priorité"""
+        if self.in_flight < self.capacity and not self.queued():
+            return 0.0
+        return (self._ahead_of(priority) + 1) / max(self.capacity, 1) * self._service_time
+
+    def retry_after(self, ahead: int) -> int:
+        """Estimation (en secondes) du délai avant qu'une place se libère"""
+        return max(1, math.ceil((ahead + 1) / max(self.capacity, 1) * self._service_time))
+
+    async def acquire(self, priority: int) -> float:
+        """
+        Attend une place libre et retourne le temps passé dans la file
+
+        Raises:
+            OverloadedError: Si la file est pleine pour cette priorité
+        """
+        start = time.monotonic()
+        if self.in_flight < self.capacity and not self.queued():
+            self.in_flight += 1
+        else:
+            ahead = self._ahead_of(priority)
+            if ahead >= self.max_queue:
+                self.rejected += 1
+                raise OverloadedError(self.retry_after(ahead), ahead)
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (priority, next(self._seq), future))
+            self._changed()
+            try:
+                await future
+            except asyncio.CancelledError:
+                # La place a pu être attribuée juste avant l'annulation
+                if future.done() and not future.cancelled():
+                    self.release()
+                else:
+                    future.cancel()
+                    self._changed()
+                raise
+
+        self._changed()
+        wait = time.monotonic() - start
+        self.admitted += 1
+        self.total_wait += wait
+        return wait
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Libère une place et la transmet à la prochaine requête en attente"""
+        if service_time is not None:
+            self._service_time += self.SERVICE_TIME_ALPHA * (service_time - self._service_time)
+        self.in_flight -= 1
+        self._wake()
+        self._changed()
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self.in_flight, self.queued())
+
+    def _wake(self) -> None:
+        while self._queue and self.in_flight < self.capacity:
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: int) -> AsyncIterator[float]:
+        """Réserve une place pour la durée du bloc et fournit le temps d'attente"""
+        wait = await self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield wait
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "max_in_flight": self.capacity,
+            "in_flight": self.in_flight,
+            "queued": self.queued(),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_queue_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "avg_service_time": round(self._service_time, 3)
+        }
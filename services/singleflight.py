@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Regroupe les appels concurrents identiques en un seul appel amont
+
+    Le premier appel pour une clé lance la coroutine dans une tâche
+    indépendante ; les appels suivants arrivant avant la fin attendent cette
+    même tâche. L'annulation d'un appelant (client déconnecté) n'annule pas
+    la tâche partagée, et une erreur est propagée à tous les appelants.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Exécute fn() une seule fois pour tous les appels concurrents de même clé"""
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def is_in_flight(self, key: str) -> bool:
+        """Un appel amont est-il déjà en cours pour cette clé"""
+        return key in self._calls
+
+    def in_flight(self) -> int:
+        """Nombre d'appels amont en cours"""
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": self.in_flight()
+        }
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Marquer l'erreur comme récupérée même si tous les appelants sont partis
+        if not task.cancelled():
+            task.exception()
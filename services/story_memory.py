@@ -0,0 +1,135 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import Config
+from .ia import request_ia
+from .prompt_registry import render_prompt, estimate_tokens
+
+
+# Séparateur entre épisodes dans le contexte du prompt
+EPISODE_SEPARATOR = "\n\n---\n\n"
+
+# Première ligne du contexte des épisodes
+CONTEXT_HEADER = "Épisodes précédents (pour contexte et cohérence) :"
+
+# Place réservée au résumé global de l'arc (250 mots demandés)
+ARC_TOKEN_RESERVE = 400
+
+
+async def summarize_episode(episode: str) -> str:
+    """
+    Résume un épisode pour la mémoire de l'histoire
+
+    Le prompt ne dépend que du contenu de l'épisode : le cache des réponses
+    IA sert donc de cache par hash de contenu, et un épisode déjà résumé
+    n'est jamais renvoyé au modèle.
+    """
+    rendered = render_prompt('SUMMARIZE_EPISODE', episode=episode)
+    result = await request_ia(
+        rendered.text,
+        endpoint='summarize_episode',
+        cache=True,
+        options=rendered.options
+    )
+    return result.get("response", "").strip()
+
+
+async def summarize_arc(summaries: List[str]) -> str:
+    """Résumé global de l'arc à partir des résumés d'épisodes (mis en cache)"""
+    resumes = "\n".join(f"- Épisode {i+1} : {summary}" for i, summary in enumerate(summaries))
+    rendered = render_prompt('SUMMARIZE_ARC', resumes=resumes)
+    result = await request_ia(
+        rendered.text,
+        endpoint='summarize_arc',
+        cache=True,
+        options=rendered.options
+    )
+    return result.get("response", "").strip()
+
+
+def _verbatim(numero: int, episode: str) -> str:
+    return f"Épisode {numero} :\n{episode}"
+
+
+async def build_episode_context(episodes: List[str], max_tokens: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Construit le contexte des épisodes précédents dans un budget de tokens
+
+    Les STORY_RECENT_EPISODES derniers épisodes sont repris tels quels, les
+    plus anciens sous forme de résumés. Si tous les résumés ne tiennent pas
+    dans le budget, un résumé global de l'arc couvre les plus anciens.
+
+    Args:
+        episodes: Contenu des épisodes précédents, dans l'ordre
+        max_tokens: Place restante dans le prompt (le budget utilisé est le
+            plus petit de max_tokens et STORY_CONTEXT_TOKEN_BUDGET)
+
+    Returns:
+        Tuple (texte du contexte, statistiques pour la metadata)
+    """
+    budget = Config.STORY_CONTEXT_TOKEN_BUDGET
+    if max_tokens is not None:
+        budget = max(min(budget, max_tokens - estimate_tokens(CONTEXT_HEADER)), 0)
+    stats = {
+        "episodes_verbatim": 0,
+        "episodes_summarized": 0,
+        "arc_summary": False,
+        "context_tokens_estimate": 0
+    }
+    if not episodes:
+        return "", stats
+
+    full = EPISODE_SEPARATOR.join(_verbatim(i + 1, e) for i, e in enumerate(episodes))
+    if estimate_tokens(full) <= budget:
+        stats["episodes_verbatim"] = len(episodes)
+        stats["context_tokens_estimate"] = estimate_tokens(full)
+        return f"{CONTEXT_HEADER}\n{full}\n", stats
+
+    # Épisodes récents repris mot pour mot, du plus récent au plus ancien
+    # (la moitié du budget au plus, le dernier épisode étant toujours inclus)
+    recent: List[str] = []
+    used = 0
+    first_recent = len(episodes)
+    start = max(len(episodes) - Config.STORY_RECENT_EPISODES, 0)
+    for index in reversed(range(start, len(episodes))):
+        block = _verbatim(index + 1, episodes[index])
+        cost = estimate_tokens(block)
+        if recent and used + cost > budget // 2:
+            break
+        recent.insert(0, block)
+        used += cost
+        first_recent = index
+
+    older = episodes[:first_recent]
+    summaries = list(await asyncio.gather(*(summarize_episode(e) for e in older)))
+
+    # Résumés des épisodes anciens, du plus récent au plus ancien
+    summary_blocks: List[str] = []
+    for index in reversed(range(len(summaries))):
+        block = f"Épisode {index + 1} (résumé) : {summaries[index]}"
+        cost = estimate_tokens(block)
+        if used + cost > budget:
+            break
+        summary_blocks.insert(0, block)
+        used += cost
+
+    # Faire de la place au résumé de l'arc s'il doit couvrir les plus anciens
+    if len(summary_blocks) < len(summaries):
+        while summary_blocks and used + ARC_TOKEN_RESERVE > budget:
+            used -= estimate_tokens(summary_blocks.pop(0))
+
+    parts = []
+    uncovered = len(summaries) - len(summary_blocks)
+    if uncovered:
+        arc = await summarize_arc(summaries[:uncovered])
+        parts.append(f"Résumé de l'histoire jusqu'à l'épisode {uncovered} :\n{arc}")
+        stats["arc_summary"] = True
+    if summary_blocks:
+        parts.append("Résumés des épisodes :\n" + "\n".join(summary_blocks))
+    parts.append(EPISODE_SEPARATOR.join(recent))
+
+    context = "\n\n".join(parts)
+    stats["episodes_verbatim"] = len(recent)
+    stats["episodes_summarized"] = len(summary_blocks)
+    stats["context_tokens_estimate"] = estimate_tokens(context)
+    return f"{CONTEXT_HEADER}\n{context}\n", stats
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from config.settings import Config
+from utils.supabase_client import SupabaseClient
+
+
+# Champs modifiables d'une histoire
+STORY_FIELDS = ('pitch', 'synopsis', 'personnages')
+
+
+class StoryNotFoundError(Exception):
+    """Levée quand l'histoire demandée n'existe pas"""
+
+    def __init__(self, story_id: str):
+        super().__init__(f"Histoire introuvable: {story_id}")
+        self.story_id = story_id
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StoryStore(ABC):
+    """
+    Stockage des sessions d'histoire côté serveur
+
+    Une histoire regroupe pitch, synopsis, personnages et épisodes sous un
+    story_id, pour que les clients n'aient plus à tout renvoyer à chaque
+    génération.
+    """
+
+    @abstractmethod
+    async def create(self, fields: Dict[str, Any], episodes: Optional[List[str]] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def get(self, story_id: str, include_episodes: bool = True) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def update(self, story_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def put_episode(self, story_id: str, numero: int, content: str) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, story_id: str) -> None:
+        ...
+
+
+class SQLiteStoryStore(StoryStore):
+    """Stockage local SQLite (développement et tests)"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS story_sessions ("
+            " id TEXT PRIMARY KEY, pitch TEXT, synopsis TEXT, personnages TEXT,"
+            " created_at TEXT NOT NULL, updated_at TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS story_episodes ("
+            " story_id TEXT NOT NULL REFERENCES story_sessions(id) ON DELETE CASCADE,"
+            " numero INTEGER NOT NULL, content TEXT NOT NULL, created_at TEXT NOT NULL,"
+            " PRIMARY KEY (story_id, numero));"
+        )
+        self._conn.commit()
+
+    def _get(self, story_id: str, include_episodes: bool) -> Dict[str, Any]:
+        row = self._conn.execute("SELECT * FROM story_sessions WHERE id = ?", (story_id,)).fetchone()
+        if row is None:
+            raise StoryNotFoundError(story_id)
+        story = {"story_id": row["id"], **{f: row[f] for f in STORY_FIELDS},
+                 "created_at": row["created_at"], "updated_at": row["updated_at"]}
+        if include_episodes:
+            story["episodes"] = [
+                {"numero": r["numero"], "content": r["content"]}
+                for r in self._conn.execute(
+                    "SELECT numero, content FROM story_episodes WHERE story_id = ? ORDER BY numero",
+                    (story_id,)
+                )
+            ]
+        return story
+
+    def _create(self, fields: Dict[str, Any], episodes: List[str]) -> Dict[str, Any]:
+        story_id = uuid.uuid4().hex
+        now = _now()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO story_sessions (id, pitch, synopsis, personnages, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (story_id, *(fields.get(f) for f in STORY_FIELDS), now, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO story_episodes (story_id, numero, content, created_at) VALUES (?, ?, ?, ?)",
+                [(story_id, i + 1, content, now) for i, content in enumerate(episodes)]
+            )
+            self._conn.commit()
+            return self._get(story_id, include_episodes=True)
+
+    def _update(self, story_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        fields = {k: v for k, v in fields.items() if k in STORY_FIELDS}
+        with self._lock:
+            self._get(story_id, include_episodes=False)
+            assignments = ", ".join(f"{k} = ?" for k in fields)
+            self._conn.execute(
+                f"UPDATE story_sessions SET {assignments + ', ' if assignments else ''}updated_at = ? WHERE id = ?",
+                (*fields.values(), _now(), story_id)
+            )
+            self._conn.commit()
+            return self._get(story_id, include_episodes=False)
+
+    def _put_episode(self, story_id: str, numero: int, content: str) -> None:
+        with self._lock:
+            self._get(story_id, include_episodes=False)
+            now = _now()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO story_episodes (story_id, numero, content, created_at) VALUES (?, ?, ?, ?)",
+                (story_id, numero, content, now)
+            )
+            self._conn.execute("UPDATE story_sessions SET updated_at = ? WHERE id = ?", (now, story_id))
+            self._conn.commit()
+
+    def _delete(self, story_id: str) -> None:
+        with self._lock:
+            self._get(story_id, include_episodes=False)
+            self._conn.execute("DELETE FROM story_sessions WHERE id = ?", (story_id,))
+            self._conn.commit()
+
+    def _read(self, story_id: str, include_episodes: bool) -> Dict[str, Any]:
+        with self._lock:
+            return self._get(story_id, include_episodes)
+
+    async def create(self, fields: Dict[str, Any], episodes: Optional[List[str]] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._create, fields, episodes or [])
+
+    async def get(self, story_id: str, include_episodes: bool = True) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._read, story_id, include_episodes)
+
+    async def update(self, story_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._update, story_id, fields)
+
+    async def put_episode(self, story_id: str, numero: int, content: str) -> None:
+        await asyncio.to_thread(self._put_episode, story_id, numero, content)
+
+    async def delete(self, story_id: str) -> None:
+        await asyncio.to_thread(self._delete, story_id)
+
+
+class SupabaseStoryStore(StoryStore):
+    """Stockage Supabase (tables story_sessions et story_episodes)"""
+
+    def _client(self):
+        return SupabaseClient.get_client()
+
+    def _get(self, story_id: str, include_episodes: bool) -> Dict[str, Any]:
+        client = self._client()
+        response = client.table('story_sessions').select('*').eq('id', story_id).execute()
+        if not response.data:
+            raise StoryNotFoundError(story_id)
+        row = response.data[0]
+        story = {"story_id": row["id"], **{f: row.get(f) for f in STORY_FIELDS},
+                 "created_at": row.get("created_at"), "updated_at": row.get("updated_at")}
+        if include_episodes:
+            episodes = client.table('story_episodes').select('numero, content') \
+                .eq('story_id', story_id).order('numero').execute()
+            story["episodes"] = episodes.data or []
+        return story
+
+    def _create(self, fields: Dict[str, Any], episodes: List[str]) -> Dict[str, Any]:
+        client = self._client()
+        story_id = uuid.uuid4().hex
+        now = _now()
+        client.table('story_sessions').insert({
+            'id': story_id,
+            **{f: fields.get(f) for f in STORY_FIELDS},
+            'created_at': now,
+            'updated_at': now
+        }).execute()
+        if episodes:
+            client.table('story_episodes').insert([
+                {'story_id': story_id, 'numero': i + 1, 'content': content, 'created_at': now}
+                for i, content in enumerate(episodes)
+            ]).execute()
+        return self._get(story_id, include_episodes=True)
+
+    def _update(self, story_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        fields = {k: v for k, v in fields.items() if k in STORY_FIELDS}
+        response = self._client().table('story_sessions') \
+            .update({**fields, 'updated_at': _now()}).eq('id', story_id).execute()
+        if not response.data:
+            raise StoryNotFoundError(story_id)
+        return self._get(story_id, include_episodes=False)
+
+    def _put_episode(self, story_id: str, numero: int, content: str) -> None:
+        client = self._client()
+        now = _now()
+        response = client.table('story_sessions').update({'updated_at': now}).eq('id', story_id).execute()
+        if not response.data:
+            raise StoryNotFoundError(story_id)
+        client.table('story_episodes').upsert(
+            {'story_id': story_id, 'numero': numero, 'content': content, 'created_at': now},
+            on_conflict='story_id,numero'
+        ).execute()
+
+    def _delete(self, story_id: str) -> None:
+        response = self._client().table('story_sessions').delete().eq('id', story_id).execute()
+        if not response.data:
+            raise StoryNotFoundError(story_id)
+
+    # Le client Supabase est synchrone : les appels sont faits hors de la boucle d'événements
+    async def create(self, fields: Dict[str, Any], episodes: Optional[List[str]] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._create, fields, episodes or [])
+
+    async def get(self, story_id: str, include_episodes: bool = True) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._get, story_id, include_episodes)
+
+    async def update(self, story_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._update, story_id, fields)
+
+    async def put_episode(self, story_id: str, numero: int, content: str) -> None:
+        await asyncio.to_thread(self._put_episode, story_id, numero, content)
+
+    async def delete(self, story_id: str) -> None:
+        await asyncio.to_thread(self._delete, story_id)
+
+
+_store: Optional[StoryStore] = None
+
+
+def get_story_store() -> StoryStore:
+    """Retourne le stockage configuré (Config.STORY_STORE : 'supabase' ou 'sqlite')"""
+    global _store
+    if _store is None:
+        if Config.STORY_STORE == 'sqlite':
+            _store = SQLiteStoryStore(Config.STORY_DB_PATH)
+        else:
+            _store = SupabaseStoryStore()
+    return _store
+
+
+def set_story_store(store: StoryStore) -> None:
+    """Remplace le stockage (ex: SQLite en mémoire pour les tests)"""
+    global _store
+    _store = store
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import stripe
+
+from config.settings import Config
+from utils.log import request_id
+from . import database, payments
+
+logger = logging.getLogger(__name__)
+
+
+# Événements Stripe traités : une session Checkout payée crédite l'utilisateur
+# (paiement immédiat, ou différé pour les moyens de paiement asynchrones)
+HANDLED_EVENTS = ("checkout.session.completed", "checkout.session.async_payment_succeeded")
+
+# Statuts d'un événement dans la file
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class StripeEventQueue:
+    """
+    File durable des événements webhook (SQLite local)
+
+    L'identifiant de l'événement est la clé primaire : un événement renvoyé
+    par Stripe n'est enregistré qu'une fois. Un lot réservé par un worker
+    redevient disponible après STRIPE_EVENTS_LEASE secondes si le processus
+    s'arrête avant de l'avoir traité.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stripe_events ("
+            " id TEXT PRIMARY KEY, type TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, last_error TEXT,"
+            " received_at REAL NOT NULL, processed_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS stripe_events_pending ON stripe_events (status, next_attempt_at)"
+        )
+
+    def _enqueue(self, event: Dict[str, Any]) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO stripe_events (id, type, payload, status, next_attempt_at, received_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (event["id"], event["type"], json.dumps(event), PENDING, now, now)
+            )
+        return cursor.rowcount == 1
+
+    def _claim(self, limit: int, lease: float) -> List[Tuple[str, int, Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE : deux processus ne réservent jamais le même lot
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, attempts, payload FROM stripe_events"
+                    " WHERE status = ? AND next_attempt_at <= ? ORDER BY received_at LIMIT ?",
+                    (PENDING, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE stripe_events SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?",
+                    [(now + lease, event_id) for event_id, _, _ in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(event_id, attempts + 1, json.loads(payload)) for event_id, attempts, payload in rows]
+
+    def _complete(self, done: List[str], retries: List[Tuple[str, float, str]], failed: List[Tuple[str, str]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE stripe_events SET status = ?, processed_at = ?, last_error = NULL WHERE id = ?",
+                    [(DONE, now, event_id) for event_id in done]
+                )
+                self._conn.executemany(
+                    "UPDATE stripe_events SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    [(now + delay, error, event_id) for event_id, delay, error in retries]
+                )
+                self._conn.executemany(
+                    "UPDATE stripe_events SET status = ?, processed_at = ?, last_error = ? WHERE id = ?",
+                    [(FAILED, now, error, event_id) for event_id, error in failed]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _purge(self, retention: float) -> None:
+        # Les événements traités sont gardés assez longtemps pour dédoublonner
+        # les renvois de Stripe (jusqu'à 3 jours)
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM stripe_events WHERE status != ? AND processed_at <= ?",
+                (PENDING, time.time() - retention)
+            )
+
+    # SQLite est synchrone : les accès sont faits hors de la boucle d'événements
+    async def enqueue(self, event: Dict[str, Any]) -> bool:
+        """Enregistre l'événement, False s'il avait déjà été reçu"""
+        return await asyncio.to_thread(self._enqueue, event)
+
+    async def claim(self, limit: int, lease: float) -> List[Tuple[str, int, Dict[str, Any]]]:
+        """Réserve jusqu'à limit événements prêts : (id, numéro d'essai, événement)"""
+        return await asyncio.to_thread(self._claim, limit, lease)
+
+    async def complete(self, done: List[str], retries: List[Tuple[str, float, str]], failed: List[Tuple[str, str]]) -> None:
+        """Enregistre le résultat d'un lot en une transaction"""
+        await asyncio.to_thread(self._complete, done, retries, failed)
+
+    async def purge(self, retention: float) -> None:
+        await asyncio.to_thread(self._purge, retention)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+async def handle_event(event: Dict[str, Any]) -> None:
+    """Applique un événement Stripe (les types non gérés sont ignorés)"""
+    if event["type"] in HANDLED_EVENTS:
+        session = stripe.checkout.Session.construct_from(event["data"]["object"], Config.STRIPE_SECRET_KEY)
+        await payments.apply_checkout_session(session)
+
+
+class StripeEventWorker:
+    """
+    Traitement en tâche de fond des webhooks Stripe
+
+    La route /stripe/webhook enregistre l'événement puis répond tout de
+    suite ; le worker réserve les événements par lots, les applique en
+    parallèle et retente les échecs avec un délai doublé à chaque essai.
+    Au-delà de STRIPE_EVENTS_MAX_ATTEMPTS, l'événement reste en base au
+    statut failed.
+    """
+
+    # Intervalle entre deux purges des événements traités (secondes)
+    PURGE_INTERVAL = 3600.0
+
+    def __init__(self, path: str, batch_size: int, max_attempts: int, retry_backoff: float,
+                 lease: float, poll_interval: float, retention: float):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.queue: Optional[StripeEventQueue] = None
+        self._wakeup = asyncio.Event()
+        self._tasks: list = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        if not Config.STRIPE_WEBHOOK_SECRET:
+            logger.info("STRIPE_WEBHOOK_SECRET non configurée : webhooks Stripe désactivés")
+            return
+        self.queue = await asyncio.to_thread(StripeEventQueue, self.path)
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._purge_loop())]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.queue is not None:
+            self.queue.close()
+            self.queue = None
+
+    async def submit(self, event: Dict[str, Any]) -> bool:
+        """Enregistre un événement vérifié, False s'il avait déjà été reçu"""
+        if self.queue is None:
+            raise RuntimeError("Le worker des webhooks Stripe n'est pas démarré")
+        created = await self.queue.enqueue(event)
+        if created:
+            self._wakeup.set()
+        return created
+
+    async def _run(self) -> None:
+        while True:
+            # Effacé avant la réservation : un événement reçu pendant le
+            # traitement du lot réveille la boucle au lieu d'attendre le poll
+            self._wakeup.clear()
+            try:
+                batch = await self.queue.claim(self.batch_size, self.lease)
+                if batch:
+                    await self._process(batch)
+            except Exception as e:
+                # Les événements réservés seront repris à la fin du bail
+                logger.warning("File des webhooks Stripe indisponible: %s", e)
+                batch = []
+            if len(batch) == self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, batch: List[Tuple[str, int, Dict[str, Any]]]) -> None:
+        async def process(event: Dict[str, Any]) -> None:
+            # Logs rattachés à l'événement
+            request_id.set(event["id"])
+            await handle_event(event)
+
+        results = await asyncio.gather(
+            *(asyncio.create_task(process(event)) for _, _, event in batch),
+            return_exceptions=True
+        )
+        done, retries, failed = [], [], []
+        for (event_id, attempt, event), result in zip(batch, results):
+            if result is None:
+                done.append(event_id)
+                continue
+            error = f"{type(result).__name__}: {result}"
+            # Un utilisateur absent ne réapparaîtra pas en retentant
+            if isinstance(result, database.UserNotFoundError) or attempt >= self.max_attempts:
+                logger.error("Webhook Stripe %s (%s) abandonné après %d essai(s): %s",
+                             event_id, event["type"], attempt, error)
+                failed.append((event_id, error))
+            else:
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                logger.warning("Webhook Stripe %s (%s): %s, nouvel essai dans %.1fs",
+                               event_id, event["type"], error, delay)
+                retries.append((event_id, delay, error))
+        await self.queue.complete(done, retries, failed)
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.PURGE_INTERVAL)
+            try:
+                await self.queue.purge(self.retention)
+            except Exception as e:
+                logger.warning("Purge des webhooks Stripe traités impossible: %s", e)
+
+
+stripe_event_worker = StripeEventWorker(
+    path=Config.STRIPE_EVENTS_DB_PATH,
+    batch_size=Config.STRIPE_EVENTS_BATCH_SIZE,
+    max_attempts=Config.STRIPE_EVENTS_MAX_ATTEMPTS,
+    retry_backoff=Config.STRIPE_EVENTS_RETRY_BACKOFF,
+    lease=Config.STRIPE_EVENTS_LEASE,
+    poll_interval=Config.STRIPE_EVENTS_POLL_INTERVAL,
+    retention=Config.STRIPE_EVENTS_RETENTION
+)
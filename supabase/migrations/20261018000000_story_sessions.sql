@@ -0,0 +1,18 @@
+-- Sessions d'histoire stockées côté serveur (pitch, synopsis, personnages, épisodes)
+
+create table if not exists public.story_sessions (
+    id text primary key,
+    pitch text,
+    synopsis text,
+    personnages text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create table if not exists public.story_episodes (
+    story_id text not null references public.story_sessions(id) on delete cascade,
+    numero integer not null,
+    content text not null,
+    created_at timestamptz not null default now(),
+    primary key (story_id, numero)
+);
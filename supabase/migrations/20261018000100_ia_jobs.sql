@@ -0,0 +1,16 @@
+-- Jobs de génération IA asynchrones (statut, texte partiel, résultat)
+-- Les dates sont des timestamps Unix (secondes) pour le calcul du TTL côté API
+
+create table if not exists public.ia_jobs (
+    id text primary key,
+    type text not null,
+    status text not null,
+    partial text,
+    result jsonb,
+    error jsonb,
+    created_at double precision not null,
+    updated_at double precision not null,
+    expires_at double precision not null
+);
+
+create index if not exists ia_jobs_expires_at_idx on public.ia_jobs (expires_at);
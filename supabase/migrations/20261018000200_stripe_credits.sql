@@ -0,0 +1,118 @@
+-- Crédit des achats Stripe en une seule opération atomique
+-- Chaque session Checkout n'est appliquée qu'une fois (registre
+-- stripe_applied_sessions) : vérifications répétées ou concurrentes et
+-- retries ne créditent pas deux fois.
+-- Les fonctions ne sont exécutables qu'avec la clé service_role (SUPABASE_KEY de l'API).
+
+create table if not exists public.stripe_applied_sessions (
+    session_id text primary key,
+    user_id text not null,
+    type text not null,
+    token_amount integer,
+    subscription_id text,
+    applied_at timestamptz not null default now()
+);
+
+alter table public.stripe_applied_sessions enable row level security;
+
+-- Ajoute (ou retire) des tokens au solde, renvoie le nouveau solde
+create or replace function public.increment_tokens(
+    p_user_id public.user_extend.id%type,
+    p_amount integer
+) returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_token integer;
+begin
+    update public.user_extend
+    set token = coalesce(token, 0) + p_amount
+    where id = p_user_id
+    returning token into v_token;
+    if not found then
+        raise exception 'Utilisateur introuvable: %', p_user_id using errcode = 'P0002';
+    end if;
+    return v_token;
+end;
+$$;
+
+-- Active (p_subscription_id renseigné) ou désactive l'abonnement sans
+-- réécrire les autres préférences
+create or replace function public.set_subscription(
+    p_user_id public.user_extend.id%type,
+    p_subscription_id text
+) returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_preferences jsonb;
+begin
+    update public.user_extend
+    set has_subscription = p_subscription_id is not null,
+        preferences = case
+            when p_subscription_id is null then coalesce(preferences, '{}'::jsonb) - 'stripe_subscription_id'
+            else jsonb_set(coalesce(preferences, '{}'::jsonb), '{stripe_subscription_id}', to_jsonb(p_subscription_id))
+        end
+    where id = p_user_id
+    returning preferences into v_preferences;
+    if not found then
+        raise exception 'Utilisateur introuvable: %', p_user_id using errcode = 'P0002';
+    end if;
+    return v_preferences;
+end;
+$$;
+
+-- Crédite un pack de tokens une seule fois par session Checkout
+create or replace function public.apply_token_pack(
+    p_session_id text,
+    p_user_id public.user_extend.id%type,
+    p_amount integer
+) returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.stripe_applied_sessions (session_id, user_id, type, token_amount)
+    values (p_session_id, p_user_id::text, 'token_pack', p_amount)
+    on conflict (session_id) do nothing;
+    if not found then
+        return jsonb_build_object('applied', false);
+    end if;
+    return jsonb_build_object('applied', true, 'token', public.increment_tokens(p_user_id, p_amount));
+end;
+$$;
+
+-- Active un abonnement une seule fois par session Checkout
+create or replace function public.apply_subscription(
+    p_session_id text,
+    p_user_id public.user_extend.id%type,
+    p_subscription_id text
+) returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.stripe_applied_sessions (session_id, user_id, type, subscription_id)
+    values (p_session_id, p_user_id::text, 'subscription', p_subscription_id)
+    on conflict (session_id) do nothing;
+    if not found then
+        return jsonb_build_object('applied', false);
+    end if;
+    return jsonb_build_object('applied', true, 'preferences', public.set_subscription(p_user_id, p_subscription_id));
+end;
+$$;
+
+revoke execute on function public.increment_tokens from public, anon, authenticated;
+revoke execute on function public.set_subscription from public, anon, authenticated;
+revoke execute on function public.apply_token_pack from public, anon, authenticated;
+revoke execute on function public.apply_subscription from public, anon, authenticated;
+grant execute on function public.increment_tokens to service_role;
+grant execute on function public.set_subscription to service_role;
+grant execute on function public.apply_token_pack to service_role;
+grant execute on function public.apply_subscription to service_role;
@@ -1,4 +1,6 @@
 from .supabase_client import SupabaseClient, supabase
+from .streaming import encode_event, wants_sse, media_type
+from .log import setup_logging, RequestIdMiddleware, request_id
 
-__all__ = ['SupabaseClient', 'supabase']
+__all__ = ['SupabaseClient', 'supabase', 'encode_event', 'wants_sse', 'media_type', 'setup_logging', 'RequestIdMiddleware', 'request_id']
 
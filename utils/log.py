@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import traceback
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from config.settings import Config
+
+
+# Identifiant de la requête HTTP (ou du job) en cours, ajouté à chaque ligne de log
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Attributs standards d'un LogRecord : les autres viennent de extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+# Bibliothèques trop bavardes au niveau INFO (une ligne par requête HTTP)
+_QUIET_LOGGERS = ("httpx", "httpcore", "hpack")
+
+_listener: Optional[QueueListener] = None
+
+
+def _truncate(value: str, max_chars: int) -> str:
+    if len(value) <= max_chars:
+        return value
+    return f"{value[:max_chars]}… [{len(value) - max_chars} caractères tronqués]"
+
+
+def _sampled(rid: Optional[str], rate: float) -> bool:
+    """Échantillonnage par requête : toutes les lignes d'une requête sont gardées ou aucune"""
+    if rate >= 1:
+        return True
+    if rid is None:
+        return random.random() < rate
+    return zlib.crc32(rid.encode()) % 10000 < rate * 10000
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Handler non bloquant : le LogRecord est préparé (message formaté et
+    tronqué, identifiant de requête, traceback) dans le thread appelant,
+    puis déposé dans une file bornée. La sérialisation JSON et l'écriture
+    sur stdout sont faites par le thread du QueueListener. File pleine :
+    la ligne est abandonnée plutôt que de bloquer la boucle asyncio.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_chars: int, sample_rate: float):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+        self.sample_rate = sample_rate
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        # Les avertissements et erreurs ne sont jamais échantillonnés
+        if record.levelno < logging.WARNING and not _sampled(record.request_id, self.sample_rate):
+            return False
+        return super().handle(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = _truncate(record.getMessage(), self.max_chars)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _truncate("".join(traceback.format_exception(*record.exc_info)), self.max_chars * 4)
+            record.exc_info = None
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and isinstance(value, str):
+                setattr(record, key, _truncate(value, self.max_chars))
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """Une ligne JSON par log : horodatage, niveau, logger, message, request_id et champs extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging() -> None:
+    """
+    Configure le logger racine (appelé une fois au démarrage)
+
+    Les logs passent par une file vers un thread d'écriture : un appel de
+    log ne fait jamais d'écriture bloquante sur la boucle asyncio.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+    _listener = QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(AsyncQueueHandler(log_queue, Config.LOG_MAX_CHARS, Config.LOG_SAMPLE_RATE))
+    root.setLevel(Config.LOG_LEVEL)
+    for name in _QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+
+class RequestIdMiddleware:
+    """
+    Middleware ASGI : reprend l'en-tête X-Request-ID (ou en génère un), le
+    place dans le contexte des logs et le renvoie dans la réponse
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        rid = next((value.decode("latin-1") for key, value in scope["headers"] if key == header), None)
+        rid = (rid or uuid.uuid4().hex)[:64]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (header, rid.encode("latin-1"))]
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,38 @@
+import json
+from typing import Any, Dict, Optional
+
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_sse(accept: Optional[str]) -> bool:
+    """Indique si le client préfère des Server-Sent Events (header Accept)"""
+    return bool(accept) and SSE_MEDIA_TYPE in accept
+
+
+def media_type(sse: bool) -> str:
+    """Retourne le type MIME du flux (SSE ou NDJSON)"""
+    return SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE
+
+
+def encode_event(data: Dict[str, Any], sse: bool, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """
+    Encode un événement de flux
+
+    Args:
+        data: Données de l'événement (sérialisées en JSON)
+        sse: True pour le format Server-Sent Events, False pour NDJSON
+        event: Nom d'événement SSE optionnel (ignoré en NDJSON)
+        event_id: Identifiant SSE optionnel, renvoyé par le client dans Last-Event-ID
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    if not sse:
+        return payload + "\n"
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
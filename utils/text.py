@@ -0,0 +1,159 @@
+import difflib
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Séparateur de paragraphes : une ligne vide (éventuellement avec des espaces)
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+
+# Fin de phrase : ponctuation finale suivie d'espaces
+SENTENCE_BREAK = re.compile(r"(?<=[.!?…»])\s+")
+
+# Limite de phrase ou de paragraphe (fenêtre de contexte par phrases)
+SENTENCE_OR_PARAGRAPH_BREAK = re.compile(r"(?<=[.!?…»])\s+|\n[ \t]*\n\s*")
+
+# Caractères typographiques ramenés à leur équivalent simple pour la recherche
+_EQUIVALENTS = str.maketrans({
+    "’": "'", "‘": "'", "“": '"', "”": '"', "«": '"', "»": '"',
+    "–": "-", "—": "-", "…": ".",
+})
+
+# Découpage en mots, espaces et ponctuation pour le calcul des corrections
+_TOKENS = re.compile(r"\w+|\s+|[^\w\s]", re.UNICODE)
+
+
+def _split_keep(pattern: re.Pattern, text: str) -> List[Tuple[str, str]]:
+    """Découpe le texte en (segment, séparateur qui le suit)"""
+    parts = []
+    position = 0
+    for match in pattern.finditer(text):
+        parts.append((text[position:match.start()], match.group()))
+        position = match.end()
+    parts.append((text[position:], ""))
+    return parts
+
+
+def split_chunks(text: str, max_chars: int) -> List[Tuple[str, str]]:
+    """
+    Découpe un texte en morceaux alignés sur les paragraphes
+
+    Les paragraphes consécutifs sont regroupés tant que le morceau ne
+    dépasse pas max_chars. Un paragraphe plus long est découpé entre deux
+    phrases. Chaque morceau est renvoyé avec le séparateur qui le suit :
+    "".join(chunk + sep) redonne exactement le texte d'origine.
+    """
+    units: List[Tuple[str, str]] = []
+    for paragraph, separator in _split_keep(PARAGRAPH_BREAK, text):
+        if len(paragraph) <= max_chars:
+            units.append((paragraph, separator))
+            continue
+        sentences = _split_keep(SENTENCE_BREAK, paragraph)
+        sentences[-1] = (sentences[-1][0], separator)
+        units.extend(sentences)
+
+    chunks: List[Tuple[str, str]] = []
+    current, current_sep = "", ""
+    for unit, separator in units:
+        if current and len(current) + len(current_sep) + len(unit) > max_chars:
+            chunks.append((current, current_sep))
+            current, current_sep = unit, separator
+        else:
+            current, current_sep = current + current_sep + unit, separator
+    if current or not chunks:
+        chunks.append((current, current_sep))
+    return chunks
+
+
+def text_edits(original: str, revised: str) -> List[Dict[str, Any]]:
+    """
+    Liste des modifications pour passer de original à revised
+
+    Chaque modification remplace original[start:end] par replacement
+    (positions en caractères dans le texte d'origine). Appliquées de la
+    fin vers le début, elles redonnent le texte révisé.
+    """
+    source = _TOKENS.findall(original)
+    target = _TOKENS.findall(revised)
+    offsets = [0]
+    for token in source:
+        offsets.append(offsets[-1] + len(token))
+
+    edits = []
+    matcher = difflib.SequenceMatcher(None, source, target, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        edits.append({
+            "start": offsets[i1],
+            "end": offsets[i2],
+            "original": original[offsets[i1]:offsets[i2]],
+            "replacement": "".join(target[j1:j2])
+        })
+    return edits
+
+
+def _normalized(text: str) -> Tuple[str, List[int]]:
+    """
+    Forme normalisée du texte pour la recherche d'un passage
+
+    Minuscules, sans accents, guillemets et apostrophes typographiques
+    simplifiés, suites d'espaces réduites à une seule. Renvoie aussi, pour
+    chaque caractère normalisé, sa position dans le texte d'origine.
+    """
+    chars: List[str] = []
+    positions: List[int] = []
+    for index, char in enumerate(text):
+        if char.isspace():
+            if chars and chars[-1] == " ":
+                continue
+            chars.append(" ")
+            positions.append(index)
+            continue
+        decomposed = unicodedata.normalize("NFD", char.translate(_EQUIVALENTS))
+        for base in decomposed:
+            if not unicodedata.combining(base):
+                chars.append(base.lower())
+                positions.append(index)
+    return "".join(chars), positions
+
+
+def locate_passage(text: str, passage: str) -> Optional[Tuple[int, int]]:
+    """
+    Position (début, fin) d'un passage dans le texte
+
+    Le passage est d'abord cherché tel quel, puis sous forme normalisée
+    (espaces, accents, casse, typographie), ce qui tolère les différences
+    introduites par l'éditeur côté client. None si le passage est absent.
+    """
+    index = text.find(passage)
+    if index >= 0 and passage:
+        return index, index + len(passage)
+
+    normalized_text, positions = _normalized(text)
+    normalized_passage = _normalized(passage.strip())[0].strip()
+    if not normalized_passage:
+        return None
+    index = normalized_text.find(normalized_passage)
+    if index < 0:
+        return None
+    return positions[index], positions[index + len(normalized_passage) - 1] + 1
+
+
+def context_window(text: str, start: int, end: int, size: int, unit: str = "sentence") -> Tuple[str, str]:
+    """
+    Texte entourant text[start:end] : size phrases (ou paragraphes) avant et après
+
+    Les phrases dont le passage ne couvre qu'une partie sont complétées en
+    plus des size phrases de chaque côté.
+
+    Returns:
+        Tuple (contexte avant, contexte après)
+    """
+    pattern = PARAGRAPH_BREAK if unit == "paragraph" else SENTENCE_OR_PARAGRAPH_BREAK
+    # Débuts des phrases jusqu'à celle où commence le passage, fins à partir de celle où il se termine
+    starts = [0] + [match.end() for match in pattern.finditer(text, 0, start)]
+    ends = [match.start() for match in pattern.finditer(text, end)] + [len(text)]
+    window_start = starts[max(len(starts) - 1 - size, 0)]
+    window_end = ends[min(size, len(ends) - 1)]
+    return text[window_start:start], text[end:window_end]